@@ -1,55 +1,85 @@
-from flask import Flask, url_for
-from flask_migrate import Migrate
+from flask import Flask, url_for, g, jsonify, request
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from api.models import db, ma
+from api.unit_of_work import UnitOfWork
 from api.config import DevConfig, ProdConfig
 import os
 from api.routes.auth import auth_endpoint
 from api.routes.site import site_endpoint
-from flasgger import Swagger
+from api.routes.admin import admin_endpoint
+from api.routes.share import share_endpoint
+from api.commands import site_cli, openapi_cli
+from api import metrics
+from api.startup import init_swagger, LazyMigrateGroup
+from api.uploads import UploadRequest, check_content_length, too_large
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 if os.environ.get("FLASK_DEBUG") == "1":
     app.config.from_object(DevConfig)
 else:
     app.config.from_object(ProdConfig)
+if app.config["TRUSTED_PROXIES"]:
+    # Take the client address from X-Forwarded-For, set by this many proxies in front.
+    proxies = app.config["TRUSTED_PROXIES"]
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 db.init_app(app)
 ma.init_app(app)
-migrate = Migrate(app, db)
+app.cli.add_command(LazyMigrateGroup(db))
 jwt = JWTManager(app)
+metrics.init_app(app)
 
-template = {
-    "swagger": "2.0",
-    "info": {
-        "title": "docudir API Docs",
-        "version": "1.0"
-    },
-    "basePath": "/",  # base bash for blueprint registration
-    "schemes": [
-        "http",
-        "https"
-    ],
-    "securityDefinitions": {
-        "Bearer": {
-            "type": "apiKey",
-            "name": "Authorization",
-            "in": "header",
-            "description": "JWT Authorization header using the Bearer scheme. Example: \"Authorization: Bearer {token}\""
-        }
-    },
-    "security": [
-        {
-            "Bearer": []
-        }
-    ]
-}
-
-swagger = Swagger(app, template=template)
+swagger = init_swagger(app)
 
 app.register_blueprint(auth_endpoint)
 app.register_blueprint(site_endpoint)
+app.register_blueprint(admin_endpoint)
+app.register_blueprint(share_endpoint)
+app.cli.add_command(site_cli)
+app.cli.add_command(openapi_cli)
+
+app.before_request(check_content_length)
+
+@app.before_request
+def begin_unit_of_work():
+    g.unit_of_work = UnitOfWork(db.session)
+    # g outlives the request when an app context was already pushed, as in the CLI and tests.
+    g.pop("site_roles", None)
+    g.pop("site_shard", None)
+    g.pop("read_only", None)
+
+@app.after_request
+def finish_unit_of_work(response):
+    uow = g.pop("unit_of_work", None)
+    if uow is None:
+        return response
+    if response.status_code >= 400:
+        uow.rollback()
+        return response
+    try:
+        uow.commit()
+    except Exception:
+        app.logger.exception("Could not commit request")
+        response = jsonify({
+            "error": "Unknown error",
+            "message": "Unkown error occurred"
+        })
+        response.status_code = 500
+    return response
+
+@app.teardown_request
+def discard_unit_of_work(exc):
+    uow = g.pop("unit_of_work", None)
+    if uow is not None and not uow.done:
+        uow.rollback()
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return too_large(request.max_content_length)
 
 @app.route("/")
 def index():
@@ -0,0 +1,202 @@
+from flask import current_app, request, make_response, Response
+from flask_jwt_extended import get_jwt_identity
+from collections import OrderedDict
+from functools import wraps
+from api.models import db, Site, User, user_sites
+from api.routing import use_replica
+import sqlalchemy as sa
+import threading
+import hashlib
+import uuid
+import time
+
+class LRUCache:
+    """In-process cache backend. Versions live outside the LRU so they are never evicted."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                return None
+            expires, body = value
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl):
+        with self.lock:
+            self.items[key] = (time.monotonic() + ttl, body)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def get_versions(self, keys):
+        with self.lock:
+            return [self.versions.setdefault(key, time.time_ns()) for key in keys]
+
+    def incr(self, key):
+        with self.lock:
+            self.versions[key] = self.versions.get(key, time.time_ns()) + 1
+
+class RedisCache:
+    """Shared cache backend, so every worker sees the same versions."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points to redis but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, body, ttl):
+        self.client.set(key, body, ex=ttl)
+
+    def get_versions(self, keys):
+        if not keys:
+            return []
+        # A missing version starts from the clock, so a lost key can't resurrect old entries.
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.set(key, time.time_ns(), nx=True)
+        pipe.mget(keys)
+        return [int(v) for v in pipe.execute()[-1]]
+
+    def incr(self, key):
+        pipe = self.client.pipeline()
+        pipe.set(key, time.time_ns(), nx=True)
+        pipe.incr(key)
+        pipe.execute()
+
+class NoCache:
+    """Backend for CACHE_URL=none, every request goes to the route."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, body, ttl):
+        pass
+
+    def get_versions(self, keys):
+        return []
+
+    def incr(self, key):
+        pass
+
+def get_cache():
+    cache = current_app.extensions.get("response_cache")
+    if cache is None:
+        url = current_app.config.get("CACHE_URL", "memory://")
+        if url.startswith("redis"):
+            cache = RedisCache(url)
+        elif url == "none":
+            cache = NoCache()
+        else:
+            cache = LRUCache(current_app.config.get("CACHE_SIZE", 1024))
+        current_app.extensions["response_cache"] = cache
+    return cache
+
+def shared_backend(app):
+    """Whether every process sees the same cache, memory:// is only seen by the process that filled it."""
+    return not app.config.get("CACHE_URL", "memory://").startswith("memory")
+
+def site_key(site_id):
+    # GUID accepts any spelling of a UUID, the key must not depend on which one the client used.
+    return "version:site:{}".format(uuid.UUID(str(site_id)))
+
+def user_key(user_id):
+    return "version:user:{}".format(user_id)
+
+def cached_response(site_arg=None):
+    """Cache the JSON body of a read only route and answer conditional requests with 304.
+
+    Entries are keyed by route, site, user, query string and the version
+    counters they depend on. Writes bump the counters after commit, so an
+    entry is never served once its data changed. Without ``site_arg`` the
+    route depends on every site the user is a member of.
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            cache = get_cache()
+            if isinstance(cache, NoCache):
+                return fn(*args, **kwargs)
+            identity = get_jwt_identity()
+            if site_arg:
+                version_keys = [site_key(kwargs[site_arg])]
+            else:
+                version_keys = _user_version_keys(identity)
+            versions = cache.get_versions(version_keys)
+            key = "response:" + hashlib.sha1(repr((request.endpoint, sorted(kwargs.items()), identity,
+                                                   sorted(request.args.items(multi=True)), versions)).encode()).hexdigest()
+            etag = key[len("response:"):]
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                body = cache.get(key)
+                if body is not None:
+                    response = Response(body, mimetype="application/json")
+                else:
+                    response = make_response(fn(*args, **kwargs))
+                    if response.status_code != 200 or not response.is_json:
+                        return response
+                    if use_replica() and "replica" in db.engines:
+                        # The replica can lag behind the versions, a stale body must not pass for the current one.
+                        return response
+                    cache.set(key, response.get_data(), current_app.config.get("CACHE_TTL", 300))
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return decorator
+    return wrapper
+
+def _user_version_keys(identity):
+    rows = db.session.execute(sa.select(User.id, user_sites.c.site_id)
+                              .outerjoin(user_sites, user_sites.c.user_id == User.id)
+                              .where(User.email == identity)).all()
+    keys = [user_key(user_id) for user_id in {row[0] for row in rows}]
+    return keys + sorted(site_key(row[1]) for row in rows if row[1] is not None)
+
+@sa.event.listens_for(db.session, "after_flush")
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault("cache_invalidations", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Site):
+            changed.add(site_key(obj.id))
+            history = sa.inspect(obj).attrs.members.history
+            changed.update(user_key(user.id) for user in list(history.added) + list(history.deleted))
+        elif getattr(obj, "site_id", None) is not None:
+            changed.add(site_key(obj.site_id))
+
+@sa.event.listens_for(db.session, "after_commit")
+def _invalidate(session):
+    changed = session.info.pop("cache_invalidations", None)
+    if changed:
+        cache = get_cache()
+        for key in changed:
+            cache.incr(key)
+
+@sa.event.listens_for(db.session, "after_rollback")
+def _discard(session):
+    session.info.pop("cache_invalidations", None)
+
+def invalidate_site(site_id):
+    """Bump a site's version for writes that bypass the ORM, like bulk inserts."""
+    get_cache().incr(site_key(site_id))
+
+def invalidate_members(site_id, user_ids):
+    """Bump the versions a membership change affects, once the session commits."""
+    changed = db.session.info.setdefault("cache_invalidations", set())
+    changed.add(site_key(site_id))
+    changed.update(user_key(user_id) for user_id in user_ids)
@@ -0,0 +1,431 @@
+from flask import current_app
+from flask.cli import AppGroup
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from api.models import db, Site, SiteShard, Folder, File, FileVersion, Change
+from api.routing import DEFAULT_SHARD
+from api.unit_of_work import unit_of_work
+from api import storage
+from api.cache import invalidate_site
+from api.startup import build_docs_app
+from api import transfer
+from api import compression
+from api import versions
+from api import scrub
+from api import trees
+from api import sharding
+from api.serializers import dumps
+from api.sniffing import sniff, SNIFF_SIZE
+import sqlalchemy as sa
+import shortuuid
+import uuid
+import glob
+import itertools
+import click
+import json
+import os
+
+site_cli = AppGroup("site", help="Manage site contents from the command line.")
+openapi_cli = AppGroup("openapi", help="Build the OpenAPI spec.")
+
+def _get_site(site_id):
+    try:
+        site = db.session.get(Site, uuid.UUID(site_id))
+    except ValueError:
+        # Not a UUID, so not a site either.
+        site = None
+    if not site:
+        raise click.ClickException("Site {} not found".format(site_id))
+    return site
+
+@site_cli.command("import")
+@click.argument("site_id")
+@click.argument("source", type=click.Path(exists=True, file_okay=False))
+@click.option("--link/--copy", default=False, help="Hardlink blobs instead of copying them.")
+@click.option("--workers", default=os.cpu_count(), type=click.IntRange(min=1), show_default=True, help="Processes used to hash and copy blobs.")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows inserted per commit.")
+def import_tree(site_id, source, link, workers, batch_size):
+    """Import the directory tree SOURCE into a site.
+
+    Folder and file ids are derived from the site and relative path, so an
+    interrupted import can be started again and skips what is already there.
+    """
+    site = _get_site(site_id)
+    site_id = str(site.id)
+    sharding.use_site(site_id)
+    source = os.path.abspath(source)
+    destination = storage.site_path(site_id)
+    os.makedirs(destination, exist_ok=True)
+
+    folder_ids = _import_folders(site_id, source, batch_size)
+    click.echo("{} folders ready".format(len(folder_ids)))
+
+    imported = 0
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in _pending_files(site_id, source, folder_ids):
+            pending.append((task, executor.submit(storage.copy_blob, task["path"],
+                                                  os.path.join(destination, task["id"] + task["ext"]), link)))
+            if len(pending) >= workers * 16:
+                rows.append(_file_row(site_id, *pending.popleft()))
+            if len(rows) >= batch_size:
+                imported += _insert(File, rows)
+                click.echo("{} files imported".format(imported))
+        while pending:
+            rows.append(_file_row(site_id, *pending.popleft()))
+            if len(rows) >= batch_size:
+                imported += _insert(File, rows)
+        imported += _insert(File, rows)
+    trees.discard(site_id)
+    db.session.commit()
+    invalidate_site(site_id)
+    click.echo("Import complete, {} files imported".format(imported))
+
+def _import_folders(site_id, source, batch_size):
+    existing = set(db.session.scalars(sa.select(Folder.id).where(Folder.site_id == site_id)))
+    folder_ids = {".": None}
+    rows = []
+    for dirpath, dirnames, _ in os.walk(source):
+        dirnames.sort()
+        parent = os.path.relpath(dirpath, source)
+        for name in dirnames:
+            relpath = os.path.normpath(os.path.join(parent, name))
+            folder_id = shortuuid.uuid(name="{}/{}".format(site_id, relpath))
+            folder_ids[relpath] = folder_id
+            if folder_id not in existing:
+                rows.append(dict(id=folder_id, name=name, site_id=site_id, parent_id=folder_ids[parent]))
+            if len(rows) >= batch_size:
+                _insert(Folder, rows)
+    _insert(Folder, rows)
+    return folder_ids
+
+def _pending_files(site_id, source, folder_ids):
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        parent = os.path.relpath(dirpath, source)
+        folder_id = folder_ids[parent]
+        # One query per directory keeps resume cheap without loading the whole site.
+        existing = set(db.session.scalars(sa.select(File.id).where(File.site_id == site_id, File.folder_id == folder_id)))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if not os.path.isfile(path):
+                continue
+            file_id = shortuuid.uuid(name="{}/{}".format(site_id, os.path.normpath(os.path.join(parent, name))))
+            if file_id in existing:
+                continue
+            mimetype, ext = sniff(_read_head(path), name)
+            yield dict(id=file_id, name=name, ext=ext, mimetype=mimetype, folder_id=folder_id, path=path)
+
+def _file_row(site_id, task, future):
+    size, digest = future.result()
+    return dict(id=task["id"], name=task["name"], ext=task["ext"], mimetype=task["mimetype"],
+                size=size, hash=digest, site_id=site_id, folder_id=task["folder_id"], deleted=False)
+
+def _read_head(path, encoding=None):
+    head = b""
+    chunks = storage.read_blob(path, encoding)
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_SIZE:
+            break
+    chunks.close()
+    return head[:SNIFF_SIZE]
+
+def _insert(model, rows):
+    count = len(rows)
+    if rows:
+        db.session.execute(sa.insert(model), rows)
+        # Every batch is committed on its own, clients refetch the site on a reset.
+        Change.record(rows[0]["site_id"], "reset", rows[0]["site_id"])
+        db.session.commit()
+        rows.clear()
+    return count
+
+@site_cli.command("sniff")
+@click.argument("site_ids", nargs=-1)
+@click.option("--batch-size", default=1000, show_default=True, help="Files updated per commit.")
+@sharding.each_shard
+def sniff_files(site_ids, batch_size):
+    """Detect the mimetype and extension of stored files from their content.
+
+    Covers files uploaded before types were sniffed, in the given sites or
+    in all of them. Blobs whose extension changes are renamed, a run that
+    was interrupted can be started again.
+    """
+    last_id = ""
+    updated = 0
+    missing = 0
+    corrupt = 0
+    while True:
+        query = sa.select(File.id, File.name, File.ext, File.mimetype, File.encoding, File.site_id).where(File.id > last_id)
+        if site_ids:
+            query = query.where(File.site_id.in_(site_ids))
+        rows = db.session.execute(query.order_by(File.id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = []
+        for row in rows:
+            folder = storage.site_path(row.site_id)
+            suffix = compression.SUFFIXES.get(row.encoding, "")
+            path = os.path.join(folder, storage.blob_name(row))
+            if not os.path.exists(path):
+                # An earlier run may have renamed the blob without committing the row.
+                found = glob.glob(os.path.join(glob.escape(folder), glob.escape(row.id) + ".*" + glob.escape(suffix)))
+                if len(found) != 1:
+                    missing += 1
+                    continue
+                path = found[0]
+            try:
+                mimetype, ext = sniff(_read_head(path, row.encoding), row.name)
+            except compression.DECODE_ERRORS as e:
+                click.echo("Skipping {}, blob can't be decoded: {}".format(row.id, e), err=True)
+                corrupt += 1
+                continue
+            blob = row.id + ext + suffix
+            if (mimetype, ext) == (row.mimetype, row.ext) and os.path.basename(path) == blob:
+                continue
+            os.rename(path, os.path.join(folder, blob))
+            changes.append(dict(file_id=row.id, site_id=row.site_id, ext=ext, mimetype=mimetype))
+        if changes:
+            db.session.execute(sa.update(File.__table__).where(File.id == sa.bindparam("file_id"))
+                               .values(ext=sa.bindparam("ext"), mimetype=sa.bindparam("mimetype")),
+                               [dict(file_id=c["file_id"], ext=c["ext"], mimetype=c["mimetype"]) for c in changes])
+            db.session.commit()
+            for site_id in {str(c["site_id"]) for c in changes}:
+                invalidate_site(site_id)
+            updated += len(changes)
+            click.echo("{} files updated".format(updated))
+    click.echo("Sniffing complete, {} files updated, {} blobs missing, {} corrupt".format(updated, missing, corrupt))
+
+@site_cli.command("compress")
+@click.argument("site_ids", nargs=-1)
+@click.option("--encoding", type=click.Choice(["gzip", "zstd", "none"]), help="Defaults to BLOB_COMPRESSION, none stores blobs uncompressed.")
+@click.option("--level", type=int, help="Compression level, defaults to BLOB_COMPRESSION_LEVEL.")
+@click.option("--workers", default=1, type=click.IntRange(min=1), show_default=True, help="Processes compressing blobs, at low priority.")
+@click.option("--batch-size", default=100, show_default=True, help="Files updated per commit.")
+@sharding.each_shard
+def compress_files(site_ids, encoding, level, workers, batch_size):
+    """Store existing blobs of compressible types with another encoding.
+
+    Meant to run next to the API, the workers are niced and every batch is
+    committed before the old blobs are removed, so downloads keep working
+    and an interrupted run can be started again.
+    """
+    encoding = encoding or current_app.config.get("BLOB_COMPRESSION") or "none"
+    encoding = None if encoding == "none" else encoding
+    if level is None:
+        level = current_app.config.get("BLOB_COMPRESSION_LEVEL")
+    if encoding:
+        pending = sa.and_(sa.or_(File.encoding.is_(None), File.encoding != encoding),
+                          sa.or_(*[File.mimetype.startswith(prefix) for prefix in compression.COMPRESSIBLE_TYPES]))
+    else:
+        pending = File.encoding.isnot(None)
+    last_id = ""
+    done = 0
+    missing = 0
+    corrupt = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=os.nice, initargs=(10,)) as executor:
+        while True:
+            query = sa.select(File).where(File.id > last_id, File.deleted == False, pending)
+            if site_ids:
+                query = query.where(File.site_id.in_(site_ids))
+            files = db.session.scalars(query.order_by(File.id).limit(batch_size)).all()
+            if not files:
+                break
+            last_id = files[-1].id
+            jobs = []
+            for file in files:
+                folder = storage.site_path(file.site_id)
+                old_name = storage.blob_name(file)
+                new_name = file.id + (file.ext or "") + compression.SUFFIXES.get(encoding, "")
+                jobs.append((file, os.path.join(folder, old_name), executor.submit(
+                    compression.recode_file, os.path.join(folder, old_name), os.path.join(folder, new_name),
+                    file.encoding, encoding, level)))
+            old_paths = []
+            for file, old_path, job in jobs:
+                try:
+                    job.result()
+                except OSError as e:
+                    click.echo("Skipping {}: {}".format(file.id, e), err=True)
+                    missing += 1
+                    continue
+                except compression.DECODE_ERRORS as e:
+                    # A corrupt blob is left as is for flask site scrub --verify to report.
+                    click.echo("Skipping {}, blob can't be decoded: {}".format(file.id, e), err=True)
+                    corrupt += 1
+                    continue
+                file.encoding = encoding
+                old_paths.append(old_path)
+            db.session.commit()
+            for old_path in old_paths:
+                os.remove(old_path)
+            done += len(old_paths)
+            click.echo("{} files recompressed".format(done))
+    click.echo("Compression complete, {} files recompressed, {} blobs missing, {} corrupt".format(done, missing, corrupt))
+
+@site_cli.command("hash")
+@click.argument("site_ids", nargs=-1)
+@click.option("--workers", default=os.cpu_count(), type=click.IntRange(min=1), show_default=True, help="Processes hashing blobs, at low priority.")
+@click.option("--batch-size", default=1000, show_default=True, help="Files updated per commit.")
+@sharding.each_shard
+def hash_files(site_ids, workers, batch_size):
+    """Store the sha256 of files uploaded before hashes were kept.
+
+    Only files without a hash are read, so an interrupted run can be
+    started again. Blobs that are missing are skipped and counted.
+    """
+    last_id = ""
+    hashed = 0
+    missing = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=os.nice, initargs=(10,)) as executor:
+        while True:
+            query = sa.select(File.id, File.ext, File.encoding, File.site_id) \
+                .where(File.id > last_id, File.hash.is_(None), File.deleted == False)
+            if site_ids:
+                query = query.where(File.site_id.in_(site_ids))
+            rows = db.session.execute(query.order_by(File.id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            jobs = [(row, executor.submit(storage.hash_blob, os.path.join(storage.site_path(row.site_id), storage.blob_name(row)),
+                                          row.encoding)) for row in rows]
+            changes = []
+            for row, job in jobs:
+                try:
+                    size, digest = job.result()
+                except OSError:
+                    missing += 1
+                    continue
+                changes.append(dict(file_id=row.id, size=size, hash=digest))
+            if changes:
+                db.session.execute(sa.update(File.__table__).where(File.id == sa.bindparam("file_id"))
+                                   .values(size=sa.bindparam("size"), hash=sa.bindparam("hash")), changes)
+                db.session.commit()
+                for site_id in {str(row.site_id) for row in rows}:
+                    invalidate_site(site_id)
+            hashed += len(changes)
+            click.echo("{} files hashed".format(hashed))
+    click.echo("Hashing complete, {} files hashed, {} blobs missing".format(hashed, missing))
+
+@site_cli.command("pack-versions")
+@click.argument("site_ids", nargs=-1)
+@sharding.each_shard
+def pack_versions(site_ids):
+    """Store file versions that were too large to pack on upload as shared chunks."""
+    query = sa.select(FileVersion, File.site_id).join(File, File.id == FileVersion.file_id).where(FileVersion.packed == False)
+    if site_ids:
+        query = query.where(File.site_id.in_(site_ids))
+    packed = 0
+    for version, site_id in db.session.execute(query.order_by(FileVersion.id)).all():
+        with unit_of_work(db.session):
+            versions.pack(site_id, version)
+        packed += 1
+        click.echo("{} versions packed".format(packed))
+    click.echo("Packing complete, {} versions packed".format(packed))
+
+@site_cli.command("scrub")
+@click.argument("site_ids", nargs=-1)
+@click.option("--repair", is_flag=True, help="Fix what can be fixed instead of only reporting it.")
+@click.option("--verify", is_flag=True, help="Hash every blob instead of only comparing sizes.")
+@click.option("--workers", default=1, type=click.IntRange(min=1), show_default=True, help="Processes hashing blobs with --verify, at low priority.")
+@click.option("--rate", default=0, show_default=True, help="Bytes per second all workers read together, 0 for no limit.")
+@click.option("--grace", default=3600, show_default=True, help="Seconds a blob without a row is taken for an upload in flight.")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows fetched and repaired per commit.")
+def scrub_files(site_ids, repair, verify, workers, rate, grace, batch_size):
+    """Report blobs and file rows that don't match, and fix them with --repair.
+
+    Meant to run next to the API: blobs are only read, hashing is niced and
+    can be throttled with --rate, and repairs move blobs to the trash
+    instead of removing them. Without SITE_IDS upload parts older than
+    --grace, left by workers that died, are reported and removed with
+    --repair. Exits with 1 when issues remain.
+    """
+    if site_ids:
+        sites = [site.id for site in db.session.scalars(sa.select(Site).where(Site.id.in_(site_ids)))]
+        if len(sites) != len(site_ids):
+            raise click.ClickException("Site not found")
+    else:
+        sites = db.session.scalars(sa.select(Site.id).order_by(Site.id)).all()
+    counts = {}
+    remaining = 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=os.nice, initargs=(10,)) if verify else None
+    try:
+        issues = itertools.chain(() if site_ids else scrub.unknown_sites(sites),
+                                 () if site_ids else scrub.stale_parts(grace, repair),
+                                 *(_scrub_on_shard(site_id, executor, repair, rate // workers, grace, batch_size)
+                                   for site_id in sites))
+        for issue in issues:
+            click.echo("{} {}/{}: {}{}".format(issue.kind, issue.site_id, issue.name, issue.detail,
+                                               " (repaired)" if issue.repaired else ""))
+            counts[issue.kind] = counts.get(issue.kind, 0) + 1
+            remaining += not issue.repaired
+    finally:
+        if executor:
+            executor.shutdown()
+    click.echo("Scrub complete, {} sites, {} issues{}".format(
+        len(sites), sum(counts.values()),
+        "".join(", {} {}".format(n, kind) for kind, n in sorted(counts.items()))))
+    if remaining:
+        raise SystemExit(1)
+
+def _scrub_on_shard(site_id, *args):
+    with sharding.using(sharding.shard_of(site_id)[0]):
+        yield from scrub.scrub_site(site_id, *args)
+
+@site_cli.command("export")
+@click.argument("site_id")
+@click.argument("output", type=click.File("wb"), default="-")
+def export_site(site_id, output):
+    """Write the metadata of a site to OUTPUT as NDJSON, stdout by default."""
+    _get_site(site_id)
+    sharding.use_site(site_id)
+    for row in transfer.export_site(site_id):
+        output.write(dumps(row) + b"\n")
+
+@site_cli.command("load")
+@click.argument("site_id")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--new-ids", is_flag=True, help="Give every folder and file a new id, to load next to the original site.")
+def load_site(site_id, source, new_ids):
+    """Load folders and files exported with ``flask site export`` into a site.
+
+    Blobs are not part of an export, copy the site's data folder separately.
+    """
+    site = _get_site(site_id)
+    sharding.use_site(site.id)
+    counts = transfer.load_site(str(site.id), source, new_ids)
+    click.echo("Loaded {folder} folders and {file} files".format(**counts))
+
+@site_cli.command("shards")
+def list_shards():
+    """List the shards from SITE_SHARDS with the number of sites on each."""
+    counts = dict(db.session.execute(sa.select(SiteShard.shard, sa.func.count()).group_by(SiteShard.shard)).all())
+    total = db.session.scalar(sa.select(sa.func.count()).select_from(Site))
+    for shard in sharding.shard_names():
+        count = total - sum(counts.values()) if shard == DEFAULT_SHARD else counts.get(shard, 0)
+        click.echo("{} {} sites".format(shard, count))
+
+@site_cli.command("move")
+@click.argument("site_id")
+@click.argument("shard")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows copied per insert.")
+def move_site(site_id, shard, batch_size):
+    """Move the folders and files of a site to SHARD.
+
+    Writes to the site get a 503 until the copy is done, reads go on from
+    the old shard. Run again to finish a move that was interrupted.
+    """
+    site = _get_site(site_id)
+    if shard not in sharding.shard_names():
+        raise click.ClickException("Shard {} not found, shards are set with SITE_SHARDS".format(shard))
+    copied = sharding.move_site(site.id, shard, batch_size, echo=click.echo)
+    click.echo("Move complete, {} rows copied to {}".format(copied, shard))
+
+@openapi_cli.command("dump")
+@click.argument("output", type=click.File("w"))
+def dump_openapi(output):
+    """Write the OpenAPI spec to OUTPUT, to be served with SWAGGER_MODE=static."""
+    docs = build_docs_app(current_app._get_current_object())
+    json.dump(docs.test_client().get("/apispec_1.json").get_json(), output, indent=2)
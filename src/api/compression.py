@@ -0,0 +1,103 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Raised while decoding a corrupt blob.
+DECODE_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Suffix added to the blob name of an encoded file, by Content-Encoding.
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Office Open XML and OpenDocument files are zip archives already, only the
+# old binary Office formats gain from compression.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/rtf",
+    "application/postscript",
+    "application/x-sh",
+    "application/x-yaml",
+    "application/msword",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+    "application/vnd.sqlite3",
+    "image/svg+xml",
+    "image/bmp",
+)
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def choose_encoding(config, mimetype):
+    """Return the encoding to store a file of ``mimetype`` with, or None to store it as is."""
+    encoding = config.get("BLOB_COMPRESSION")
+    if encoding and is_compressible(mimetype):
+        return encoding
+    return None
+
+def _zstandard():
+    if zstandard is None:
+        raise RuntimeError("BLOB_COMPRESSION is zstd but the zstandard package is not installed")
+    return zstandard
+
+def compressor(encoding, level=None):
+    """Return an object with ``compress(data)`` and ``flush()`` writing ``encoding``."""
+    if encoding == "gzip":
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+    if encoding == "zstd":
+        return _zstandard().ZstdCompressor(level=3 if level is None else level).compressobj()
+    raise ValueError("Unknown encoding {}".format(encoding))
+
+def decompressor(encoding):
+    if encoding == "gzip":
+        return zlib.decompressobj(31)
+    if encoding == "zstd":
+        return _zstandard().ZstdDecompressor().decompressobj()
+    raise ValueError("Unknown encoding {}".format(encoding))
+
+def decompress_file(path, encoding, chunk_size=1024 * 1024):
+    """Yield the decoded content of the blob at ``path`` chunk by chunk."""
+    decoder = decompressor(encoding)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            data = decoder.decompress(chunk)
+            if data:
+                yield data
+    if hasattr(decoder, "flush"):
+        data = decoder.flush()
+        if data:
+            yield data
+
+def recode_file(source, destination, from_encoding, to_encoding, level=None, chunk_size=1024 * 1024):
+    """Write ``source`` stored with ``from_encoding`` to ``destination`` with ``to_encoding``.
+
+    Either encoding can be None for raw bytes. Runs in worker processes, so
+    it must not touch the app context.
+    """
+    encoder = compressor(to_encoding, level) if to_encoding else None
+    if from_encoding:
+        chunks = decompress_file(source, from_encoding, chunk_size)
+    else:
+        chunks = _read_chunks(source, chunk_size)
+    try:
+        with open(destination, "wb") as dst:
+            for chunk in chunks:
+                dst.write(encoder.compress(chunk) if encoder else chunk)
+            if encoder:
+                dst.write(encoder.flush())
+    except Exception:
+        # Don't leave half a blob next to the original.
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+def _read_chunks(path, chunk_size):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
@@ -1,30 +1,91 @@
 from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity
-from flask import jsonify
+from flask import jsonify, g, request
 from functools import wraps
-import sys
-import inspect
-from api.models import User, Site
+from api.models import db, User, Site, SiteShard, user_sites, SITE_ROLES
+from api.routing import DEFAULT_SHARD
+from api import sharding
+import sqlalchemy as sa
+import uuid
 
-def check_site_permissions(site_id):
+def check_site_permissions(site_id, role="read"):
+    """Require the current user to have at least ``role`` on the site in the ``site_id`` route argument."""
     def wrapper(fn):
         @wraps(fn)
         def decorator(*args, **kwargs):
             if (site_id in kwargs):
-                print(kwargs[site_id])
                 verify_jwt_in_request()
-                current_user = User.find_by_email(get_jwt_identity())
-                site = Site.query.filter(Site.id==kwargs[site_id], Site.members.any(id=current_user.id)).first()
-                if site:
-                    return fn(*args, **kwargs)
-                else:
+                current_role, shard, state = site_access(kwargs[site_id])
+                if current_role is None:
                     return jsonify({
                         "error": "Not found",
                         "message": "Site not found"
                     }), 404
+                if SITE_ROLES[current_role] < SITE_ROLES[role]:
+                    return jsonify({
+                        "error": "Forbidden",
+                        "message": "Requires {} access to this site".format(role)
+                    }), 403
+                writes = request.method not in ("GET", "HEAD", "OPTIONS")
+                if writes and (state != "active" or not sharding.hold_site(kwargs[site_id], shard)):
+                    response = jsonify({
+                        "error": "Service unavailable",
+                        "message": "Site is being moved, try again shortly"
+                    })
+                    response.headers["Retry-After"] = "30"
+                    return response, 503
+                g.site_shard = shard
+                # One spelling of the site id for the route, its cache keys and change notifications.
+                kwargs[site_id] = str(uuid.UUID(str(kwargs[site_id])))
+                return fn(*args, **kwargs)
             else:
                 return jsonify({
                     "error": "Unknown error",
                     "message": "Unkown error occurred"
                 }), 500
         return decorator
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def site_access(site_id):
+    """Return the current user's role on a site with the site's shard and its state.
+
+    One query on the unique (user_id, site_id) index whatever the number of
+    members, remembered for the rest of the request. The role is None when
+    the user isn't a member.
+    """
+    access = g.setdefault("site_roles", {})
+    if site_id not in access:
+        try:
+            uuid.UUID(str(site_id))
+        except ValueError:
+            # Not a UUID, so not a site either.
+            access[site_id] = (None, DEFAULT_SHARD, "active")
+            return access[site_id]
+        row = db.session.execute(sa.select(user_sites.c.permission, SiteShard.shard, SiteShard.state)
+                                 .join(User, User.id == user_sites.c.user_id)
+                                 .outerjoin(SiteShard, SiteShard.site_id == user_sites.c.site_id)
+                                 .where(User.email == get_jwt_identity(), user_sites.c.site_id == site_id)).first()
+        if row is None or row.permission not in SITE_ROLES:
+            access[site_id] = (None, DEFAULT_SHARD, "active")
+        else:
+            access[site_id] = (row.permission, row.shard or DEFAULT_SHARD, row.state or "active")
+    return access[site_id]
+
+def read_only(fn):
+    """Mark a route as read only so its queries can be served by the replica."""
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        g.read_only = True
+        return fn(*args, **kwargs)
+    return decorator
+
+def admin_required(fn):
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        verify_jwt_in_request()
+        if get_jwt().get("role") != "admin":
+            return jsonify({
+                "error": "Forbidden",
+                "message": "Administrator access required"
+            }), 403
+        return fn(*args, **kwargs)
+    return decorator
\ No newline at end of file
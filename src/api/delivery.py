@@ -0,0 +1,28 @@
+from flask import request, current_app, send_from_directory, abort, Response
+from api import storage, compression
+import os
+
+def send_blob(site_id, file):
+    """Send the content of ``file``, compressed as stored when the client accepts it."""
+    folder = os.path.join(os.getcwd(), current_app.config["DATA_FOLDER"], str(site_id))
+    if not file.encoding:
+        return send_from_directory(folder, storage.blob_name(file), mimetype=file.mimetype)
+    # Ranges are over the decoded content, clients don't expect them to address compressed bytes.
+    if request.accept_encodings[file.encoding] and not request.range:
+        response = send_from_directory(folder, storage.blob_name(file), mimetype=file.mimetype)
+        response.headers["Content-Encoding"] = file.encoding
+    else:
+        path = os.path.join(folder, storage.blob_name(file))
+        if not os.path.isfile(path):
+            abort(404)
+        response = send_content(compression.decompress_file(path, file.encoding), file.mimetype, file.size, file.hash or file.id)
+    response.vary.add("Accept-Encoding")
+    return response
+
+def send_content(content, mimetype, size, etag):
+    """Stream decoded content, answering conditional and range requests over it."""
+    response = Response(content, mimetype=mimetype, direct_passthrough=True)
+    response.set_etag(etag)
+    if size is not None:
+        response.content_length = size
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
@@ -0,0 +1,65 @@
+from api.models import db, File
+from api import sharding
+import sqlalchemy as sa
+import heapq
+
+def duplicate_groups(*criteria, limit=100):
+    """Return files with the same content among the ones matching ``criteria``, largest savings first.
+
+    Each group has the hash, the number of copies, the bytes of content that
+    keeping one copy would reclaim and the files. Removed files and files
+    without a hash yet are left out.
+    """
+    criteria += (File.deleted == False, File.hash.isnot(None))
+    reclaimable = (sa.func.sum(File.size) - sa.func.max(File.size)).label("reclaimable")
+    groups = db.session.execute(sa.select(File.hash, sa.func.count().label("copies"), reclaimable)
+                                .where(*criteria)
+                                .group_by(File.hash)
+                                .having(sa.func.count() > 1)
+                                .order_by(reclaimable.desc(), File.hash)
+                                .limit(limit)).all()
+    if not groups:
+        return []
+    files = _files(criteria, [g.hash for g in groups])
+    return [{"hash": g.hash, "copies": g.copies, "reclaimable": g.reclaimable or 0, "files": files.get(g.hash, [])}
+            for g in groups]
+
+def sharded_duplicate_groups(*criteria, limit=100):
+    """Like ``duplicate_groups`` over every shard, with copies on different shards in the same group.
+
+    Each shard only sums up its files by hash, the groups are made once the
+    sums of all shards are added up, so a hash with one copy per shard is
+    found and a hash copied on several shards counts all of its copies.
+    """
+    criteria += (File.deleted == False, File.hash.isnot(None))
+    shards = sharding.shard_names()
+    sums = {}
+    for shard in shards:
+        with sharding.using(shard):
+            rows = db.session.execute(sa.select(File.hash, sa.func.count(), sa.func.sum(File.size), sa.func.max(File.size))
+                                      .where(*criteria).group_by(File.hash))
+            for hash, copies, total, largest in rows:
+                seen = sums.get(hash, (0, 0, 0))
+                sums[hash] = (seen[0] + copies, seen[1] + (total or 0), max(seen[2], largest or 0))
+    groups = heapq.nsmallest(limit, ((hash, copies, total - largest) for hash, (copies, total, largest) in sums.items()
+                                     if copies > 1), key=lambda g: (-g[2], g[0]))
+    if not groups:
+        return []
+    files = {}
+    for shard in shards:
+        with sharding.using(shard):
+            for hash, found in _files(criteria, [g[0] for g in groups]).items():
+                files.setdefault(hash, []).extend(found)
+    return [{"hash": hash, "copies": copies, "reclaimable": reclaimable,
+             "files": sorted(files.get(hash, []), key=lambda f: (f["site_id"], f["folder_id"] or "", f["id"]))}
+            for hash, copies, reclaimable in groups]
+
+def _files(criteria, hashes):
+    files = {}
+    rows = db.session.execute(sa.select(File.hash, File.id, File.site_id, File.folder_id, File.name, File.size)
+                              .where(*criteria, File.hash.in_(hashes))
+                              .order_by(File.site_id, File.folder_id, File.id))
+    for hash, id, site_id, folder_id, name, size in rows:
+        files.setdefault(hash, []).append({"id": id, "site_id": str(site_id), "folder_id": folder_id,
+                                           "name": name, "size": size})
+    return files
@@ -0,0 +1,117 @@
+from flask import current_app
+from api.models import db, Change
+import sqlalchemy as sa
+import threading
+import uuid
+import select
+import time
+
+CHANNEL = "docudir_changes"
+
+def _key(site_id):
+    # The same site whatever spelling of its UUID the writer or the waiter was given.
+    return str(uuid.UUID(str(site_id)))
+
+class InProcessBroker:
+    """Wakes waiters in this process when a site gets a new change."""
+
+    def __init__(self):
+        self.latest = {}
+        self.condition = threading.Condition()
+
+    def publish(self, site_id, seq):
+        with self.condition:
+            site_id = _key(site_id)
+            self.latest[site_id] = max(self.latest.get(site_id, 0), seq)
+            self.condition.notify_all()
+
+    def wait(self, site_id, after, timeout):
+        """Block until the site has a change newer than ``after``, returns False on timeout."""
+        site_id = _key(site_id)
+        with self.condition:
+            return self.condition.wait_for(lambda: self.latest.get(site_id, 0) > after, timeout)
+
+class PostgresBroker:
+    """Fans changes out to every worker through PostgreSQL LISTEN/NOTIFY.
+
+    The listening connection is opened on first use, so it is never shared
+    across a fork.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.local = InProcessBroker()
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def publish(self, site_id, seq):
+        with self.engine.connect() as conn:
+            conn.execute(sa.text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": CHANNEL, "payload": "{}:{}".format(site_id, seq)})
+            conn.commit()
+
+    def wait(self, site_id, after, timeout):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self._listen, args=(current_app.logger,), daemon=True)
+                self.listener.start()
+        return self.local.wait(site_id, after, timeout)
+
+    def _listen(self, logger):
+        import psycopg2
+        import psycopg2.extensions
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute("LISTEN " + CHANNEL)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        site_id, seq = conn.notifies.pop(0).payload.split(":")
+                        self.local.publish(site_id, int(seq))
+            except Exception:
+                logger.exception("Change listener lost its connection, reconnecting")
+                time.sleep(1)
+
+def get_broker():
+    broker = current_app.extensions.get("change_broker")
+    if broker is None:
+        if current_app.config.get("EVENTS_BROKER", "memory") == "postgres":
+            broker = PostgresBroker(db.engine)
+        else:
+            broker = InProcessBroker()
+        current_app.extensions["change_broker"] = broker
+    return broker
+
+def stream_slots():
+    """Return the semaphore counting this worker's requests that wait for changes.
+
+    SSE streams and long-polls hold a worker thread for as long as they
+    wait, EVENTS_MAX_STREAMS keeps some threads for the rest of the API.
+    """
+    slots = current_app.extensions.get("change_stream_slots")
+    if slots is None:
+        slots = threading.BoundedSemaphore(current_app.config.get("EVENTS_MAX_STREAMS", 2))
+        current_app.extensions["change_stream_slots"] = slots
+    return slots
+
+@sa.event.listens_for(db.session, "after_flush")
+def _collect_changes(session, flush_context):
+    published = session.info.setdefault("published_changes", [])
+    published.extend((obj.site_id, obj.seq) for obj in session.new if isinstance(obj, Change))
+
+@sa.event.listens_for(db.session, "after_commit")
+def _publish(session):
+    published = session.info.pop("published_changes", None)
+    if published:
+        broker = get_broker()
+        for site_id, seq in published:
+            broker.publish(site_id, seq)
+
+@sa.event.listens_for(db.session, "after_rollback")
+def _discard(session):
+    session.info.pop("published_changes", None)
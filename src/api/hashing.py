@@ -0,0 +1,75 @@
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+
+class HasherBusy(Exception):
+    """Raised when more hashes are waiting than PASSWORD_HASH_QUEUE allows."""
+
+class PasswordHasher:
+    """Run password hashing in worker processes so it can't starve request threads.
+
+    The pool is started on first use, after gunicorn has forked. At most
+    ``workers + queue`` hashes are in flight, beyond that callers get
+    ``HasherBusy`` straight away instead of queueing without bound. With
+    no workers hashing runs inline.
+    """
+
+    def __init__(self, method, salt_length=16, workers=0, queue=0):
+        self.method = method
+        self.salt_length = salt_length
+        self.prefix = None
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue) if workers else None
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password, hash):
+        return self._run(check_password_hash, hash, password)
+
+    def needs_rehash(self, hash):
+        """Whether ``hash`` was made with another method or cost than the configured one."""
+        if self.prefix is None:
+            # werkzeug fills in defaults, pbkdf2:sha256 is stored as pbkdf2:sha256:<iterations>.
+            self.prefix = generate_password_hash("", self.method, self.salt_length).split("$", 1)[0]
+        return hash.split("$", 1)[0] != self.prefix
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return self._submit(fn, *args).result()
+
+    def _submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def _get_executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    # Forking a threaded worker can copy held locks, start clean interpreters instead.
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+def get_hasher():
+    hasher = current_app.extensions.get("password_hasher")
+    if hasher is None:
+        config = current_app.config
+        hasher = PasswordHasher(config.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000"),
+                                config.get("PASSWORD_SALT_LENGTH", 16),
+                                config.get("PASSWORD_HASH_WORKERS", 0),
+                                config.get("PASSWORD_HASH_QUEUE", 0))
+        current_app.extensions["password_hasher"] = hasher
+    return hasher
@@ -0,0 +1,148 @@
+from flask import g, request, has_app_context, Response
+from sqlalchemy.engine import Engine
+from functools import wraps
+from api.pool import pool_status
+from api.models import db
+import sqlalchemy as sa
+import threading
+import hmac
+import time
+import os
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, extra=()):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append("{}{} {}".format(self.name, _labels(key + extra), value))
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, extra=()):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                key += extra
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append("{}_bucket{} {}".format(self.name, _labels(key + (("le", bound),)), bucket))
+                lines.append("{}_bucket{} {}".format(self.name, _labels(key + (("le", "+Inf"),)), count))
+                lines.append("{}_sum{} {}".format(self.name, _labels(key), total))
+                lines.append("{}_count{} {}".format(self.name, _labels(key), count))
+        return lines
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in key) + "}"
+
+request_duration = Histogram("docudir_request_duration_seconds", "Time spent handling a request.")
+request_queries = Histogram("docudir_request_queries", "SQL queries executed per request.", COUNT_BUCKETS)
+request_query_duration = Histogram("docudir_request_query_duration_seconds", "Time spent in SQL per request.")
+request_bytes = Counter("docudir_request_bytes_total", "Request and response body bytes.")
+query_budget_exceeded = Counter("docudir_query_budget_exceeded_total", "Requests that ran more queries than QUERY_BUDGET.")
+fs_duration = Histogram("docudir_fs_operation_duration_seconds", "Time spent in filesystem operations.")
+rate_limited = Counter("docudir_rate_limited_total", "Requests rejected by a rate limit.")
+
+def timed(operation):
+    """Record the duration of a filesystem operation."""
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                fs_duration.observe(time.perf_counter() - start, operation=operation)
+        return decorator
+    return wrapper
+
+def init_app(app):
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "metrics_start" not in g:
+            return response
+        route = request.endpoint or "unmatched"
+        request_duration.observe(time.perf_counter() - g.metrics_start,
+                                 route=route, method=request.method, status=response.status_code)
+        request_queries.observe(g.query_count, route=route)
+        request_query_duration.observe(g.query_time, route=route)
+        request_bytes.inc(request.content_length or 0, route=route, direction="in")
+        request_bytes.inc(response.content_length or 0, route=route, direction="out")
+        budget = app.config.get("QUERY_BUDGET", 20)
+        if g.query_count > budget:
+            query_budget_exceeded.inc(route=route)
+            app.logger.warning("%s %s ran %d queries, more than the budget of %d; possible N+1",
+                               request.method, request.path, g.query_count, budget)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        """Serve the metrics of this worker to a scraper holding METRICS_TOKEN, off without one."""
+        token = app.config.get("METRICS_TOKEN")
+        if not token or not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + token):
+            return Response(status=404)
+        # Counters are per worker process, the pid tells the series of each worker apart.
+        worker = (("pid", os.getpid()),)
+        lines = []
+        for metric in (request_duration, request_queries, request_query_duration, request_bytes,
+                       query_budget_exceeded, fs_duration, rate_limited):
+            lines.extend(metric.render(worker))
+        lines.extend(_render_pool(pool_status(db.engines), worker))
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+def _render_pool(status, extra=()):
+    lines = []
+    for field in ("size", "checked_out", "overflow", "checkouts", "waits", "wait_seconds", "timeouts"):
+        name = "docudir_db_pool_" + field
+        lines.append("# TYPE {} {}".format(name, "counter" if field in ("checkouts", "waits", "wait_seconds", "timeouts") else "gauge"))
+        for bind, info in sorted(status.items()):
+            if field in info:
+                lines.append("{}{} {}".format(name, _labels((("bind", bind),) + extra), info[field]))
+    return lines
+
+@sa.event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+@sa.event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "query_count" in g:
+        g.query_count += 1
+        g.query_time += time.perf_counter() - conn.info["query_start"]
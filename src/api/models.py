@@ -1,50 +1,153 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow, fields
 import uuid
-from werkzeug.security import generate_password_hash, check_password_hash
+from api.hashing import get_hasher
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator, CHAR
 import shortuuid
+import datetime
+import sqlalchemy as sa
+from api.routing import RoutingSession
+from api.unit_of_work import current_unit_of_work
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 ma = Marshmallow()
 
+class GUID(TypeDecorator):
+    """Native UUID on PostgreSQL and CHAR(32) elsewhere, so the models also run on SQLite."""
+    impl = CHAR
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=True))
+        return dialect.type_descriptor(CHAR(32))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return value if dialect.name == "postgresql" else value.hex
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
+
 user_sites = db.Table("user_sites", 
                         db.Column("user_id", db.Integer, db.ForeignKey("users.id")),
-                        db.Column("site_id", UUID(as_uuid=True), db.ForeignKey("sites.id")),
-                        db.Column("permission", db.String, default="owner"))
+                        db.Column("site_id", GUID(), db.ForeignKey("sites.id")),
+                        db.Column("permission", db.String, default="owner"),
+                        db.Index("ix_user_sites_user_id_site_id", "user_id", "site_id", unique=True),
+                        db.Index("ix_user_sites_site_id", "site_id"))
+
+# Roles a member can have on a site, each allows what the ones below it do.
+# The creator of a site is its owner, which is an admin that can't be removed.
+SITE_ROLES = {"read": 1, "write": 2, "admin": 3, "owner": 3}
+
+def roles_at_least(role):
+    return [name for name, level in SITE_ROLES.items() if level >= SITE_ROLES[role]]
 
 class File(db.Model):
     __tablename__ = "files"
+    __table_args__ = (db.Index("ix_files_site_id_mimetype", "site_id", "mimetype",
+                               postgresql_ops={"mimetype": "text_pattern_ops"}),
+                      db.Index("ix_files_site_id_hash", "site_id", "hash"),
+                      db.Index("ix_files_hash", "hash"))
     id = db.Column(db.String, primary_key=True, default=shortuuid.uuid)
     name = db.Column(db.String, nullable=False)
     ext = db.Column(db.String)
     mimetype = db.Column(db.String)
     size = db.Column(db.Integer)
-    site_id = db.Column(UUID(as_uuid=True), db.ForeignKey("sites.id"), nullable=False)
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), nullable=False)
     folder_id = db.Column(db.String, db.ForeignKey("folders.id"), nullable=True)
     deleted = db.Column(db.Boolean, default=False)
+    hash = db.Column(db.String)
+    encoding = db.Column(db.String)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     def save_to_db(self):
         db.session.add(self)
-        db.session.commit()
+        if not current_unit_of_work():
+            db.session.commit()
 
 class FileSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = File
-        exclude = ["deleted"]
+        exclude = ["deleted", "encoding"]
         
+class FileVersion(db.Model):
+    """An earlier content of a file.
+
+    Its blob is moved aside as is when it is superseded, and later packed
+    into content-defined chunks shared with the other versions of the site.
+    """
+    __tablename__ = "file_versions"
+    __table_args__ = (db.UniqueConstraint("file_id", "number"),)
+    id = db.Column(db.String, primary_key=True, default=shortuuid.uuid)
+    file_id = db.Column(db.String, db.ForeignKey("files.id"), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String, nullable=False)
+    ext = db.Column(db.String)
+    mimetype = db.Column(db.String)
+    size = db.Column(db.Integer)
+    hash = db.Column(db.String)
+    encoding = db.Column(db.String)
+    packed = db.Column(db.Boolean, nullable=False, default=False, server_default=sa.false())
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    file = db.relationship("File")
+
+    def save_to_db(self):
+        db.session.add(self)
+        if not current_unit_of_work():
+            db.session.commit()
+
+class FileVersionSchema(ma.SQLAlchemySchema):
+    number = ma.auto_field()
+    name = ma.auto_field()
+    ext = ma.auto_field()
+    mimetype = ma.auto_field()
+    size = ma.auto_field()
+    hash = ma.auto_field()
+    created_at = ma.auto_field()
+
+    class Meta:
+        model = FileVersion
+
+class Chunk(db.Model):
+    """A piece of version content, stored once per site under its sha256."""
+    __tablename__ = "chunks"
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), primary_key=True)
+    hash = db.Column(db.String, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    encoding = db.Column(db.String)
+
+version_chunks = db.Table("version_chunks",
+                          db.Column("version_id", db.String, db.ForeignKey("file_versions.id"), primary_key=True),
+                          db.Column("position", db.Integer, primary_key=True),
+                          db.Column("chunk_hash", db.String, nullable=False))
+
 class Folder(db.Model):
     __tablename__ = "folders"
     id = db.Column(db.String, primary_key=True, default=shortuuid.uuid)
     name = db.Column(db.String, nullable=False)
     parent_id = db.Column(db.String, db.ForeignKey("folders.id"))
     children = db.relationship("Folder", backref=db.backref("parent", remote_side=[id]))
-    site_id = db.Column(UUID(as_uuid=True), db.ForeignKey("sites.id"), nullable=False)
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), nullable=False)
     files = db.relationship("File")
     
     def save_to_db(self):
         db.session.add(self)
-        db.session.commit()
+        if not current_unit_of_work():
+            db.session.commit()
+
+class FolderTree(db.Model):
+    """Snapshot of a site's folders with their file counts, see ``api.trees``."""
+    __tablename__ = "folder_trees"
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
 
 class FolderSchema(ma.SQLAlchemyAutoSchema):
     children = ma.Nested('FolderSchema', many=True)
@@ -69,7 +172,8 @@ class User(db.Model):
 
     def save_to_db(self):
         db.session.add(self)
-        db.session.commit()
+        if not current_unit_of_work():
+            db.session.commit()
 
     @classmethod
     def find_by_email(cls, email):
@@ -77,11 +181,15 @@ class User(db.Model):
 
     @staticmethod
     def generate_hash(password):
-        return generate_password_hash(password)
+        return get_hasher().hash(password)
 
     @staticmethod
     def verify_hash(password, hash):
-        return check_password_hash(hash, password)
+        return get_hasher().verify(password, hash)
+
+    @staticmethod
+    def needs_rehash(hash):
+        return get_hasher().needs_rehash(hash)
 
 class UserSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
@@ -90,15 +198,17 @@ class UserSchema(ma.SQLAlchemyAutoSchema):
 
 class Site(db.Model):
     __tablename__ = "sites"
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = db.Column(GUID(), primary_key=True, default=uuid.uuid4)
     name = db.Column(db.String, nullable=False)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
     members = db.relationship("User", secondary="user_sites", backref="sites")
     folders = db.relationship("Folder")
     files = db.relationship("File")
 
     def save_to_db(self):
         db.session.add(self)
-        db.session.commit()
+        if not current_unit_of_work():
+            db.session.commit()
 
 class SiteSchema(ma.SQLAlchemySchema):
     id = ma.auto_field()
@@ -116,6 +226,80 @@ class SiteSchema(ma.SQLAlchemySchema):
     class Meta:
         model = Site
 
+class Change(db.Model):
+    __tablename__ = "changes"
+    __table_args__ = (db.UniqueConstraint("site_id", "seq"),)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), nullable=False)
+    seq = db.Column(db.BigInteger, nullable=False)
+    action = db.Column(db.String, nullable=False)
+    object_id = db.Column(db.String, nullable=False)
+    folder_id = db.Column(db.String)
+    name = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def save_to_db(self):
+        db.session.add(self)
+        if not current_unit_of_work():
+            db.session.commit()
+
+    @classmethod
+    def record(cls, site_id, action, object_id, folder_id=None, name=None):
+        """Append a change to the site's log in the current transaction.
+
+        Taking the next sequence number locks the site row until commit, so
+        sequence order always matches commit order.
+        """
+        with db.session.no_autoflush:
+            # The counter is on the copy of the site row next to the changes, on the site's shard.
+            seq = db.session.execute(sa.update(Site).where(Site.id == site_id)
+                                     .values(change_seq=Site.change_seq + 1)
+                                     .returning(Site.change_seq)
+                                     .execution_options(synchronize_session=False),
+                                     bind_arguments={"bind": db.session.get_bind(mapper=cls)}).scalar_one()
+        change = cls(site_id=site_id, seq=seq, action=action, object_id=object_id, folder_id=folder_id, name=name)
+        change.save_to_db()
+        return change
+
+class ChangeSchema(ma.SQLAlchemySchema):
+    seq = ma.auto_field()
+    action = ma.auto_field()
+    id = ma.auto_field("object_id")
+    folder_id = ma.auto_field()
+    name = ma.auto_field()
+    created_at = ma.auto_field()
+
+    class Meta:
+        model = Change
+
+class SiteShard(db.Model):
+    """The shard holding a site's folders and files, sites without a row are on the primary.
+
+    ``state`` is moving while ``flask site move`` copies the site, writes to
+    it are refused until it is active again.
+    """
+    __tablename__ = "site_shards"
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), primary_key=True)
+    shard = db.Column(db.String, nullable=False)
+    state = db.Column(db.String, nullable=False, default="active", server_default="active")
+
+class ShareDownload(db.Model):
+    """Downloads left on a share link with a download limit.
+
+    Links are stateless, only the ones with a limit have a row here.
+    """
+    __tablename__ = "share_downloads"
+    id = db.Column(db.String, primary_key=True)
+    site_id = db.Column(GUID(), db.ForeignKey("sites.id"), nullable=False)
+    limit = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def save_to_db(self):
+        db.session.add(self)
+        if not current_unit_of_work():
+            db.session.commit()
+
 class RevokedTokenModel(db.Model):
     __tablename__ = 'revoked_tokens'
 
@@ -124,7 +308,8 @@ class RevokedTokenModel(db.Model):
 
     def add(self):
         db.session.add(self)
-        db.session.commit()
+        if not current_unit_of_work():
+            db.session.commit()
 
     @classmethod
     def is_jti_blacklisted(cls, jti):
@@ -0,0 +1,80 @@
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import exc
+import threading
+import time
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.overflow_peak = 0
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "timeouts": self.timeouts,
+                "overflow_peak": self.overflow_peak
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts and how often callers had to wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        # Nothing idle and no overflow left means the checkout blocks on the queue.
+        must_wait = self.checkedin() == 0 and self._max_overflow > -1 and self.overflow() >= self._max_overflow
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with self.stats.lock:
+                self.stats.timeouts += 1
+                self.stats.waits += 1
+                self.stats.wait_seconds += time.perf_counter() - start
+            raise
+        with self.stats.lock:
+            self.stats.checkouts += 1
+            self.stats.overflow_peak = max(self.stats.overflow_peak, self.overflow())
+            if must_wait:
+                self.stats.waits += 1
+                self.stats.wait_seconds += time.perf_counter() - start
+        return conn
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        with self.stats.lock:
+            self.stats.checkins += 1
+
+def pool_status(engines):
+    """Return pool usage for every configured bind, keyed by bind name."""
+    status = {}
+    for key, engine in engines.items():
+        pool = engine.pool
+        info = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            info.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0)
+            })
+        if isinstance(pool, InstrumentedQueuePool):
+            info.update(pool.stats.as_dict())
+        status[key or "default"] = info
+    return status
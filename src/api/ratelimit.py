@@ -0,0 +1,187 @@
+from flask import current_app, request, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from functools import wraps
+from api.metrics import rate_limited
+import threading
+import math
+import time
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+class MemoryBuckets:
+    """In-process token buckets, each worker process limits on its own."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1, debt=False):
+        """Take ``cost`` tokens and return 0, or the seconds until they are available.
+
+        With ``debt`` the tokens are always taken and the bucket may go
+        negative, the caller then waits the returned time before carrying on.
+        """
+        with self.lock:
+            now = self.clock()
+            tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost or debt:
+                tokens -= cost
+                wait = max(0, -tokens / rate)
+            else:
+                wait = (cost - tokens) / rate
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            # Full buckets carry no state, drop them so idle clients don't pile up.
+            if len(self.buckets) > 10000:
+                self.buckets = {k: v for k, v in self.buckets.items() if v[2] > now}
+            return wait
+
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + (now - (tonumber(state[2]) or now)) * rate)
+local wait = 0
+if tokens >= cost or ARGV[4] == '1' then
+    tokens = tokens - cost
+    if tokens < 0 then wait = -tokens / rate end
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    """Token buckets shared by every worker, updated atomically by a script using the Redis clock."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATELIMIT_URL points to redis but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1, debt=False):
+        return float(self.script(keys=[key], args=[rate, burst, cost, "1" if debt else "0"]))
+
+def get_limiter():
+    limiter = current_app.extensions.get("rate_limiter")
+    if limiter is None:
+        url = current_app.config.get("RATELIMIT_URL", "memory://")
+        if url.startswith("redis"):
+            limiter = RedisBuckets(url)
+        else:
+            limiter = MemoryBuckets()
+        current_app.extensions["rate_limiter"] = limiter
+    return limiter
+
+def parse_limit(limit):
+    """Turn ``"10/minute"`` into a rate in tokens per second and a burst of 10."""
+    count, period = limit.split("/")
+    return int(count) / PERIODS[period], int(count)
+
+def _scope_key(name, scope, kwargs, site_arg):
+    if scope == "user":
+        value = get_jwt_identity()
+    elif scope == "site":
+        value = kwargs[site_arg]
+    else:
+        value = request.remote_addr
+    return "ratelimit:{}:{}:{}".format(name, scope, value)
+
+def rate_limit(name, scopes=("user", "site"), site_arg="site_id"):
+    """Limit a route with the RATELIMIT_<NAME> setting, one bucket per user, site or ip in ``scopes``.
+
+    Requests over the limit get a 429 with Retry-After. User scoped limits
+    must come after ``jwt_required`` and site scoped ones after
+    ``check_site_permissions``, so only members take from a site's bucket.
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            limit = current_app.config.get("RATELIMIT_" + name.upper())
+            if current_app.config.get("RATELIMIT_ENABLED", True) and limit:
+                rate, burst = parse_limit(limit)
+                limiter = get_limiter()
+                for scope in scopes:
+                    wait = limiter.take(_scope_key(name, scope, kwargs, site_arg), rate, burst)
+                    if wait:
+                        rate_limited.inc(name=name, scope=scope)
+                        response = make_response(jsonify({
+                            "error": "Too many requests",
+                            "message": "Rate limit exceeded, try again later"
+                        }), 429)
+                        response.headers["Retry-After"] = str(math.ceil(wait))
+                        return response
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
+
+class ThrottledStream:
+    """Wrap the request body so reading it, and so the upload, runs at TRANSFER_RATE_LIMIT."""
+
+    def __init__(self, stream, throttle):
+        self.stream = stream
+        self.throttle = throttle
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.throttle(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.throttle(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _bandwidth_key():
+    try:
+        return "bandwidth:user:{}".format(get_jwt_identity())
+    except RuntimeError:
+        # Public routes, like share links, have no user.
+        return "bandwidth:ip:{}".format(request.remote_addr)
+
+def throttled(fn):
+    """Shape request and response bodies to TRANSFER_RATE_LIMIT bytes per second for each user.
+
+    Must come after ``jwt_required`` and before anything reads the body,
+    routes without one are shaped per ip address.
+    Throttled downloads are sent by the worker instead of wsgi.file_wrapper.
+    """
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        rate = current_app.config.get("TRANSFER_RATE_LIMIT", 0)
+        if not rate:
+            return fn(*args, **kwargs)
+        limiter = get_limiter()
+        key = _bandwidth_key()
+
+        def throttle(size):
+            if size:
+                wait = limiter.take(key, rate, rate, size, debt=True)
+                if wait:
+                    time.sleep(wait)
+
+        request.environ["wsgi.input"] = ThrottledStream(request.environ["wsgi.input"], throttle)
+        response = make_response(fn(*args, **kwargs))
+        if response.direct_passthrough:
+            body = response.response
+            def stream():
+                try:
+                    for chunk in body:
+                        throttle(len(chunk))
+                        yield chunk
+                finally:
+                    if hasattr(body, "close"):
+                        body.close()
+            response.response = stream()
+        return response
+    return decorator
@@ -0,0 +1,51 @@
+from flask import Blueprint, jsonify, request
+from api.models import db
+from api.decorators import admin_required
+from api.pool import pool_status
+from api.duplicates import sharded_duplicate_groups
+
+admin_endpoint = Blueprint('admin', __name__)
+
+@admin_endpoint.route("/v1/admin/pool")
+@admin_required
+def get_pool_status():
+    """Retrieve database connection pool usage
+    ---
+    tags: [Admin]
+    responses:
+      200:
+        description: Pool size, checked out connections, overflow, checkouts and waits per database bind
+      403:
+        description: Administrator access required
+    """
+    return jsonify(pool_status(db.engines))
+
+@admin_endpoint.route("/v1/admin/duplicates")
+@admin_required
+def get_duplicates():
+    """List files with the same content across all sites
+    ---
+    tags: [Admin]
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of groups to return, at most 1000
+    responses:
+      200:
+        description: Groups of files with the same hash across all sites and shards, the ones keeping a single copy would reclaim the most bytes from first
+      400:
+        description: limit is not a number
+      403:
+        description: Administrator access required
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 1000))
+    except ValueError:
+        return jsonify({
+            "error": "Bad request",
+            "message": "limit must be a number"
+        }), 400
+    groups = sharded_duplicate_groups(limit=limit)
+    return jsonify({"reclaimable": sum(g["reclaimable"] for g in groups), "groups": groups})
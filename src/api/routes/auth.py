@@ -2,10 +2,23 @@ from flask import Blueprint, request, jsonify, abort
 from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 jwt_required, get_jwt_identity, get_jwt)
 from api.models import User, RevokedTokenModel
+from api.ratelimit import rate_limit
+from api.hashing import HasherBusy
 
 auth_endpoint = Blueprint('auth', __name__)
 
+@auth_endpoint.errorhandler(HasherBusy)
+def hasher_busy(e):
+    response = jsonify({
+        "error": "Service unavailable",
+        "message": "Too many logins in progress, try again shortly"
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 @auth_endpoint.route("/v1/auth/register", methods=["POST"])
+@rate_limit("login", scopes=("ip",))
 def register():
     """Register account
     ---
@@ -33,6 +46,8 @@ def register():
         description: Returns if email, password and name is not given in body
       409:
         description: Email already in use by another account
+      503:
+        description: Too many passwords being hashed, retry after the number of seconds in Retry-After
       500:
         description: Unknown error occurred while creating account
     """
@@ -53,6 +68,7 @@ def register():
         return jsonify({'message': 'Something went wrong'}), 500
 
 @auth_endpoint.route("/v1/auth/login", methods=["POST"])
+@rate_limit("login", scopes=("ip",))
 def login():
     """Register account
     ---
@@ -77,6 +93,10 @@ def login():
         description: Returns if account has been inactivated
       404:
         description: Wrong email or password
+      429:
+        description: Too many login attempts from this address, retry after the number of seconds in Retry-After
+      503:
+        description: Too many passwords being hashed, retry after the number of seconds in Retry-After
       500:
         description: Unknown error occurred while creating account
     """
@@ -87,6 +107,9 @@ def login():
         return jsonify({'message': 'Wrong email or password, please try again.'}), 404
 
     if User.verify_hash(request.json["password"], current_user.password) and current_user.status == "active":
+        if User.needs_rehash(current_user.password):
+            current_user.password = User.generate_hash(request.json["password"])
+            current_user.save_to_db()
         access_token = create_access_token(identity=request.json['email'], additional_claims={"role": current_user.role})
         refresh_token = create_refresh_token(identity=request.json['email'])
 
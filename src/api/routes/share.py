@@ -0,0 +1,256 @@
+from flask import Blueprint, request, jsonify, current_app, url_for
+from flask_jwt_extended import jwt_required
+from itsdangerous import BadSignature
+from api.models import File, Folder
+from api.decorators import check_site_permissions
+from api.ratelimit import rate_limit, throttled
+from api.delivery import send_blob
+from api import serializers
+from api import shares
+from api import sharding
+
+share_endpoint = Blueprint('share', __name__)
+
+def _share_options():
+    """Read expires_in and max_downloads from the JSON body, or return an error response."""
+    data = request.get_json(silent=True) or {}
+    expires_in = data.get("expires_in")
+    max_downloads = data.get("max_downloads")
+    max_ttl = current_app.config["SHARE_MAX_TTL"]
+    if expires_in is not None and (not isinstance(expires_in, int) or not 0 < expires_in <= max_ttl):
+        return None, None, (jsonify({
+            "error": "Bad request",
+            "message": "expires_in must be a number of seconds up to {}".format(max_ttl)
+        }), 400)
+    if max_downloads is not None and (not isinstance(max_downloads, int) or max_downloads < 1):
+        return None, None, (jsonify({
+            "error": "Bad request",
+            "message": "max_downloads must be a positive number"
+        }), 400)
+    return expires_in, max_downloads, None
+
+def _share_response(token, expires_at, max_downloads):
+    return {
+        "token": token,
+        "url": url_for("share.get_share", token=token, _external=True),
+        "expires_at": expires_at,
+        "max_downloads": max_downloads
+    }, 201
+
+@share_endpoint.route("/v1/sites/<site_id>/files/<file_id>/shares", methods=["POST"])
+@jwt_required()
+@check_site_permissions("site_id", "write")
+def share_file(site_id, file_id):
+    """Create a public link to a file
+    ---
+    tags: [Shares]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            expires_in:
+              type: integer
+              description: Seconds until the link expires, SHARE_TTL by default
+            max_downloads:
+              type: integer
+              description: Number of downloads allowed, unlimited by default
+    responses:
+      201:
+        description: The link, which downloads the current version of the file without authentication until it expires
+      400:
+        description: Invalid expires_in or max_downloads
+      403:
+        description: Requires write access to the site
+      404:
+        description: File not found
+    """
+    expires_in, max_downloads, error = _share_options()
+    if error:
+        return error
+    file = File.query.filter(File.id==file_id, File.site_id==site_id, File.deleted==False).first()
+    if not file:
+        return jsonify({
+            "error": "Not found",
+            "message": "File not found"
+        }), 404
+    token, expires_at = shares.share_file(file, expires_in, max_downloads)
+    return _share_response(token, expires_at, max_downloads)
+
+@share_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/shares", methods=["POST"])
+@jwt_required()
+@check_site_permissions("site_id", "write")
+def share_folder(site_id, folder_id):
+    """Create a public link to the files in a folder
+    ---
+    tags: [Shares]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: folder_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a folder
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            expires_in:
+              type: integer
+              description: Seconds until the link expires, SHARE_TTL by default
+            max_downloads:
+              type: integer
+              description: Number of file downloads allowed, unlimited by default
+    responses:
+      201:
+        description: The link, which lists the files directly in the folder without authentication until it expires
+      400:
+        description: Invalid expires_in or max_downloads
+      403:
+        description: Requires write access to the site
+      404:
+        description: Folder not found
+    """
+    expires_in, max_downloads, error = _share_options()
+    if error:
+        return error
+    folder = Folder.query.filter(Folder.id==folder_id, Folder.site_id==site_id).first()
+    if not folder:
+        return jsonify({
+            "error": "Not found",
+            "message": "Folder not found"
+        }), 404
+    token, expires_at = shares.share_folder(folder, expires_in, max_downloads)
+    return _share_response(token, expires_at, max_downloads)
+
+def _load(token):
+    """Return the payload of a share token, or an error response."""
+    try:
+        return shares.load(token), None
+    except shares.ShareExpired:
+        return None, (jsonify({
+            "error": "Gone",
+            "message": "Share link expired"
+        }), 410)
+    except BadSignature:
+        return None, (jsonify({
+            "error": "Not found",
+            "message": "Share link not found"
+        }), 404)
+
+def _download(site_id, file, payload):
+    try:
+        shares.count_download(payload)
+    except shares.ShareExhausted:
+        return jsonify({
+            "error": "Gone",
+            "message": "Share link download limit reached"
+        }), 410
+    response = send_blob(site_id, file)
+    response.headers.set("Content-Disposition", "attachment", filename=file.name)
+    return response
+
+@share_endpoint.route("/v1/shares/<token>")
+@rate_limit("download", scopes=("ip",))
+@throttled
+def get_share(token):
+    """Download a shared file or list the files of a shared folder
+    ---
+    tags: [Shares]
+    parameters:
+      - name: token
+        in: path
+        type: string
+        required: true
+        description: The token of a share link
+    responses:
+      200:
+        description: The content of a shared file, or information about the files in a shared folder
+      404:
+        description: Share link or file not found
+      410:
+        description: Share link expired, download limit reached or the file changed since it was shared
+      429:
+        description: Too many requests, retry after the number of seconds in Retry-After
+    """
+    payload, error = _load(token)
+    if error:
+        return error
+    sharding.use_site(payload["s"])
+    if "f" in payload:
+        try:
+            file = shares.shared_file(payload)
+        except shares.ShareOutdated:
+            return jsonify({
+                "error": "Gone",
+                "message": "File changed since it was shared"
+            }), 410
+        if not file:
+            return jsonify({
+                "error": "Not found",
+                "message": "File not found"
+            }), 404
+        return _download(payload["s"], file, payload)
+    files = serializers.file_rows(File.site_id==payload["s"], File.folder_id==payload["d"], File.deleted==False)
+    return serializers.json_response(files)
+
+@share_endpoint.route("/v1/shares/<token>/files/<file_id>")
+@rate_limit("download", scopes=("ip",))
+@throttled
+def get_shared_folder_file(token, file_id):
+    """Download a file of a shared folder
+    ---
+    tags: [Shares]
+    parameters:
+      - name: token
+        in: path
+        type: string
+        required: true
+        description: The token of a folder share link
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file directly in the shared folder
+    responses:
+      200:
+        description: The content of the file
+      404:
+        description: Share link or file not found
+      410:
+        description: Share link expired or download limit reached
+      429:
+        description: Too many requests, retry after the number of seconds in Retry-After
+    """
+    payload, error = _load(token)
+    if error:
+        return error
+    file = None
+    if "d" in payload:
+        sharding.use_site(payload["s"])
+        file = File.query.filter(File.id==file_id, File.site_id==payload["s"], File.folder_id==payload["d"],
+                                 File.deleted==False).first()
+    if not file:
+        return jsonify({
+            "error": "Not found",
+            "message": "File not found"
+        }), 404
+    return _download(payload["s"], file, payload)
@@ -1,18 +1,37 @@
-from flask import Blueprint, request, jsonify, abort, current_app, send_from_directory
-from flask_jwt_extended import (create_access_token, create_refresh_token,
-                                jwt_required, get_jwt_identity, get_jwt)
-from api.models import Folder, FolderSchema, User, Site, SiteSchema, File, FileSchema
-from werkzeug.utils import secure_filename
-import os
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from api.models import (db, Folder, User, Site, File, FileSchema, FileVersion, FileVersionSchema, Change, ChangeSchema,
+                        user_sites, SITE_ROLES, roles_at_least)
 import pathlib
-import shutil
-from api.decorators import check_site_permissions
+from sqlalchemy.exc import IntegrityError
+from api.decorators import check_site_permissions, read_only
+from api.ratelimit import rate_limit, throttled
+from api.uploads import upload_limit
+from api import storage
+from api.cache import cached_response, invalidate_members
+from api.delivery import send_blob, send_content
+from api.events import get_broker, stream_slots
+from api import serializers
+from api import transfer
+from api.sniffing import sniff
+from api import compression
+from api import versions
+from api import trees
+from api import sharding
+from api.duplicates import duplicate_groups
+import json
+import time
+import itertools
+import shortuuid
+import sqlalchemy as sa
 
 site_endpoint = Blueprint('site', __name__)
 
 @site_endpoint.route("/v1/sites/<id>")
+@read_only
 @jwt_required()
 @check_site_permissions("id")
+@cached_response("id")
 def get_site(id):
     """Retrieve information about a specific site
     ---
@@ -29,10 +48,9 @@ def get_site(id):
       404:
         description: Site not found
     """
-    sites_schema = SiteSchema()
-    site = Site.query.filter(Site.id==id).first()
+    site = serializers.site_rows(Site.id==id)
     if site:
-        return jsonify(sites_schema.dump(site))
+        return serializers.json_response(site[0])
     else:
         return jsonify({
             "error": "Not found",
@@ -40,22 +58,39 @@ def get_site(id):
         }), 404
 
 @site_endpoint.route("/v1/sites")
+@read_only
 @jwt_required()
+@cached_response()
 def get_sites():
     """Retrieve information about all sites belonging to the user
     ---
     tags: [Sites]
+    parameters:
+      - name: role
+        in: query
+        type: string
+        required: false
+        description: Only sites where the user has at least this role, read, write or admin
     responses:
       200:
         description: Information about all sites belonging to the user
+      400:
+        description: role is not a known role
       404:
         description: User is not a member of any sites
     """
-    sites_schema = SiteSchema(many=True)
+    role = request.args.get("role", "read")
+    if role not in SITE_ROLES:
+        return jsonify({
+            "error": "Bad request",
+            "message": "role must be one of read, write or admin"
+        }), 400
     current_user = User.find_by_email(get_jwt_identity())
-    sites = Site.query.filter(Site.members.any(id=current_user.id)).all()
+    sites = serializers.site_rows(Site.id.in_(sa.select(user_sites.c.site_id)
+                                              .where(user_sites.c.user_id==current_user.id,
+                                                     user_sites.c.permission.in_(roles_at_least(role)))))
     if sites:
-        return jsonify(sites_schema.dump(sites))
+        return serializers.json_response(sites)
     else:
         return jsonify({
             "error": "Not found",
@@ -63,6 +98,7 @@ def get_sites():
         }), 404
 
 @site_endpoint.route("/v1/sites/<id>/folders")
+@read_only
 @jwt_required()
 @check_site_permissions("id")
 def get_folders_in_site(id):
@@ -78,21 +114,34 @@ def get_folders_in_site(id):
     responses:
       200:
         description: Information about all folders in site
+      304:
+        description: The tree didn't change since the ETag in If-None-Match
       404:
         description: No folders found in site
     """
-    folders_schema = FolderSchema(many=True)
-    folders = Folder.query.filter(Folder.site_id==id, Folder.parent_id==None).all()
-    if folders:
-        return jsonify(folders_schema.dump(folders))
+    return _folder_tree_response(id)
+
+def _folder_tree_response(site_id, folder_id=None):
+    """Serve a site's folder tree, or a subtree, from its snapshot with the snapshot version as ETag."""
+    version, data = trees.snapshot(site_id)
+    etag = "{}-{}".format(version, folder_id or "")
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
     else:
-        return jsonify({
-            "error": "Not found",
-            "message": "No folders in site"
-        }), 404
+        folders = trees.render(site_id, trees.decode(data), folder_id)
+        if not folders:
+            return jsonify({
+                "error": "Not found",
+                "message": "Folder not found" if folder_id else "No folders in site"
+            }), 404
+        response = serializers.json_response(folders)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>")
+@read_only
 @jwt_required()
 @check_site_permissions("site_id")
 def get_folder_by_id(site_id, folder_id):
@@ -113,23 +162,17 @@ def get_folder_by_id(site_id, folder_id):
     responses:
       200:
         description: Information about the specified folder
+      304:
+        description: The tree didn't change since the ETag in If-None-Match
       404:
         description: Folder not found
     """
-    folders_schema = FolderSchema()
-    folders = Folder.query.filter(Folder.id==folder_id, Folder.site_id==site_id).first()
-    if folders:
-        return jsonify(folders_schema.dump(folders))
-    else:
-        return jsonify({
-            "error": "Not found",
-            "message": "Folder not found"
-        }), 404
+    return _folder_tree_response(site_id, folder_id)
 
 @site_endpoint.route("/v1/sites/<site_id>/files/<file_id>", methods=["PATCH"])
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/files/<file_id>", methods=["PATCH"])
 @jwt_required()
-@check_site_permissions("site_id")
+@check_site_permissions("site_id", "write")
 def edit_file(site_id, file_id, folder_id=None):
     """Change information about a file
     ---
@@ -154,29 +197,43 @@ def edit_file(site_id, file_id, folder_id=None):
         in: body
         type: string
         required: false
-        description: The ID of a folder
+        description: New name of the file
+      - name: folder_id
+        in: body
+        type: string
+        required: false
+        description: Move the file to this folder, null moves it to the root of the site
     responses:
+      403:
+        description: Requires write access to the site
       200:
         description: File information changed successfully
       400:
         description: Returns if body is empty
       404:
-        description: File not found
+        description: File or destination folder not found
     """
     file_schema = FileSchema()
     files = File.query.filter(File.id==file_id, File.site_id==site_id, File.folder_id==folder_id, File.deleted==False).first()
     if files:
         if request.json:
             if "name" in request.json:
-                ext = pathlib.Path(request.json["name"]).suffix
-                if ext:
-                    if ext != files.ext:
-                        os.rename(os.path.join(current_app.config["DATA_FOLDER"], site_id, str(files.id + files.ext)),
-                                os.path.join(current_app.config["DATA_FOLDER"], site_id, str(files.id + ext)))
-                        files.ext = ext
+                # The extension comes from the content, so renaming never touches the blob.
+                if pathlib.Path(request.json["name"]).suffix:
                     files.name = request.json["name"]
                 else:
                     files.name = request.json["name"] + files.ext
+                Change.record(site_id, "rename", files.id, files.folder_id, files.name)
+            if "folder_id" in request.json and request.json["folder_id"] != files.folder_id:
+                destination = request.json["folder_id"]
+                if destination and not Folder.query.filter(Folder.id==destination, Folder.site_id==site_id).first():
+                    return jsonify({
+                        "error": "Not found",
+                        "message": "Folder not found"
+                    }), 404
+                trees.patch(site_id, counts={files.folder_id: -1, destination: 1})
+                files.folder_id = destination
+                Change.record(site_id, "move", files.id, files.folder_id, files.name)
             files.save_to_db()
             return jsonify({"message": "File updated"}), 200
         else:
@@ -192,7 +249,7 @@ def edit_file(site_id, file_id, folder_id=None):
 @site_endpoint.route("/v1/sites/<site_id>/files/<file_id>", methods=["DELETE"])
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/files/<file_id>", methods=["DELETE"])
 @jwt_required()
-@check_site_permissions("site_id")
+@check_site_permissions("site_id", "write")
 def remove_file(site_id, file_id, folder_id=None):
     """Remove specific file
     ---
@@ -214,6 +271,8 @@ def remove_file(site_id, file_id, folder_id=None):
         required: false
         description: The ID of a folder
     responses:
+      403:
+        description: Requires write access to the site
       200:
         description: File removed successfully
       404:
@@ -227,12 +286,8 @@ def remove_file(site_id, file_id, folder_id=None):
         try:
             files.deleted = True
             files.save_to_db()
-
-            trash_path = os.path.join(current_app.config["DATA_FOLDER"], site_id, ".trash")
-            if not os.path.exists(trash_path):
-                os.makedirs(trash_path)
-            
-            shutil.move(os.path.join(current_app.config["DATA_FOLDER"], site_id, str(files.id + files.ext)), trash_path)
+            storage.trash_blob(site_id, storage.blob_name(files))
+            Change.record(site_id, "delete", files.id, files.folder_id, files.name)
 
             return jsonify({"message": "File deleted"})
         except:
@@ -252,6 +307,8 @@ def remove_file(site_id, file_id, folder_id=None):
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/files/<file_id>.<ext>")
 @jwt_required()
 @check_site_permissions("site_id")
+@rate_limit("download")
+@throttled
 def get_file(site_id, file_id, folder_id=None, ext=None):
     """Retrieve information or contents of a file
     ---
@@ -282,13 +339,15 @@ def get_file(site_id, file_id, folder_id=None, ext=None):
         description: Return information about the file. If ext is present it will deliver the file content instead.
       404:
         description: File not found
+      429:
+        description: Too many requests, retry after the number of seconds in Retry-After
     """
 
     file_schema = FileSchema()
     files = File.query.filter(File.id==file_id, File.site_id==site_id, File.folder_id==folder_id, File.deleted==False).first()
     if files:
-        if ext == files.ext.replace(".", ""):
-            return send_from_directory(os.path.join(os.getcwd(), current_app.config["DATA_FOLDER"], site_id), str(files.id + files.ext))
+        if ext is not None and "." + ext.lower() == (files.ext or "").lower():
+            return send_blob(site_id, files)
         else:
             return jsonify(file_schema.dump(files))
     else:
@@ -299,8 +358,10 @@ def get_file(site_id, file_id, folder_id=None, ext=None):
 
 @site_endpoint.route("/v1/sites/<site_id>/files")
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/files")
+@read_only
 @jwt_required()
 @check_site_permissions("site_id")
+@cached_response("site_id")
 def get_files_(site_id, folder_id=None):
     """Retrieve information about all files in site and/or folder
     ---
@@ -316,26 +377,44 @@ def get_files_(site_id, folder_id=None):
         type: string
         required: false
         description: The ID of a folder 
+      - name: format
+        in: query
+        type: string
+        required: false
+        description: ndjson streams one file per line instead of returning a JSON array
+      - name: type
+        in: query
+        type: string
+        required: false
+        description: Only files of this detected mimetype, like image/png, or of this top level type, like image
     responses:
       200:
         description: Return information about all files in site and/or folder
       404:
         description: No files found in site
     """
-    file_schema = FileSchema(many=True)
-    files = File.query.filter(File.site_id==site_id, File.folder_id==folder_id, File.deleted==False).all()
-    if files:
-        return jsonify(file_schema.dump(files))
+    criteria = (File.site_id==site_id, File.folder_id==folder_id, File.deleted==False)
+    file_type = request.args.get("type")
+    if file_type:
+        criteria += (File.mimetype==file_type,) if "/" in file_type else (File.mimetype.startswith(file_type + "/", autoescape=True),)
+    if request.args.get("format") == "ndjson":
+        files = serializers.stream_file_rows(*criteria)
+        first = next(files, None)
+        if first:
+            return serializers.ndjson_response(itertools.chain([first], files))
     else:
-        return jsonify({
-            "error": "Not found",
-            "message": "No files in site"
-        }), 404
+        files = serializers.file_rows(*criteria)
+        if files:
+            return serializers.json_response(files)
+    return jsonify({
+        "error": "Not found",
+        "message": "No files in site"
+    }), 404
 
 @site_endpoint.route("/v1/sites/<site_id>/folders", methods=["POST"])
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>", methods=["POST"])
 @jwt_required()
-@check_site_permissions("site_id")
+@check_site_permissions("site_id", "write")
 def add_folder(site_id, folder_id=None):
     """Create a new folder
     ---
@@ -357,6 +436,8 @@ def add_folder(site_id, folder_id=None):
         required: true
         description: Name of the folder 
     responses:
+      403:
+        description: Requires write access to the site
       201:
         description: Returns successful message and information about the resource created
       400:
@@ -371,8 +452,10 @@ def add_folder(site_id, folder_id=None):
         }), 400
     
     try:
-        new_folder = Folder(name=request.json["name"], site_id=site_id, parent_id=folder_id)
+        new_folder = Folder(id=shortuuid.uuid(), name=request.json["name"], site_id=site_id, parent_id=folder_id)
         new_folder.save_to_db()
+        trees.patch(site_id, folders=[new_folder])
+        Change.record(site_id, "folder_create", new_folder.id, folder_id, new_folder.name)
         return {
             "message": "New folder created",
             "id": new_folder.id,
@@ -416,6 +499,7 @@ def add_site():
     new_site.members.append(current_user)
     try:
         new_site.save_to_db()
+        sharding.place_site(new_site)
         return jsonify({'message': 'New site created'}), 201
     except IntegrityError:
         return jsonify({
@@ -425,7 +509,11 @@ def add_site():
 
 @site_endpoint.route("/v1/sites/<site_id>/files", methods=["POST"])
 @site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>/files", methods=["POST"])
+@upload_limit("UPLOAD_MAX_SIZE")
 @jwt_required()
+@check_site_permissions("site_id", "write")
+@rate_limit("upload")
+@throttled
 def add_file(site_id, folder_id=None):
     """Upload file
     ---
@@ -447,12 +535,18 @@ def add_file(site_id, folder_id=None):
         required: true
         description: FormData of file 
     responses:
+      403:
+        description: Requires write access to the site
       201:
         description: Returns successful message and information about the resource created
       400:
         description: file not given in body
       400:
         description: file is empty
+      429:
+        description: Too many uploads, retry after the number of seconds in Retry-After
+      413:
+        description: Body larger than UPLOAD_MAX_SIZE
       500:
         description: Unknown error occurred while saving file  
     """
@@ -469,15 +563,15 @@ def add_file(site_id, folder_id=None):
             "message": "file is empty"
         }), 400
     if file:
-        filepath = os.path.join(current_app.config["DATA_FOLDER"], site_id)
-        if not os.path.exists(filepath):
-            os.makedirs(filepath)
-        
-        file_extension = pathlib.Path(file.filename).suffix
         try:
-            new_file = File(name=file.filename, site_id=site_id, mimetype=file.mimetype, ext=file_extension, folder_id=folder_id)
+            mimetype, file_extension = sniff(storage.read_head(file), file.filename)
+            new_file = File(id=shortuuid.uuid(), name=file.filename, site_id=site_id, mimetype=mimetype, ext=file_extension, folder_id=folder_id,
+                            encoding=compression.choose_encoding(current_app.config, mimetype))
+            new_file.size, new_file.hash = storage.save_blob(file, site_id, storage.blob_name(new_file), new_file.encoding,
+                                                             current_app.config.get("BLOB_COMPRESSION_LEVEL"))
             new_file.save_to_db()
-            file.save(os.path.join(filepath, str(new_file.id + file_extension)))
+            trees.patch(site_id, counts={folder_id: 1})
+            Change.record(site_id, "upload", new_file.id, folder_id, new_file.name)
             return {
                 "message": "Upload complete",
                 "id": new_file.id,
@@ -487,4 +581,646 @@ def add_file(site_id, folder_id=None):
             return jsonify({
                 "error": "Unknown error",
                 "message": "Unkown error occurred"
-            }), 500
\ No newline at end of file
+            }), 500
+
+@site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>", methods=["PATCH"])
+@jwt_required()
+@check_site_permissions("site_id", "write")
+def edit_folder(site_id, folder_id):
+    """Rename or move a folder
+    ---
+    tags: [Folders]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: folder_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a folder
+      - name: name
+        in: body
+        type: string
+        required: false
+        description: New name of the folder
+      - name: parent_id
+        in: body
+        type: string
+        required: false
+        description: Move the folder into this folder, null moves it to the root of the site
+    responses:
+      403:
+        description: Requires write access to the site
+      200:
+        description: Folder information changed successfully
+      400:
+        description: Returns if body is empty or the folder would be moved into itself
+      404:
+        description: Folder or destination folder not found
+    """
+    folder = Folder.query.filter(Folder.id==folder_id, Folder.site_id==site_id).first()
+    if not folder:
+        return jsonify({
+            "error": "Not found",
+            "message": "Folder not found"
+        }), 404
+    if not request.json:
+        return jsonify({
+            "error": "Bad request",
+            "message": "name or parent_id not given"
+        }), 400
+    if "name" in request.json and request.json["name"] != folder.name:
+        folder.name = request.json["name"]
+        Change.record(site_id, "folder_rename", folder.id, folder.parent_id, folder.name)
+    if "parent_id" in request.json and request.json["parent_id"] != folder.parent_id:
+        parent_id = request.json["parent_id"]
+        ancestor_id = parent_id
+        while ancestor_id:
+            if ancestor_id == folder.id:
+                return jsonify({
+                    "error": "Bad request",
+                    "message": "A folder can not be moved into itself"
+                }), 400
+            ancestor = Folder.query.filter(Folder.id==ancestor_id, Folder.site_id==site_id).first()
+            if not ancestor:
+                return jsonify({
+                    "error": "Not found",
+                    "message": "Folder not found"
+                }), 404
+            ancestor_id = ancestor.parent_id
+        folder.parent_id = parent_id
+        Change.record(site_id, "folder_move", folder.id, folder.parent_id, folder.name)
+    folder.save_to_db()
+    trees.patch(site_id, folders=[folder])
+    return jsonify({"message": "Folder updated"}), 200
+
+@site_endpoint.route("/v1/sites/<site_id>/folders/<folder_id>", methods=["DELETE"])
+@jwt_required()
+@check_site_permissions("site_id", "write")
+def remove_folder(site_id, folder_id):
+    """Remove an empty folder
+    ---
+    tags: [Folders]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: folder_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a folder
+    responses:
+      200:
+        description: Folder removed successfully
+      403:
+        description: Requires write access to the site
+      404:
+        description: Folder not found
+      409:
+        description: The folder still has folders or files in it
+    """
+    folder = Folder.query.filter(Folder.id==folder_id, Folder.site_id==site_id).first()
+    if not folder:
+        return jsonify({
+            "error": "Not found",
+            "message": "Folder not found"
+        }), 404
+    if Folder.query.filter(Folder.parent_id==folder.id).first() or \
+            File.query.filter(File.folder_id==folder.id, File.deleted==False).first():
+        return jsonify({
+            "error": "Conflict",
+            "message": "Folder is not empty"
+        }), 409
+    # Removed files keep their row, they move to the root of the site with the folder gone.
+    db.session.execute(sa.update(File.__table__).where(File.folder_id==folder.id).values(folder_id=None))
+    Change.record(site_id, "folder_delete", folder.id, folder.parent_id, folder.name)
+    db.session.delete(folder)
+    trees.patch(site_id, removed=[folder.id])
+    return jsonify({"message": "Folder deleted"}), 200
+
+@site_endpoint.route("/v1/sites/<site_id>/changes")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+def get_changes(site_id):
+    """Retrieve changes made to a site since a cursor
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: Cursor returned by a previous call, changes after it are returned. Defaults to the start of the log
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of changes to return, at most 1000
+      - name: wait
+        in: query
+        type: integer
+        required: false
+        description: Long-poll for up to this many seconds (at most 60) when there are no changes yet
+    responses:
+      200:
+        description: Changes in the order they were committed, the cursor to pass next and whether more changes are waiting. A reset change means folders and files were loaded in bulk, refetch the site
+      400:
+        description: since, limit or wait is not a number
+      503:
+        description: The worker has EVENTS_MAX_STREAMS requests waiting already, retry after the number of seconds in Retry-After
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = max(1, min(int(request.args.get("limit", 1000)), 1000))
+        wait = min(int(request.args.get("wait", 0)), 60)
+    except ValueError:
+        return jsonify({
+            "error": "Bad request",
+            "message": "since, limit and wait must be numbers"
+        }), 400
+    changes = Change.query.filter(Change.site_id==site_id, Change.seq > since).order_by(Change.seq).limit(limit + 1).all()
+    if not changes and wait > 0:
+        slots = stream_slots()
+        if not slots.acquire(blocking=False):
+            return _streams_busy()
+        try:
+            # Give the connection back while blocked, the wait can outlast many requests.
+            db.session.close()
+            if get_broker().wait(site_id, since, wait):
+                changes = Change.query.filter(Change.site_id==site_id, Change.seq > since).order_by(Change.seq).limit(limit + 1).all()
+        finally:
+            slots.release()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return jsonify({
+        "changes": ChangeSchema(many=True).dump(changes),
+        "cursor": changes[-1].seq if changes else since,
+        "has_more": has_more
+    })
+
+@site_endpoint.route("/v1/sites/<site_id>/events")
+@jwt_required()
+@check_site_permissions("site_id")
+def get_events(site_id):
+    """Stream changes to a site as Server-Sent Events
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: Cursor to start after, the Last-Event-ID header takes precedence when reconnecting
+    responses:
+      200:
+        description: A text/event-stream where every event is a change, its id is the cursor of the change. Refetch the site on a reset event
+      400:
+        description: since is not a number
+      503:
+        description: The worker has EVENTS_MAX_STREAMS streams open already, retry after the number of seconds in Retry-After
+    """
+    try:
+        since = int(request.headers.get("Last-Event-ID", request.args.get("since", 0)))
+    except ValueError:
+        return jsonify({
+            "error": "Bad request",
+            "message": "since must be a number"
+        }), 400
+    slots = stream_slots()
+    if not slots.acquire(blocking=False):
+        return _streams_busy()
+    broker = get_broker()
+    keepalive = current_app.config["EVENTS_KEEPALIVE"]
+    deadline = time.monotonic() + current_app.config["EVENTS_MAX_DURATION"]
+    change_schema = ChangeSchema()
+
+    def stream(cursor):
+        yield "retry: 3000\n\n"
+        while True:
+            changes = Change.query.filter(Change.site_id==site_id, Change.seq > cursor).order_by(Change.seq).limit(1000).all()
+            db.session.close()
+            for change in changes:
+                cursor = change.seq
+                yield "id: {}\nevent: {}\ndata: {}\n\n".format(change.seq, change.action, json.dumps(change_schema.dump(change)))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not broker.wait(site_id, cursor, min(keepalive, remaining)):
+                yield ": keepalive\n\n"
+
+    response = Response(stream_with_context(stream(since)), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Released once the server closes the response, even when the stream never started.
+    response.call_on_close(slots.release)
+    return response
+
+def _streams_busy():
+    response = jsonify({
+        "error": "Service unavailable",
+        "message": "Too many open change streams, try again shortly"
+    })
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+@site_endpoint.route("/v1/sites/<site_id>/export")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+def export_site(site_id):
+    """Export the metadata of a site as NDJSON
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+    responses:
+      200:
+        description: One JSON document per line, the site first, then its folders with parents before children, then its files
+    """
+    response = serializers.ndjson_response(transfer.export_site(site_id))
+    response.headers["Content-Disposition"] = "attachment; filename={}.ndjson".format(site_id)
+    return response
+
+
+@site_endpoint.route("/v1/sites/<site_id>/duplicates")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+def get_duplicates(site_id):
+    """List files of a site with the same content
+    ---
+    tags: [Files]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of groups to return, at most 1000
+    responses:
+      200:
+        description: Groups of files with the same hash, the ones keeping a single copy would reclaim the most bytes from first
+      400:
+        description: limit is not a number
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 1000))
+    except ValueError:
+        return jsonify({
+            "error": "Bad request",
+            "message": "limit must be a number"
+        }), 400
+    groups = duplicate_groups(File.site_id==site_id, limit=limit)
+    return jsonify({"reclaimable": sum(g["reclaimable"] for g in groups), "groups": groups})
+
+@site_endpoint.route("/v1/sites/<site_id>/files/<file_id>/versions")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+def get_file_versions(site_id, file_id):
+    """List the versions of a file
+    ---
+    tags: [Files]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file
+    responses:
+      200:
+        description: Every version of the file from the oldest, the last one is the current content
+      404:
+        description: File not found
+    """
+    file = File.query.filter(File.id==file_id, File.site_id==site_id, File.deleted==False).first()
+    if not file:
+        return jsonify({
+            "error": "Not found",
+            "message": "File not found"
+        }), 404
+    history = FileVersion.query.filter(FileVersion.file_id==file.id).order_by(FileVersion.number).all()
+    current = dict(number=file.version, name=file.name, ext=file.ext, mimetype=file.mimetype, size=file.size,
+                   hash=file.hash, created_at=None, current=True)
+    return jsonify([dict(v, current=False) for v in FileVersionSchema(many=True).dump(history)] + [current])
+
+@site_endpoint.route("/v1/sites/<site_id>/files/<file_id>/versions/<int:number>")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+@rate_limit("download")
+@throttled
+def get_file_version(site_id, file_id, number):
+    """Retrieve the content of a version of a file
+    ---
+    tags: [Files]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file
+      - name: number
+        in: path
+        type: integer
+        required: true
+        description: The version number
+    responses:
+      200:
+        description: The content of the file as it was in that version
+      404:
+        description: File or version not found
+    """
+    file = File.query.filter(File.id==file_id, File.site_id==site_id, File.deleted==False).first()
+    if file and number == file.version:
+        return send_blob(site_id, file)
+    version = file and FileVersion.query.filter(FileVersion.file_id==file.id, FileVersion.number==number).first()
+    if not version:
+        return jsonify({
+            "error": "Not found",
+            "message": "Version not found"
+        }), 404
+    return send_content(versions.content(site_id, version), version.mimetype, version.size, version.hash or version.id)
+
+@site_endpoint.route("/v1/sites/<site_id>/files/<file_id>/versions", methods=["POST"])
+@upload_limit("UPLOAD_MAX_SIZE")
+@jwt_required()
+@check_site_permissions("site_id", "write")
+@rate_limit("upload")
+@throttled
+def add_file_version(site_id, file_id):
+    """Upload new content for a file, keeping the current content as a version
+    ---
+    tags: [Files]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file
+      - name: file
+        in: formData
+        type: file
+        required: true
+        description: FormData of file
+    responses:
+      403:
+        description: Requires write access to the site
+      201:
+        description: Returns the new version number
+      400:
+        description: file not given in body
+      404:
+        description: File not found
+      413:
+        description: Body larger than UPLOAD_MAX_SIZE
+    """
+    if "file" not in request.files or request.files["file"].filename == "":
+        return jsonify({
+            "error": "Bad request",
+            "message": "file not given"
+        }), 400
+    file = File.query.filter(File.id==file_id, File.site_id==site_id, File.deleted==False).first()
+    if not file:
+        return jsonify({
+            "error": "Not found",
+            "message": "File not found"
+        }), 404
+    upload = request.files["file"]
+    versions.supersede(file)
+    file.mimetype, file.ext = sniff(storage.read_head(upload), upload.filename)
+    file.encoding = compression.choose_encoding(current_app.config, file.mimetype)
+    file.size, file.hash = storage.save_blob(upload, site_id, storage.blob_name(file), file.encoding,
+                                             current_app.config.get("BLOB_COMPRESSION_LEVEL"))
+    file.save_to_db()
+    Change.record(site_id, "version", file.id, file.folder_id, file.name)
+    return jsonify({"message": "Upload complete", "id": file.id, "version": file.version}), 201
+
+@site_endpoint.route("/v1/sites/<site_id>/files/<file_id>/versions/<int:number>/restore", methods=["POST"])
+@jwt_required()
+@check_site_permissions("site_id", "write")
+def restore_file_version(site_id, file_id, number):
+    """Make an earlier version the current content of a file
+    ---
+    tags: [Files]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a file
+      - name: number
+        in: path
+        type: integer
+        required: true
+        description: The version to restore
+    responses:
+      403:
+        description: Requires write access to the site
+      201:
+        description: The restored content was saved as a new version, returns its number
+      404:
+        description: File or version not found
+    """
+    file = File.query.filter(File.id==file_id, File.site_id==site_id, File.deleted==False).first()
+    version = file and FileVersion.query.filter(FileVersion.file_id==file.id, FileVersion.number==number).first()
+    if not version:
+        return jsonify({
+            "error": "Not found",
+            "message": "Version not found"
+        }), 404
+    content = versions.content(site_id, version)
+    versions.supersede(file)
+    file.mimetype, file.ext = version.mimetype, version.ext
+    file.encoding = compression.choose_encoding(current_app.config, file.mimetype)
+    file.size, file.hash = storage.write_blob(content, site_id, storage.blob_name(file), file.encoding,
+                                              current_app.config.get("BLOB_COMPRESSION_LEVEL"))
+    file.save_to_db()
+    Change.record(site_id, "version", file.id, file.folder_id, file.name)
+    return jsonify({"message": "Version restored", "id": file.id, "version": file.version}), 201
+
+
+@site_endpoint.route("/v1/sites/<site_id>/members")
+@read_only
+@jwt_required()
+@check_site_permissions("site_id")
+def get_members(site_id):
+    """List the members of a site
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: after
+        in: query
+        type: integer
+        required: false
+        description: Return members after this user id, from the last page
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of members to return, at most 1000
+    responses:
+      200:
+        description: Members ordered by user id, with their role
+      400:
+        description: after or limit is not a number
+    """
+    try:
+        after = int(request.args.get("after", 0))
+        limit = max(1, min(int(request.args.get("limit", 1000)), 1000))
+    except ValueError:
+        return jsonify({
+            "error": "Bad request",
+            "message": "after and limit must be numbers"
+        }), 400
+    rows = db.session.execute(sa.select(User.id, User.email, User.name, user_sites.c.permission)
+                              .join(user_sites, user_sites.c.user_id==User.id)
+                              .where(user_sites.c.site_id==site_id, User.id > after)
+                              .order_by(User.id).limit(limit))
+    return jsonify([{"id": id, "email": email, "name": name, "role": role} for id, email, name, role in rows])
+
+@site_endpoint.route("/v1/sites/<site_id>/members", methods=["POST"])
+@jwt_required()
+@check_site_permissions("site_id", "admin")
+def add_members(site_id):
+    """Add members to a site or change their role
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: members
+        in: body
+        type: array
+        required: true
+        description: List of {"email", "role"} with role read, write or admin
+    responses:
+      200:
+        description: Number of members added and updated, and emails without an account
+      400:
+        description: members missing or a role is not read, write or admin
+      403:
+        description: Requires admin access to the site
+    """
+    members = (request.json or {}).get("members")
+    if not isinstance(members, list) or not all(isinstance(m, dict) and m.get("role") in ("read", "write", "admin")
+                                                and m.get("email") for m in members):
+        return jsonify({
+            "error": "Bad request",
+            "message": "members must be a list of email and role, role being read, write or admin"
+        }), 400
+    roles = {m["email"]: m["role"] for m in members}
+    users = dict(db.session.execute(sa.select(User.email, User.id).where(User.email.in_(roles))).all())
+    existing = dict(db.session.execute(sa.select(user_sites.c.user_id, user_sites.c.permission)
+                                       .where(user_sites.c.site_id==site_id, user_sites.c.user_id.in_(users.values()))).all())
+    added = [dict(user_id=user_id, site_id=site_id, permission=roles[email])
+             for email, user_id in users.items() if user_id not in existing]
+    # The owner keeps their role, whoever tries to change it.
+    updated = [dict(member_id=user_id, role=roles[email]) for email, user_id in users.items()
+               if user_id in existing and existing[user_id] not in (roles[email], "owner")]
+    if added:
+        db.session.execute(sa.insert(user_sites), added)
+    if updated:
+        db.session.execute(sa.update(user_sites)
+                           .where(user_sites.c.site_id==site_id, user_sites.c.user_id==sa.bindparam("member_id"))
+                           .values(permission=sa.bindparam("role")), updated)
+    invalidate_members(site_id, [row["user_id"] for row in added] + [row["member_id"] for row in updated])
+    return jsonify({
+        "added": len(added),
+        "updated": len(updated),
+        "unknown": sorted(set(roles) - set(users))
+    })
+
+@site_endpoint.route("/v1/sites/<site_id>/members/<int:user_id>", methods=["DELETE"])
+@jwt_required()
+@check_site_permissions("site_id", "admin")
+def remove_member(site_id, user_id):
+    """Remove a member from a site
+    ---
+    tags: [Sites]
+    parameters:
+      - name: site_id
+        in: path
+        type: string
+        required: true
+        description: The ID of a site
+      - name: user_id
+        in: path
+        type: integer
+        required: true
+        description: The ID of the user to remove
+    responses:
+      200:
+        description: Member removed
+      403:
+        description: Requires admin access to the site, or the member is the owner
+      404:
+        description: The user is not a member of the site
+    """
+    role = db.session.execute(sa.select(user_sites.c.permission)
+                              .where(user_sites.c.site_id==site_id, user_sites.c.user_id==user_id)).scalar()
+    if role is None:
+        return jsonify({
+            "error": "Not found",
+            "message": "Member not found"
+        }), 404
+    if role == "owner":
+        return jsonify({
+            "error": "Forbidden",
+            "message": "The owner of a site can't be removed"
+        }), 403
+    db.session.execute(sa.delete(user_sites).where(user_sites.c.site_id==site_id, user_sites.c.user_id==user_id))
+    invalidate_members(site_id, [user_id])
+    return jsonify({"message": "Member removed"}), 200
@@ -0,0 +1,57 @@
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+
+# Tables holding the contents of a site, which live on the site's shard.
+# Every shard has the full schema and a copy of the rows in sites for the
+# sites it holds, the rest of the global tables are only used on the primary.
+SHARDED_TABLES = frozenset(["folders", "files", "file_versions", "chunks", "version_chunks", "changes", "folder_trees"])
+DEFAULT_SHARD = "default"
+
+class RoutingSession(Session):
+    """Session that sends reads to the ``replica`` bind while the current request is marked read only.
+
+    Flushes always go to the primary, so a read only request that ends up writing
+    still writes to the right database. Statements on the sharded tables go to
+    the shard in ``g.site_shard``, set once the site of a request is known.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = current_shard()
+            if shard is not None and _is_sharded(mapper, clause):
+                return self._db.engines[shard_bind(shard)]
+        if bind is None and not self._flushing and use_replica():
+            engines = self._db.engines
+            if "replica" in engines and not _has_bind_key(mapper):
+                return engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def use_replica():
+    return has_app_context() and g.get("read_only", False)
+
+def current_shard():
+    """Return the shard of the current site, or None for the primary."""
+    if not has_app_context():
+        return None
+    shard = g.get("site_shard")
+    return None if shard in (None, DEFAULT_SHARD) else shard
+
+def shard_bind(shard):
+    return "shard:" + shard
+
+def _is_sharded(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is None:
+        return False
+    table = getattr(clause, "table", None)
+    if table is not None:
+        return getattr(table, "name", None) in SHARDED_TABLES
+    froms = clause.get_final_froms() if hasattr(clause, "get_final_froms") else []
+    return any(t.name in SHARDED_TABLES for f in froms for t in sa.sql.util.find_tables(f, include_joins=True))
+
+def _has_bind_key(mapper):
+    if mapper is None:
+        return False
+    return sa.inspect(mapper).local_table.metadata.info.get("bind_key") is not None
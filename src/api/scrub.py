@@ -0,0 +1,221 @@
+from api.models import db, File, Change
+from api.cache import invalidate_site
+from api import storage, compression, uploads
+from collections import namedtuple
+import sqlalchemy as sa
+import hashlib
+import shutil
+import time
+import os
+
+# Folders in a site folder that don't hold current blobs.
+SKIP_DIRS = {".trash", ".versions", ".chunks"}
+
+# kind is one of missing, misnamed, untrashed, mismatch, orphan, unknown_site and stale_part.
+Issue = namedtuple("Issue", "kind site_id name detail repaired")
+
+def list_blobs(folder):
+    """Return the size and mtime of every blob directly in ``folder``, by name."""
+    blobs = {}
+    if not os.path.isdir(folder):
+        return blobs
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name in SKIP_DIRS or entry.name.endswith(".tmp") or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            blobs[entry.name] = (stat.st_size, stat.st_mtime)
+    return blobs
+
+def split_blob_name(name):
+    """Return the file id, extension and encoding a blob name was made from."""
+    encoding = None
+    for candidate, suffix in compression.SUFFIXES.items():
+        if name.endswith(suffix) and name.count(".") > 1:
+            encoding = candidate
+            name = name[:-len(suffix)]
+            break
+    id, dot, ext = name.partition(".")
+    return id, dot + ext, encoding
+
+def verify_blob(path, encoding=None, rate=0):
+    """Return the decoded size and sha256 of the blob at ``path``.
+
+    Reads at most ``rate`` bytes per second from disk when given. Runs in
+    worker processes, so it must not touch the app context.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    read = 0
+    start = time.monotonic()
+    decoder = compression.decompressor(encoding) if encoding else None
+    with open(path, "rb") as f:
+        for raw in iter(lambda: f.read(storage.COPY_BUFFER_SIZE), b""):
+            data = decoder.decompress(raw) if decoder else raw
+            digest.update(data)
+            size += len(data)
+            if rate:
+                read += len(raw)
+                ahead = read / rate - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    if decoder and hasattr(decoder, "flush"):
+        data = decoder.flush()
+        digest.update(data)
+        size += len(data)
+    return size, digest.hexdigest()
+
+def scrub_site(site_id, executor=None, repair=False, rate=0, grace=3600, batch_size=1000):
+    """Compare the file rows of a site with the blobs in its folder and yield an Issue for each difference.
+
+    The folder is listed first and the rows are streamed after, so a blob
+    written since isn't reported missing, and blobs younger than ``grace``
+    seconds without a row are left alone as uploads in flight. With an
+    ``executor`` every blob is hashed on it, otherwise only sizes of raw
+    blobs are compared. With ``repair``:
+
+    * a blob under another extension or encoding of its id, or still in the
+      trash, is put back under the name the row expects,
+    * a row whose blob is gone is marked deleted, like a removed file,
+    * a deleted file's blob left in the site folder is moved to the trash,
+    * a row without a size or hash takes the blob's, one whose size or
+      hash differ from its blob is only reported, the row being the record
+      of what was uploaded,
+    * a blob without a row is moved to the trash.
+    """
+    site_id = str(site_id)
+    folder = storage.site_path(site_id)
+    blobs = list_blobs(folder)
+    by_id = {}
+    for name in blobs:
+        by_id.setdefault(split_blob_name(name)[0], []).append(name)
+    repaired = False
+
+    columns = (File.id, File.ext, File.encoding, File.size, File.hash, File.deleted, File.folder_id, File.name)
+    engine = db.session.get_bind(mapper=File)
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True, yield_per=batch_size) \
+            .execute(sa.select(*columns).where(File.site_id == site_id).order_by(File.id))
+        for batch in iter(lambda: rows.fetchmany(batch_size), []):
+            jobs = []
+            for row in batch:
+                name = storage.blob_name(row)
+                entry = blobs.pop(name, None)
+                if row.deleted:
+                    if entry:
+                        yield _untrashed(site_id, name, repair)
+                    continue
+                if entry is None:
+                    if os.path.exists(os.path.join(folder, name)):
+                        continue
+                    issue = _missing(site_id, row, name, blobs, by_id.get(row.id, []), repair)
+                    repaired |= issue.repaired
+                    yield issue
+                    continue
+                if executor:
+                    jobs.append((row, name, executor.submit(verify_blob, os.path.join(folder, name), row.encoding, rate)))
+                elif not row.encoding and row.size is not None and entry[0] != row.size:
+                    issue = _mismatch(site_id, row, name, entry[0], None, repair)
+                    repaired |= issue.repaired
+                    yield issue
+            for row, name, job in jobs:
+                try:
+                    size, hash = job.result()
+                except Exception as e:
+                    # Truncated or corrupt compressed blobs fail to decode.
+                    yield Issue("mismatch", site_id, name, "unreadable: {}".format(e), False)
+                    continue
+                if size != row.size or hash != row.hash:
+                    issue = _mismatch(site_id, row, name, size, hash, repair)
+                    repaired |= issue.repaired
+                    yield issue
+            if repair:
+                db.session.commit()
+
+    cutoff = time.time() - grace
+    for name, (size, mtime) in sorted(blobs.items()):
+        if mtime > cutoff:
+            continue
+        moved = False
+        if repair:
+            moved = _trash(folder, name)
+        yield Issue("orphan", site_id, name, "{} bytes without a file row".format(size), moved)
+    if repaired:
+        invalidate_site(site_id)
+
+def unknown_sites(site_ids):
+    """Yield an Issue for each folder in DATA_FOLDER that doesn't belong to one of ``site_ids``."""
+    root = storage.site_path("")
+    if not os.path.isdir(root):
+        return
+    known = {str(site_id) for site_id in site_ids}
+    for name in sorted(os.listdir(root)):
+        # Dot folders, like .incoming for uploads being parsed, aren't sites.
+        if name not in known and not name.startswith(".") and os.path.isdir(os.path.join(root, name)):
+            yield Issue("unknown_site", name, "", "folder without a site row", False)
+
+def stale_parts(grace=3600, repair=False):
+    """Yield an Issue for each upload part older than ``grace`` seconds, left behind by a worker that died while parsing."""
+    folder = uploads.incoming_path()
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - grace
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not name.endswith(".part") or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+            continue
+        size = os.path.getsize(path)
+        if repair:
+            storage._remove(path)
+        yield Issue("stale_part", "", name, "{} bytes of an upload that never finished".format(size), repair)
+
+def _missing(site_id, row, name, blobs, candidates, repair):
+    folder = storage.site_path(site_id)
+    candidates = [c for c in candidates if c in blobs]
+    if os.path.exists(os.path.join(storage.trash_path(site_id), name)):
+        source, detail = os.path.join(storage.trash_path(site_id), name), "blob is in the trash"
+        encoding = row.encoding
+    elif len(candidates) == 1:
+        source, detail = os.path.join(folder, candidates[0]), "blob is named {}".format(candidates[0])
+        encoding = split_blob_name(candidates[0])[2]
+        # The extension comes from the row, a stale one on disk is renamed but an encoding is kept.
+        blobs.pop(candidates[0])
+    else:
+        if repair:
+            db.session.execute(sa.update(File.__table__).where(File.id == row.id).values(deleted=True))
+            Change.record(site_id, "delete", row.id, row.folder_id, row.name)
+        return Issue("missing", site_id, name, "no blob, file marked deleted" if repair else "no blob", repair)
+    if repair:
+        target = row.id + (row.ext or "") + compression.SUFFIXES.get(encoding, "")
+        os.rename(source, os.path.join(folder, target))
+        if encoding != row.encoding:
+            db.session.execute(sa.update(File.__table__).where(File.id == row.id).values(encoding=encoding))
+    return Issue("misnamed", site_id, name, detail, repair)
+
+def _untrashed(site_id, name, repair):
+    moved = _trash(storage.site_path(site_id), name) if repair else False
+    return Issue("untrashed", site_id, name, "file is deleted but its blob wasn't moved to the trash", moved)
+
+def _mismatch(site_id, row, name, size, hash, repair):
+    detail = []
+    values = {}
+    if size != row.size:
+        detail.append("size {} on disk, {} in the row".format(size, row.size))
+        values["size"] = size
+    if hash is not None and hash != row.hash:
+        detail.append("sha256 {} on disk, {} in the row".format(hash, row.hash))
+        values["hash"] = hash
+    # Filling in what was never recorded is safe, overwriting a recorded value
+    # would take a rotten or tampered blob for the truth and lose the evidence.
+    fillable = all(getattr(row, column) is None for column in values)
+    if repair and fillable:
+        db.session.execute(sa.update(File.__table__).where(File.id == row.id).values(**values))
+    return Issue("mismatch", site_id, name, ", ".join(detail), repair and fillable)
+
+def _trash(folder, name):
+    trash = os.path.join(folder, ".trash")
+    os.makedirs(trash, exist_ok=True)
+    if os.path.exists(os.path.join(trash, name)):
+        return False
+    shutil.move(os.path.join(folder, name), trash)
+    return True
@@ -0,0 +1,95 @@
+from flask import Response, stream_with_context
+from api.models import db, File, FileSchema, Folder, FolderSchema, Site, SiteSchema
+from api import sharding
+import sqlalchemy as sa
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The columns the schemas dump, so the fast path can never drift from them.
+FILE_FIELDS = tuple(FileSchema().fields)
+FOLDER_FIELDS = tuple(name for name in FolderSchema().fields if name not in ("children", "file_count"))
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), default=str).encode()
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype="application/json")
+
+def ndjson_response(rows):
+    """Stream one JSON document per line, so the client can start before the query finishes."""
+    def stream():
+        for row in rows:
+            yield dumps(row) + b"\n"
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+def file_rows(*criteria):
+    """Return the FileSchema dump of the files matching ``criteria`` as dicts, straight from tuples."""
+    return [dict(zip(FILE_FIELDS, row)) for row in db.session.execute(_file_query(criteria))]
+
+def stream_file_rows(*criteria):
+    """Like ``file_rows`` but fetched with a server-side cursor on a connection of its own.
+
+    The request commits before a streamed body is sent, so the rows can't
+    come from the session's transaction.
+    """
+    engine = db.session.get_bind(mapper=File)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=1000).execute(_file_query(criteria))
+        for row in result:
+            yield dict(zip(FILE_FIELDS, row))
+
+def _file_query(criteria):
+    return sa.select(*[getattr(File, name) for name in FILE_FIELDS]).where(*criteria).order_by(File.id)
+
+def folder_tree(site_id, root_id=None):
+    """Return the FolderSchema dump of the top level folders (or ``root_id``) with all descendants.
+
+    Two queries for the whole site, instead of one per folder for the
+    children and one more for each file count.
+    """
+    counts = dict(db.session.execute(sa.select(File.folder_id, sa.func.count())
+                                     .where(File.site_id == site_id, File.folder_id.isnot(None))
+                                     .group_by(File.folder_id)).all())
+    nodes = {}
+    children = {}
+    query = sa.select(*[getattr(Folder, name) for name in FOLDER_FIELDS]).where(Folder.site_id == site_id).order_by(Folder.id)
+    for row in db.session.execute(query):
+        node = dict(zip(FOLDER_FIELDS, row))
+        node["site_id"] = str(node["site_id"])
+        node["file_count"] = counts.get(node["id"], 0)
+        node["children"] = children.setdefault(node["id"], [])
+        nodes[node["id"]] = node
+        children.setdefault(node["parent_id"], []).append(node)
+    if root_id is not None:
+        return nodes.get(root_id)
+    return children.get(None, [])
+
+def site_rows(*criteria):
+    """Return the SiteSchema dump of the matching sites, counting rows in the database."""
+    if sharding.is_sharded():
+        return _sharded_site_rows(criteria)
+    folder_count = sa.select(sa.func.count()).where(Folder.site_id == Site.id).correlate(Site).scalar_subquery()
+    file_count = sa.select(sa.func.count()).where(File.site_id == Site.id).correlate(Site).scalar_subquery()
+    query = sa.select(Site.id, Site.name, folder_count, file_count).where(*criteria).order_by(Site.name)
+    return [{"id": str(id), "name": name, "folder_count": folders, "file_count": files}
+            for id, name, folders, files in db.session.execute(query)]
+
+def _sharded_site_rows(criteria):
+    # Sites are on the primary and their folders and files on their shards, so count on each shard.
+    sites = db.session.execute(sa.select(Site.id, Site.name).where(*criteria).order_by(Site.name)).all()
+    folder_counts = {}
+    file_counts = {}
+    for shard, site_ids in sharding.group_by_shard([id for id, name in sites]).items():
+        with sharding.using(shard):
+            folder_counts.update(db.session.execute(sa.select(Folder.site_id, sa.func.count())
+                                                    .where(Folder.site_id.in_(site_ids)).group_by(Folder.site_id)).all())
+            file_counts.update(db.session.execute(sa.select(File.site_id, sa.func.count())
+                                                  .where(File.site_id.in_(site_ids)).group_by(File.site_id)).all())
+    return [{"id": str(id), "name": name, "folder_count": folder_counts.get(id, 0), "file_count": file_counts.get(id, 0)}
+            for id, name in sites]
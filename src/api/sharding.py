@@ -0,0 +1,169 @@
+from flask import current_app, g
+from contextlib import contextmanager
+from functools import wraps
+from api.models import (db, Site, SiteShard, Folder, File, FileVersion, Chunk, Change, FolderTree, version_chunks)
+from api.routing import DEFAULT_SHARD, shard_bind
+from api.cache import invalidate_site
+import sqlalchemy as sa
+
+# A site's folders, files and everything hanging off them live on one shard,
+# found in the site_shards directory on the primary. Shards are binds named
+# shard:<name> in SQLALCHEMY_BINDS, see SITE_SHARDS, and the primary is the
+# default shard.
+
+BATCH_SIZE = 1000
+
+def shard_names():
+    binds = current_app.config.get("SQLALCHEMY_BINDS") or {}
+    return [DEFAULT_SHARD] + sorted(key[len("shard:"):] for key in binds if key.startswith("shard:"))
+
+def is_sharded():
+    return len(shard_names()) > 1
+
+def engine(shard):
+    return db.engines[None if shard == DEFAULT_SHARD else shard_bind(shard)]
+
+def shard_of(site_id, primary=False):
+    """Return the shard and state of a site, read from the primary with ``primary`` even in read only requests."""
+    row = db.session.execute(sa.select(SiteShard.shard, SiteShard.state).where(SiteShard.site_id == site_id),
+                             bind_arguments={"bind": db.engines[None] if primary else None}).first()
+    return tuple(row) if row else (DEFAULT_SHARD, "active")
+
+@contextmanager
+def using(shard):
+    """Send the statements on the sharded tables in the block to ``shard``."""
+    previous = g.get("site_shard")
+    g.site_shard = shard
+    try:
+        yield
+    finally:
+        g.site_shard = previous
+
+def use_site(site_id):
+    """Route the rest of the request to the shard of ``site_id``, for routes that don't check site permissions."""
+    g.site_shard = shard_of(site_id)[0]
+
+def hold_site(site_id, shard):
+    """Keep a site on ``shard`` until the current transaction ends, for requests that write to it.
+
+    Takes a key share lock on the site row on the shard, which writers don't
+    conflict on but a move waits for before it copies anything, then reads
+    the directory again: a move that started since the site was looked up
+    holds the row until its copy is done, and is seen here once it lets go.
+    Returns False when the site is moving or no longer on ``shard``.
+    """
+    db.session.execute(sa.select(Site.id).where(Site.id == site_id).with_for_update(read=True, key_share=True),
+                       bind_arguments={"bind": engine(shard)})
+    return shard_of(site_id) == (shard, "active")
+
+def group_by_shard(site_ids):
+    """Return the given site ids by shard, in one directory query."""
+    placed = dict(db.session.execute(sa.select(SiteShard.site_id, SiteShard.shard)
+                                     .where(SiteShard.site_id.in_(site_ids))).all()) if site_ids else {}
+    shards = {}
+    for site_id in site_ids:
+        shards.setdefault(placed.get(site_id, DEFAULT_SHARD), []).append(site_id)
+    return shards
+
+def each_shard(fn):
+    """Run a command over all sites once per shard, for commands that query every site at once."""
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        for shard in shard_names():
+            with using(shard):
+                fn(*args, **kwargs)
+    return decorator
+
+def place_site(site):
+    """Put a new site on NEW_SITE_SHARD, after it was added to the session."""
+    shard = current_app.config.get("NEW_SITE_SHARD") or DEFAULT_SHARD
+    if shard == DEFAULT_SHARD or shard not in shard_names():
+        return
+    db.session.flush()
+    db.session.add(SiteShard(site_id=site.id, shard=shard))
+    db.session.execute(sa.insert(Site.__table__).values(id=site.id, name=site.name, change_seq=0),
+                       bind_arguments={"bind": engine(shard)})
+
+def _site_tables(site_id):
+    """Return a select for the rows of every sharded table of a site, parents before children."""
+    tree = sa.select(Folder.id, sa.literal(0).label("depth")) \
+        .where(Folder.site_id == site_id, Folder.parent_id == None).cte("tree", recursive=True)
+    tree = tree.union_all(sa.select(Folder.id, tree.c.depth + 1).where(Folder.parent_id == tree.c.id))
+    files = sa.select(File.id).where(File.site_id == site_id)
+    versions = sa.select(FileVersion.id).where(FileVersion.file_id.in_(files))
+    return [
+        (Folder.__table__, sa.select(*Folder.__table__.c).join(tree, tree.c.id == Folder.id).order_by(tree.c.depth, Folder.id)),
+        (File.__table__, sa.select(*File.__table__.c).where(File.site_id == site_id).order_by(File.id)),
+        (FileVersion.__table__, sa.select(*FileVersion.__table__.c).where(FileVersion.file_id.in_(files))),
+        (Chunk.__table__, sa.select(*Chunk.__table__.c).where(Chunk.site_id == site_id)),
+        (version_chunks, sa.select(*version_chunks.c).where(version_chunks.c.version_id.in_(versions))),
+        # Change ids come from a sequence on each shard, the seq column orders a site's changes.
+        (Change.__table__, sa.select(*[c for c in Change.__table__.c if c.name != "id"])
+         .where(Change.site_id == site_id).order_by(Change.id)),
+        (FolderTree.__table__, sa.select(*FolderTree.__table__.c).where(FolderTree.site_id == site_id)),
+    ]
+
+def _delete_site_rows(conn, site_id, keep_site):
+    files = sa.select(File.id).where(File.site_id == site_id)
+    versions = sa.select(FileVersion.id).where(FileVersion.file_id.in_(files))
+    conn.execute(sa.delete(FolderTree.__table__).where(FolderTree.site_id == site_id))
+    conn.execute(sa.delete(Change.__table__).where(Change.site_id == site_id))
+    conn.execute(sa.delete(version_chunks).where(version_chunks.c.version_id.in_(versions)))
+    conn.execute(sa.delete(Chunk.__table__).where(Chunk.site_id == site_id))
+    conn.execute(sa.delete(FileVersion.__table__).where(FileVersion.file_id.in_(files)))
+    conn.execute(sa.delete(File.__table__).where(File.site_id == site_id))
+    # Children first, a folder can only go once nothing points at it.
+    while conn.execute(sa.delete(Folder.__table__).where(
+            Folder.site_id == site_id,
+            ~Folder.id.in_(sa.select(Folder.parent_id).where(Folder.site_id == site_id, Folder.parent_id.isnot(None))))).rowcount:
+        pass
+    if not keep_site:
+        conn.execute(sa.delete(Site.__table__).where(Site.id == site_id))
+
+def move_site(site_id, target, batch_size=BATCH_SIZE, echo=lambda message: None):
+    """Move the folders and files of a site to the ``target`` shard.
+
+    Reads go on from the old shard while the site is copied, writes get a
+    503 until it is done, and the ones already running are waited for. A move that was interrupted can be started again,
+    the site is copied from scratch. Blobs stay where they are.
+    """
+    source, state = shard_of(site_id)
+    if source == target:
+        if state != "active":
+            db.session.execute(sa.update(SiteShard.__table__).where(SiteShard.site_id == site_id).values(state="active"))
+            db.session.commit()
+        return 0
+    directory = db.session.get(SiteShard, site_id) or SiteShard(site_id=site_id, shard=source)
+    directory.state = "moving"
+    db.session.add(directory)
+    db.session.commit()
+
+    copied = 0
+    with engine(source).connect() as src, engine(target).begin() as dst:
+        src = src.execution_options(stream_results=True, yield_per=batch_size)
+        with src.begin():
+            # Waits for the writes holding the site, see hold_site, and keeps
+            # out the ones that come after until the copy is done.
+            site = src.execute(sa.select(*Site.__table__.c).where(Site.id == site_id).with_for_update()).one()
+            _delete_site_rows(dst, site_id, keep_site=target == DEFAULT_SHARD)
+            if dst.execute(sa.select(Site.id).where(Site.id == site_id)).first():
+                dst.execute(sa.update(Site.__table__).where(Site.id == site_id).values(change_seq=site.change_seq))
+            else:
+                dst.execute(sa.insert(Site.__table__).values(**site._mapping))
+            for table, query in _site_tables(site_id):
+                result = src.execute(query)
+                for rows in iter(lambda: result.fetchmany(batch_size), []):
+                    dst.execute(sa.insert(table), [dict(row._mapping) for row in rows])
+                    copied += len(rows)
+                    echo("{} rows copied".format(copied))
+
+    if target == DEFAULT_SHARD:
+        db.session.delete(directory)
+    else:
+        directory.shard = target
+        directory.state = "active"
+    db.session.commit()
+    with engine(source).begin() as conn:
+        _delete_site_rows(conn, site_id, keep_site=source == DEFAULT_SHARD)
+    invalidate_site(site_id)
+    return copied
@@ -0,0 +1,81 @@
+from flask import current_app
+from itsdangerous import URLSafeSerializer
+from api.models import db, File, ShareDownload
+import sqlalchemy as sa
+import shortuuid
+import datetime
+import time
+
+# Share links carry what they share and their expiry, signed with
+# SHARE_SECRET_KEY (SECRET_KEY when unset), so checking one doesn't touch the
+# database. Changing the key revokes every link.
+
+class ShareExpired(Exception):
+    pass
+
+class ShareExhausted(Exception):
+    pass
+
+class ShareOutdated(Exception):
+    pass
+
+def _serializer():
+    secret = current_app.config.get("SHARE_SECRET_KEY") or current_app.config["SECRET_KEY"]
+    return URLSafeSerializer(secret, salt="share-link")
+
+def share_file(file, expires_in=None, max_downloads=None):
+    """Return a token sharing the current version of ``file``."""
+    return _sign({"s": str(file.site_id), "f": [file.id, file.version]}, file.site_id, expires_in, max_downloads)
+
+def share_folder(folder, expires_in=None, max_downloads=None):
+    """Return a token sharing the files directly in ``folder``."""
+    return _sign({"s": str(folder.site_id), "d": folder.id}, folder.site_id, expires_in, max_downloads)
+
+def _sign(payload, site_id, expires_in, max_downloads):
+    expires_at = int(time.time()) + (expires_in or current_app.config["SHARE_TTL"])
+    payload["x"] = expires_at
+    if max_downloads:
+        payload["i"] = shortuuid.uuid()
+        ShareDownload(id=payload["i"], site_id=site_id, limit=max_downloads,
+                      expires_at=datetime.datetime.utcfromtimestamp(expires_at)).save_to_db()
+    return _serializer().dumps(payload), expires_at
+
+def load(token):
+    """Return the payload of a share token.
+
+    Raises ``BadSignature`` for tokens that weren't made here and
+    ``ShareExpired`` for the ones past their expiry.
+    """
+    payload = _serializer().loads(token)
+    if payload["x"] < time.time():
+        raise ShareExpired()
+    return payload
+
+def shared_file(payload):
+    """Return the file row a file token shares, None when it's gone.
+
+    The row is read by primary key rather than signed into the link, since
+    compressing or replacing the blob changes it. Raises ``ShareOutdated``
+    once the file has a newer version than the one shared.
+    """
+    file_id, version = payload["f"]
+    file = db.session.get(File, file_id)
+    if file is None or file.deleted or str(file.site_id) != payload["s"]:
+        return None
+    if file.version != version:
+        raise ShareOutdated()
+    return file
+
+def count_download(payload):
+    """Count a download against the link's limit, raising ``ShareExhausted`` once it's used up.
+
+    Links without a limit aren't counted. The update is conditional, so
+    concurrent downloads can't go over the limit.
+    """
+    if "i" not in payload:
+        return
+    table = ShareDownload.__table__
+    result = db.session.execute(sa.update(table).where(table.c.id == payload["i"], table.c.count < table.c.limit)
+                                .values(count=table.c.count + 1))
+    if result.rowcount != 1:
+        raise ShareExhausted()
@@ -0,0 +1,144 @@
+import mimetypes
+import pathlib
+
+# Bytes read from the start of a file to detect its type. Large enough to
+# see the first entry names of zip based office documents.
+SNIFF_SIZE = 8192
+
+# (offset, magic, mimetype, extension), the first match wins.
+SIGNATURES = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (0, b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (0, b"GIF87a", "image/gif", ".gif"),
+    (0, b"GIF89a", "image/gif", ".gif"),
+    (8, b"WEBP", "image/webp", ".webp"),
+    (0, b"II*\x00", "image/tiff", ".tif"),
+    (0, b"MM\x00*", "image/tiff", ".tif"),
+    (0, b"\x00\x00\x01\x00", "image/vnd.microsoft.icon", ".ico"),
+    (0, b"8BPS", "image/vnd.adobe.photoshop", ".psd"),
+    (0, b"%PDF-", "application/pdf", ".pdf"),
+    (0, b"%!PS", "application/postscript", ".ps"),
+    (0, b"{\\rtf", "application/rtf", ".rtf"),
+    (0, b"\x1f\x8b", "application/gzip", ".gz"),
+    (0, b"BZh", "application/x-bzip2", ".bz2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz", ".xz"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd", ".zst"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed", ".7z"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar", ".rar"),
+    (257, b"ustar", "application/x-tar", ".tar"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3", ".sqlite"),
+    (0, b"\x7fELF", "application/x-executable", ".bin"),
+    (0, b"\x00asm", "application/wasm", ".wasm"),
+    (0, b"ID3", "audio/mpeg", ".mp3"),
+    (0, b"OggS", "audio/ogg", ".ogg"),
+    (0, b"fLaC", "audio/flac", ".flac"),
+    (8, b"WAVE", "audio/wav", ".wav"),
+    (8, b"AVI ", "video/x-msvideo", ".avi"),
+    (0, b"wOFF", "font/woff", ".woff"),
+    (0, b"wOF2", "font/woff2", ".woff2"),
+    (0, b"OTTO", "font/otf", ".otf"),
+    (0, b"\x00\x01\x00\x00\x00", "font/ttf", ".ttf"),
+]
+
+# Short magic numbers that plain text can start with, only tried on binary content.
+WEAK_SIGNATURES = [
+    (0, b"BM", "image/bmp", ".bmp"),
+    (0, b"MZ", "application/vnd.microsoft.portable-executable", ".exe"),
+    (0, b"\xff\xfb", "audio/mpeg", ".mp3"),
+]
+
+# ISO base media files, by the major brand after "ftyp".
+FTYP_BRANDS = {
+    b"qt  ": ("video/quicktime", ".mov"),
+    b"M4A ": ("audio/mp4", ".m4a"),
+    b"heic": ("image/heic", ".heic"),
+    b"heix": ("image/heic", ".heic"),
+    b"mif1": ("image/heif", ".heif"),
+    b"avif": ("image/avif", ".avif"),
+}
+
+# Zip based formats, by a marker among the first entries.
+ZIP_MARKERS = [
+    (b"mimetypeapplication/epub+zip", "application/epub+zip", ".epub"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.text", "application/vnd.oasis.opendocument.text", ".odt"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.spreadsheet", "application/vnd.oasis.opendocument.spreadsheet", ".ods"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.presentation", "application/vnd.oasis.opendocument.presentation", ".odp"),
+    (b"word/", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", ".docx"),
+    (b"xl/", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    (b"ppt/", "application/vnd.openxmlformats-officedocument.presentationml.presentation", ".pptx"),
+]
+
+# Old Office documents share one container format, only the name tells them apart.
+OLE_TYPES = {
+    ".doc": "application/msword",
+    ".xls": "application/vnd.ms-excel",
+    ".ppt": "application/vnd.ms-powerpoint",
+    ".msg": "application/vnd.ms-outlook",
+}
+
+def sniff(head, filename):
+    """Return the mimetype and normalized extension of a file from its first SNIFF_SIZE bytes.
+
+    The type comes from the content, the client's file name only picks
+    between types the content can't tell apart and keeps an extension
+    that is a valid alias, like .jpeg for a JPEG. Extensions are lowercase
+    and never empty, files are only served under their extension, so
+    content without one the name can give is stored as .bin.
+    """
+    given = pathlib.Path(filename or "").suffix.lower()
+    if not head:
+        return mimetypes.guess_type("x" + given)[0] or "application/octet-stream", given or ".bin"
+    detected = _detect(head, given)
+    if detected is None:
+        return "application/octet-stream", given or ".bin"
+    mimetype, ext = detected
+    if given and given != ext and mimetypes.guess_type("x" + given)[0] == mimetype:
+        ext = given
+    return mimetype, ext or ".bin"
+
+def _detect(head, given):
+    for offset, magic, mimetype, ext in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mimetype, ext
+    if head[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(head[8:12], ("video/mp4", ".mp4"))
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return ("video/webm", ".webm") if b"webm" in head[:64] else ("video/x-matroska", ".mkv")
+    if head.startswith((b"PK\x03\x04", b"PK\x05\x06")):
+        for marker, mimetype, ext in ZIP_MARKERS:
+            if marker in head:
+                return mimetype, ext
+        return "application/zip", ".zip"
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        if given in OLE_TYPES:
+            return OLE_TYPES[given], given
+        return "application/x-ole-storage", given
+    if _is_text(head):
+        return _text_type(head, given)
+    for offset, magic, mimetype, ext in WEAK_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mimetype, ext
+    return None
+
+def _is_text(head):
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return True
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # The head can end halfway through a character.
+        return e.start >= len(head) - 3 and e.reason == "unexpected end of data"
+    return True
+
+def _text_type(head, given):
+    start = head.lstrip()[:256].lower()
+    if b"<svg" in start or (start.startswith(b"<?xml") and b"<svg" in head.lower()):
+        return "image/svg+xml", ".svg"
+    guessed = mimetypes.guess_type("x" + given)[0] if given else None
+    # Keep the client's type for text formats, never let text pass as a binary type.
+    if guessed and (guessed.startswith("text/") or guessed in ("application/json", "application/xml", "application/javascript",
+                                                                "application/x-sh", "application/x-yaml", "image/svg+xml")):
+        return guessed, given
+    return "text/plain", given or ".txt"
@@ -0,0 +1,104 @@
+from flask import Flask
+from flask.cli import ScriptInfo
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+import threading
+import click
+import json
+
+TEMPLATE = {
+    "swagger": "2.0",
+    "info": {
+        "title": "docudir API Docs",
+        "version": "1.0"
+    },
+    "basePath": "/",  # base bash for blueprint registration
+    "schemes": [
+        "http",
+        "https"
+    ],
+    "securityDefinitions": {
+        "Bearer": {
+            "type": "apiKey",
+            "name": "Authorization",
+            "in": "header",
+            "description": "JWT Authorization header using the Bearer scheme. Example: \"Authorization: Bearer {token}\""
+        }
+    },
+    "security": [
+        {
+            "Bearer": []
+        }
+    ]
+}
+
+def init_swagger(app):
+    """Set up the API docs according to SWAGGER_MODE.
+
+    ``eager`` registers Flasgger on the app at import time. ``lazy`` and
+    ``static`` mount a separate docs app on /apidocs that is only built,
+    and only imports Flasgger, on the first request to it. ``static``
+    serves the spec written by ``flask openapi dump`` instead of
+    generating it. ``off`` disables the docs.
+    """
+    mode = app.config.get("SWAGGER_MODE", "lazy")
+    if mode == "eager":
+        from flasgger import Swagger
+        return Swagger(app, template=TEMPLATE)
+    if mode in ("lazy", "static"):
+        spec_file = app.config.get("SWAGGER_SPEC_FILE") if mode == "static" else None
+        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {"/apidocs": LazyDocs(app, spec_file)})
+
+class LazyDocs:
+    def __init__(self, app, spec_file=None):
+        self.app = app
+        self.spec_file = spec_file
+        self.docs = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self.docs is None:
+            with self.lock:
+                if self.docs is None:
+                    self.docs = build_docs_app(self.app, self.spec_file)
+        return self.docs(environ, start_response)
+
+def build_docs_app(app, spec_file=None):
+    """Build a Flask app serving Swagger UI and the spec of ``app``'s routes."""
+    from flasgger import Swagger
+
+    class APISwagger(Swagger):
+        def get_apispecs(self, endpoint="apispec_1"):
+            if endpoint not in self.apispecs:
+                if spec_file:
+                    with open(spec_file) as f:
+                        self.apispecs[endpoint] = json.load(f)
+                else:
+                    # Flasgger reads the routes from current_app.
+                    with app.app_context():
+                        self.apispecs[endpoint] = super().get_apispecs(endpoint)
+            return self.apispecs[endpoint]
+
+    docs = Flask(__name__)
+    APISwagger(docs, template=TEMPLATE, config=dict(Swagger.DEFAULT_CONFIG, specs_route="/"))
+    return docs
+
+class LazyMigrateGroup(click.Group):
+    """The ``flask db`` group, importing Flask-Migrate and Alembic only when it is used."""
+
+    def __init__(self, db, **kwargs):
+        super().__init__(name="db", help="Perform database migrations.", **kwargs)
+        self.db = db
+
+    def migrate_group(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as db_group
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if "migrate" not in app.extensions:
+            Migrate(app, self.db)
+        return db_group
+
+    def list_commands(self, ctx):
+        return self.migrate_group(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.migrate_group(ctx).get_command(ctx, name)
@@ -0,0 +1,155 @@
+from flask import current_app
+from api.unit_of_work import current_unit_of_work
+from api.metrics import timed
+from api.sniffing import SNIFF_SIZE
+from api.compression import SUFFIXES, compressor, decompress_file
+import os
+import shutil
+import hashlib
+import errno
+import mmap
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def site_path(site_id):
+    return os.path.join(current_app.config["DATA_FOLDER"], str(site_id))
+
+def trash_path(site_id):
+    return os.path.join(site_path(site_id), ".trash")
+
+def blob_name(file):
+    return str(file.id + (file.ext or "") + SUFFIXES.get(file.encoding, ""))
+
+def read_head(upload):
+    """Return the first bytes of an upload for sniffing, leaving the stream where it was."""
+    head = upload.stream.read(SNIFF_SIZE)
+    upload.stream.seek(0)
+    return head
+
+@timed("save")
+def save_blob(upload, site_id, name, encoding=None, level=None):
+    """Write an uploaded file into the site folder, removing it again if the request rolls back.
+
+    With ``encoding`` the blob is compressed as it is written. Returns the
+    size and sha256 of the uploaded content, computed in the same pass, or
+    while the upload was spooled for parts of an ``UploadRequest``.
+    """
+    stream = upload.stream
+    if not encoding and hasattr(stream, "claim"):
+        # Spooled to the data volume while parsing, moving it into place is enough.
+        path = os.path.join(site_path(site_id), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if stream.claim(path):
+            _undo(_remove, path)
+            return stream.size, stream.digest.hexdigest()
+    return write_blob(iter(lambda: stream.read(COPY_BUFFER_SIZE), b""), site_id, name, encoding, level)
+
+def write_blob(chunks, site_id, name, encoding=None, level=None):
+    """Like ``save_blob`` for content given as an iterable of bytes."""
+    folder = site_path(site_id)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, name)
+    digest = hashlib.sha256()
+    size = 0
+    _undo(_remove, path)
+    encoder = compressor(encoding, level) if encoding else None
+    with open(path, "wb") as dst:
+        for chunk in chunks:
+            digest.update(chunk)
+            dst.write(encoder.compress(chunk) if encoder else chunk)
+            size += len(chunk)
+        if encoder:
+            dst.write(encoder.flush())
+    return size, digest.hexdigest()
+
+def read_blob(path, encoding=None):
+    """Yield the decoded content of the blob at ``path``."""
+    if encoding:
+        return decompress_file(path, encoding, COPY_BUFFER_SIZE)
+    return _read_chunks(path)
+
+def _read_chunks(path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            yield chunk
+
+@timed("move")
+def move_blob(path, destination):
+    """Move a blob, putting it back if the request rolls back."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.rename(path, destination)
+    _undo(os.rename, destination, path)
+
+@timed("rename")
+def rename_blob(site_id, old_name, new_name):
+    old_path = os.path.join(site_path(site_id), old_name)
+    new_path = os.path.join(site_path(site_id), new_name)
+    os.rename(old_path, new_path)
+    _undo(os.rename, new_path, old_path)
+
+@timed("trash")
+def trash_blob(site_id, name):
+    trash = trash_path(site_id)
+    if not os.path.exists(trash):
+        os.makedirs(trash)
+    path = os.path.join(site_path(site_id), name)
+    shutil.move(path, trash)
+    _undo(shutil.move, os.path.join(trash, name), path)
+
+def _undo(fn, *args):
+    uow = current_unit_of_work()
+    if uow:
+        uow.on_rollback(fn, *args)
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def copy_blob(source, destination, link=False):
+    """Copy or hardlink ``source`` to ``destination`` and return its size and sha256.
+
+    Runs in worker processes, so it must not touch the app context.
+    """
+    digest = hashlib.sha256()
+    if link:
+        try:
+            if os.path.exists(destination):
+                os.remove(destination)
+            os.link(source, destination)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            link = False
+    if link:
+        with open(source, "rb") as src:
+            for chunk in iter(lambda: src.read(COPY_BUFFER_SIZE), b""):
+                digest.update(chunk)
+    else:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            for chunk in iter(lambda: src.read(COPY_BUFFER_SIZE), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+    return os.path.getsize(destination), digest.hexdigest()
+
+def hash_blob(path, encoding=None):
+    """Return the size and sha256 of the content of the blob at ``path``.
+
+    Raw blobs are mapped into memory and hashed in one call, which hashlib
+    does without holding the GIL. Runs in worker processes, so it must not
+    touch the app context.
+    """
+    if encoding:
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in decompress_file(path, encoding, 8 * COPY_BUFFER_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+        return size, digest.hexdigest()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            # Empty files can't be mapped.
+            return 0, hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return size, hashlib.sha256(data).hexdigest()
@@ -0,0 +1,97 @@
+from api.models import db, Site, Folder, File, Change
+from api.cache import invalidate_site
+from api import trees
+import sqlalchemy as sa
+import shortuuid
+import json
+import csv
+import io
+
+FOLDER_COLUMNS = [c.name for c in Folder.__table__.c]
+FILE_COLUMNS = [c.name for c in File.__table__.c]
+BATCH_SIZE = 10000
+
+def export_site(site_id):
+    """Yield a site, its folders (parents first) and its files as dicts, one per NDJSON line.
+
+    Rows come from a server-side cursor on a connection of its own, so
+    memory stays flat however big the site is and a streamed response
+    can outlive the request's transaction.
+    """
+    engine = db.session.get_bind(mapper=File)
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=1000)
+        site = conn.execute(sa.select(Site.id, Site.name).where(Site.id == site_id)).one()
+        yield {"type": "site", "id": str(site.id), "name": site.name}
+
+        tree = sa.select(Folder.id, sa.literal(0).label("depth")) \
+            .where(Folder.site_id == site_id, Folder.parent_id == None).cte("tree", recursive=True)
+        tree = tree.union_all(sa.select(Folder.id, tree.c.depth + 1).where(Folder.parent_id == tree.c.id))
+        folders = sa.select(*Folder.__table__.c).join(tree, tree.c.id == Folder.id).order_by(tree.c.depth, Folder.id)
+        for row in conn.execute(folders):
+            yield dict(row._mapping, type="folder", site_id=str(row.site_id))
+
+        files = sa.select(*File.__table__.c).where(File.site_id == site_id).order_by(File.id)
+        for row in conn.execute(files):
+            yield dict(row._mapping, type="file", site_id=str(row.site_id))
+
+def load_site(site_id, lines, new_ids=False):
+    """Insert the folders and files of an export into ``site_id``.
+
+    Uses COPY on PostgreSQL and batched INSERTs elsewhere, in one
+    transaction with a reset change in the site's log. With
+    ``new_ids`` every row gets a fresh id, so an export can be loaded next
+    to the site it came from.
+    """
+    folder_ids = {}
+    batches = {"folder": [], "file": []}
+    counts = {"folder": 0, "file": 0}
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        kind = row.pop("type")
+        if kind == "site":
+            continue
+        row["site_id"] = site_id
+        if kind == "folder":
+            if new_ids:
+                folder_ids[row["id"]] = row["id"] = shortuuid.uuid()
+                row["parent_id"] = folder_ids.get(row["parent_id"])
+        elif new_ids:
+            row["id"] = shortuuid.uuid()
+            row["folder_id"] = folder_ids.get(row["folder_id"])
+        if kind == "file" and batches["folder"]:
+            # Folders come first in an export, flush them before files refer to them.
+            counts["folder"] += _load(Folder, FOLDER_COLUMNS, batches["folder"])
+        batches[kind].append(row)
+        if len(batches[kind]) >= BATCH_SIZE:
+            counts[kind] += _load(Folder if kind == "folder" else File,
+                                  FOLDER_COLUMNS if kind == "folder" else FILE_COLUMNS, batches[kind])
+    counts["folder"] += _load(Folder, FOLDER_COLUMNS, batches["folder"])
+    counts["file"] += _load(File, FILE_COLUMNS, batches["file"])
+    # One change for the whole load, clients refetch the site on a reset.
+    Change.record(site_id, "reset", str(site_id))
+    trees.discard(site_id)
+    db.session.commit()
+    invalidate_site(site_id)
+    return counts
+
+def _load(model, columns, rows):
+    count = len(rows)
+    if not rows:
+        return count
+    conn = db.session.connection(bind_arguments={"mapper": model})
+    if conn.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        # Strings are quoted, so COPY can tell empty strings from NULLs.
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for row in rows:
+            writer.writerow([row.get(c) for c in columns])
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(model.__tablename__, ", ".join(columns)), buffer)
+    else:
+        conn.execute(sa.insert(model), [{c: row.get(c) for c in columns} for row in rows])
+    rows.clear()
+    return count
@@ -0,0 +1,99 @@
+from api.models import db, Site, File, Folder, FolderTree
+from api.serializers import dumps, FOLDER_FIELDS
+from api import sharding
+from sqlalchemy.exc import IntegrityError
+import sqlalchemy as sa
+import json
+import time
+import zlib
+
+# The folder tree of a site is kept as one row holding its folders as a
+# compressed list of [id, name, parent_id, file_count], sorted by id.
+# Folder writes patch the snapshot in their own transaction and bump its
+# version, which is the ETag, so reading the tree is one primary key lookup
+# and a 304 for clients that have it already. Versions start from the clock,
+# like the response cache's, so a rebuilt snapshot never reuses an old ETag.
+
+def build(site_id, bind=None):
+    """Read the folders and file counts of a site from the database, or from ``bind``."""
+    bind_arguments = {"bind": bind}
+    counts = dict(db.session.execute(sa.select(File.folder_id, sa.func.count())
+                                     .where(File.site_id == site_id, File.folder_id.isnot(None))
+                                     .group_by(File.folder_id), bind_arguments=bind_arguments).all())
+    return {id: [name, parent_id, counts.get(id, 0)] for id, name, parent_id in
+            db.session.execute(sa.select(Folder.id, Folder.name, Folder.parent_id).where(Folder.site_id == site_id),
+                               bind_arguments=bind_arguments)}
+
+def encode(nodes):
+    return zlib.compress(dumps([[id] + node for id, node in sorted(nodes.items())]))
+
+def decode(data):
+    return {node[0]: node[1:] for node in json.loads(zlib.decompress(data))}
+
+def snapshot(site_id):
+    """Return the version and encoded folders of a site, building the snapshot when there is none."""
+    tree = db.session.get(FolderTree, site_id)
+    if tree is not None:
+        return tree.version, tree.data
+    shard, state = sharding.shard_of(site_id)
+    bind = sharding.engine(shard)
+    if state == "active":
+        # Writers hold a key share lock on the site row until they commit, see
+        # sharding.hold_site, and only patch a snapshot that exists. Locking the
+        # row makes the build wait for the writes in flight and later writes
+        # wait for the snapshot, which is built on the shard, never the replica.
+        db.session.execute(sa.select(Site.id).where(Site.id == site_id).with_for_update(),
+                           bind_arguments={"bind": bind})
+    tree = FolderTree(site_id=site_id, version=time.time_ns(), data=encode(build(site_id, bind)))
+    if state != "active" or sharding.shard_of(site_id, primary=True) != (shard, "active"):
+        # Not kept while the site is moved, the copy could miss it and the old shard is emptied after.
+        return tree.version, tree.data
+    try:
+        with db.session.begin_nested():
+            db.session.add(tree)
+    except IntegrityError:
+        # Built by a concurrent request, which is as good as ours.
+        pass
+    return tree.version, tree.data
+
+def render(site_id, nodes, root_id=None):
+    """Return the FolderSchema dump of the top level folders, or of ``root_id``, with all descendants."""
+    site_id = str(site_id)
+    rendered = {}
+    children = {}
+    for id, (name, parent_id, file_count) in sorted(nodes.items()):
+        values = {"id": id, "site_id": site_id, "name": name, "parent_id": parent_id}
+        node = {field: values[field] for field in FOLDER_FIELDS}
+        node["file_count"] = file_count
+        node["children"] = children.setdefault(id, [])
+        rendered[id] = node
+        children.setdefault(parent_id, []).append(node)
+    if root_id is not None:
+        return rendered.get(root_id)
+    return children.get(None, [])
+
+def patch(site_id, folders=(), removed=(), counts=None):
+    """Apply folder writes to the site's snapshot in the current transaction.
+
+    ``folders`` are added or updated, ``removed`` are folder ids and
+    ``counts`` maps folder ids to a change in their file count. Sites
+    without a snapshot are left alone, the next read builds one.
+    """
+    tree = db.session.execute(sa.select(FolderTree).where(FolderTree.site_id == site_id).with_for_update()).scalar()
+    if tree is None:
+        return
+    nodes = decode(tree.data)
+    for folder in folders:
+        count = nodes[folder.id][2] if folder.id in nodes else 0
+        nodes[folder.id] = [folder.name, folder.parent_id, count]
+    for folder_id in removed:
+        nodes.pop(folder_id, None)
+    for folder_id, delta in (counts or {}).items():
+        if folder_id in nodes:
+            nodes[folder_id][2] += delta
+    tree.data = encode(nodes)
+    tree.version += 1
+
+def discard(site_id):
+    """Drop the snapshot of a site, for bulk writes that would be slower to patch in."""
+    db.session.execute(sa.delete(FolderTree.__table__).where(FolderTree.site_id == site_id))
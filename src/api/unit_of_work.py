@@ -0,0 +1,64 @@
+from flask import g, has_app_context, current_app
+from contextlib import contextmanager
+
+class UnitOfWork:
+    """Collects the database changes of a request and commits them once.
+
+    Filesystem changes made along the way register an undo action with
+    ``on_rollback`` so a failed request doesn't leave blobs without rows.
+    ``after_commit`` callbacks only run once the transaction is durable.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.undo = []
+        self.callbacks = []
+        self.done = False
+
+    def on_rollback(self, fn, *args):
+        self.undo.append((fn, args))
+
+    def after_commit(self, fn, *args):
+        self.callbacks.append((fn, args))
+
+    def commit(self):
+        try:
+            self.session.commit()
+        except Exception:
+            self.rollback()
+            raise
+        self.done = True
+        for fn, args in self.callbacks:
+            try:
+                fn(*args)
+            except Exception:
+                current_app.logger.exception("after_commit callback %r failed", fn)
+
+    def rollback(self):
+        self.session.rollback()
+        self.done = True
+        for fn, args in reversed(self.undo):
+            try:
+                fn(*args)
+            except Exception:
+                current_app.logger.exception("Could not undo %r%r", fn, args)
+
+def current_unit_of_work():
+    if has_app_context():
+        return g.get("unit_of_work")
+    return None
+
+@contextmanager
+def unit_of_work(session):
+    """Run a block as a single unit of work, for CLI commands and scripts outside a request."""
+    previous = g.get("unit_of_work")
+    uow = g.unit_of_work = UnitOfWork(session)
+    try:
+        yield uow
+    except BaseException:
+        uow.rollback()
+        raise
+    else:
+        uow.commit()
+    finally:
+        g.unit_of_work = previous
@@ -0,0 +1,127 @@
+from flask import Request, current_app, request, jsonify
+from werkzeug.formparser import FormDataParser, MultiPartParser, exhaust_stream
+from api import storage
+import tempfile
+import hashlib
+import errno
+import os
+
+class IncomingFile:
+    """A multipart file part written straight to the incoming folder as it is parsed.
+
+    The size and sha256 of the part are computed on the way, so saving it is
+    a rename on the same volume instead of a second copy.
+    """
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(suffix=".part", dir=folder)
+        self.file = os.fdopen(fd, "w+b")
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def claim(self, path):
+        """Move the part to ``path`` and return True, or False when ``path`` is on another volume."""
+        self.file.flush()
+        try:
+            os.rename(self.name, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return False
+        self.name = None
+        return True
+
+    def close(self):
+        self.file.close()
+        if self.name:
+            storage._remove(self.name)
+            self.name = None
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+class UploadFormDataParser(FormDataParser):
+    """Form parser reading multipart bodies UPLOAD_BUFFER_SIZE bytes at a time."""
+    buffer_size = 64 * 1024
+
+    # Werkzeug's own _parse_multipart with buffer_size passed on, keep in step with the Werkzeug pin in requirements.txt.
+    @exhaust_stream
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = MultiPartParser(
+            self.stream_factory,
+            self.charset,
+            self.errors,
+            max_form_memory_size=self.max_form_memory_size,
+            buffer_size=self.buffer_size,
+            cls=self.cls,
+            max_form_parts=self.max_form_parts,
+        )
+        boundary = options.get("boundary", "").encode("ascii")
+        if not boundary:
+            raise ValueError("Missing boundary")
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+    parse_functions = dict(FormDataParser.parse_functions, **{"multipart/form-data": _parse_multipart})
+
+class UploadRequest(Request):
+    """Request that spools file parts to the incoming folder instead of memory or /tmp.
+
+    Memory per upload is bounded by UPLOAD_BUFFER_SIZE for file parts and
+    MAX_FORM_MEMORY_SIZE for other fields. ``upload_limit`` raises the body
+    size limit of a route above MAX_CONTENT_LENGTH.
+    """
+    form_data_parser_class = UploadFormDataParser
+    route_max_content_length = None
+
+    @property
+    def max_content_length(self):
+        if self.route_max_content_length is not None:
+            return self.route_max_content_length
+        return super().max_content_length
+
+    @property
+    def max_form_memory_size(self):
+        return current_app.config.get("MAX_FORM_MEMORY_SIZE")
+
+    def make_form_data_parser(self):
+        parser = super().make_form_data_parser()
+        parser.buffer_size = current_app.config.get("UPLOAD_BUFFER_SIZE") or parser.buffer_size
+        return parser
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IncomingFile(incoming_path())
+
+def incoming_path():
+    return current_app.config.get("UPLOAD_FOLDER") or os.path.join(current_app.config["DATA_FOLDER"], ".incoming")
+
+def upload_limit(setting):
+    """Limit the body of a route to the size in the ``setting`` config value instead of MAX_CONTENT_LENGTH."""
+    def wrapper(fn):
+        fn.upload_limit = setting
+        return fn
+    return wrapper
+
+def check_content_length():
+    """Answer 413 before any of the body is read when its Content-Length is over the route's limit.
+
+    Larger chunked bodies get one as soon as parsing goes over.
+    """
+    setting = getattr(current_app.view_functions.get(request.endpoint), "upload_limit", None)
+    if setting:
+        request.route_max_content_length = current_app.config.get(setting)
+    limit = request.max_content_length
+    if limit and request.content_length is not None and request.content_length > limit:
+        return too_large(limit)
+
+def too_large(limit=None):
+    return jsonify({
+        "error": "Payload too large",
+        "message": "Request body is larger than {} bytes".format(limit) if limit else "Request body is too large"
+    }), 413
@@ -0,0 +1,161 @@
+from flask import current_app
+from api.models import db, FileVersion, Chunk, version_chunks
+from api.unit_of_work import current_unit_of_work
+from api import storage, compression
+import sqlalchemy as sa
+import shortuuid
+import hashlib
+import random
+import os
+
+# FastCDC style content-defined chunking. A cut is made where the gear hash
+# of the last 64 bytes matches a mask, so an edit only changes the chunks
+# around it and the rest of a new version dedups against the old one.
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+_M64 = (1 << 64) - 1
+# Fixed seed, chunk boundaries must be the same in every process and release.
+_rng = random.Random(0x6765617243444321)
+_GEAR = [_rng.getrandbits(64) for _ in range(256)]
+# Harder to match before the average size and easier after, which keeps
+# chunk sizes close to the average (normalized chunking).
+_MASK_HARD = ((1 << 18) - 1) << 46
+_MASK_EASY = ((1 << 14) - 1) << 50
+
+def cut_point(buf, n):
+    """Return the length of the first chunk in ``buf[:n]``."""
+    if n <= MIN_CHUNK_SIZE:
+        return n
+    end = min(n, MAX_CHUNK_SIZE)
+    normal = min(AVG_CHUNK_SIZE, end)
+    gear = _GEAR
+    h = 0
+    i = MIN_CHUNK_SIZE
+    while i < normal:
+        h = ((h << 1) + gear[buf[i]]) & _M64
+        i += 1
+        if not h & _MASK_HARD:
+            return i
+    while i < end:
+        h = ((h << 1) + gear[buf[i]]) & _M64
+        i += 1
+        if not h & _MASK_EASY:
+            return i
+    return end
+
+def split(content):
+    """Cut an iterable of bytes into content-defined chunks."""
+    buf = bytearray()
+    for data in content:
+        buf += data
+        while len(buf) >= MAX_CHUNK_SIZE:
+            cut = cut_point(buf, len(buf))
+            yield bytes(buf[:cut])
+            del buf[:cut]
+    while buf:
+        cut = cut_point(buf, len(buf))
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+def version_path(site_id, version):
+    return os.path.join(storage.site_path(site_id), ".versions", version.id + compression.SUFFIXES.get(version.encoding, ""))
+
+def chunk_path(site_id, hash, encoding=None):
+    return os.path.join(storage.site_path(site_id), ".chunks", hash[:2], hash + compression.SUFFIXES.get(encoding, ""))
+
+def supersede(file):
+    """Keep the current content of ``file`` as a version and make room for a new one.
+
+    The blob is moved aside unchanged, so this is cheap whatever the size.
+    Small versions are packed into chunks straight away, larger ones by
+    ``flask site pack-versions``.
+    """
+    version = FileVersion(id=shortuuid.uuid(), file_id=file.id, number=file.version, name=file.name, ext=file.ext,
+                          mimetype=file.mimetype, size=file.size, hash=file.hash, encoding=file.encoding)
+    storage.move_blob(os.path.join(storage.site_path(file.site_id), storage.blob_name(file)),
+                      version_path(file.site_id, version))
+    version.save_to_db()
+    file.version += 1
+    if (version.size or 0) <= current_app.config.get("VERSIONS_PACK_INLINE", 0):
+        pack(file.site_id, version)
+    return version
+
+def pack(site_id, version):
+    """Store a moved aside version as chunks, writing only the chunks the site doesn't have yet."""
+    path = version_path(site_id, version)
+    encoding = compression.choose_encoding(current_app.config, version.mimetype)
+    level = current_app.config.get("BLOB_COMPRESSION_LEVEL")
+    hashes = []
+    chunks = {}
+    for data in split(storage.read_blob(path, version.encoding)):
+        hash = hashlib.sha256(data).hexdigest()
+        hashes.append(hash)
+        if hash not in chunks:
+            chunks[hash] = dict(site_id=site_id, hash=hash, size=len(data), encoding=_store_chunk(site_id, hash, data, encoding, level))
+    # Another version may have stored the same chunk concurrently, the first row wins.
+    _insert_missing(Chunk.__table__, list(chunks.values()))
+    if hashes:
+        db.session.execute(sa.insert(version_chunks), [dict(version_id=version.id, position=i, chunk_hash=hash)
+                                                        for i, hash in enumerate(hashes)])
+    version.packed = True
+    version.encoding = None
+    version.save_to_db()
+    uow = current_unit_of_work()
+    if uow:
+        uow.after_commit(storage._remove, path)
+    else:
+        storage._remove(path)
+
+def _store_chunk(site_id, hash, data, encoding, level):
+    for existing in (None, *compression.SUFFIXES):
+        if os.path.exists(chunk_path(site_id, hash, existing)):
+            return existing
+    path = chunk_path(site_id, hash, encoding)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Chunks are shared, so they are never removed on rollback and only appear once complete.
+    temp = "{}.{}.tmp".format(path, shortuuid.uuid())
+    with open(temp, "wb") as f:
+        if encoding:
+            encoder = compression.compressor(encoding, level)
+            f.write(encoder.compress(data) + encoder.flush())
+        else:
+            f.write(data)
+    os.replace(temp, path)
+    return encoding
+
+def _insert_missing(table, rows):
+    if not rows:
+        return
+    dialect = db.session.get_bind(mapper=Chunk).dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        existing = set(db.session.scalars(sa.select(table.c.hash).where(table.c.site_id == rows[0]["site_id"],
+                                                                         table.c.hash.in_([r["hash"] for r in rows]))))
+        rows = [r for r in rows if r["hash"] not in existing]
+        if rows:
+            db.session.execute(sa.insert(table), rows)
+        return
+    db.session.execute(insert(table).on_conflict_do_nothing(), rows)
+
+def content(site_id, version):
+    """Return the content of a version as an iterable of bytes.
+
+    The chunk list is read up front, so the content can be streamed after
+    the request's session is gone.
+    """
+    if not version.packed:
+        return storage.read_blob(version_path(site_id, version), version.encoding)
+    chunks = db.session.execute(sa.select(version_chunks.c.chunk_hash, Chunk.encoding)
+                                .join(Chunk, sa.and_(Chunk.hash == version_chunks.c.chunk_hash, Chunk.site_id == site_id))
+                                .where(version_chunks.c.version_id == version.id)
+                                .order_by(version_chunks.c.position)).all()
+    paths = [(chunk_path(site_id, hash, encoding), encoding) for hash, encoding in chunks]
+    return _read_chunks(paths)
+
+def _read_chunks(paths):
+    for path, encoding in paths:
+        yield from storage.read_blob(path, encoding)
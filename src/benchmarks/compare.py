@@ -0,0 +1,36 @@
+"""Compare two benchmark results and flag regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Exits with status 1 when a latency percentile or query count got worse
+by more than the threshold, so it can gate a CI job.
+"""
+import click
+import json
+
+METRICS = ("p50_ms", "p90_ms", "p99_ms", "queries_per_request")
+
+@click.command()
+@click.argument("before", type=click.File())
+@click.argument("after", type=click.File())
+@click.option("--threshold", default=10.0, show_default=True, help="Allowed slowdown in percent.")
+def main(before, after, threshold):
+    before, after = json.load(before), json.load(after)
+    click.echo("{} -> {}".format((before["commit"] or "?")[:10], (after["commit"] or "?")[:10]))
+    regressed = False
+    for scenario, old in before["results"].items():
+        new = after["results"].get(scenario)
+        if new is None:
+            continue
+        for metric in METRICS:
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressed = True
+            click.echo("{:<18} {:<20} {:>10.2f} {:>10.2f} {:>+8.1f}%{}".format(scenario, metric, old[metric], new[metric], change, flag))
+    if regressed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
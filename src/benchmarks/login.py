@@ -0,0 +1,97 @@
+"""Measure login throughput and how much a login burst slows other requests.
+
+    python -m benchmarks.login --workers 0 --workers 4 --threads 16 --logins 400
+
+Every ``--workers`` value is a run with that PASSWORD_HASH_WORKERS, 0
+hashes on the request thread. During each run a probe thread requests
+``/`` in a loop, its latency shows how much the logins starve the rest
+of the worker. Logins rejected with 503 by the queue limit are counted.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import click
+import json
+import os
+import tempfile
+import threading
+import time
+
+@click.command()
+@click.option("--database", default="sqlite:///" + os.path.join(tempfile.gettempdir(), "docudir-login-bench.db"),
+              show_default=True, help="Database URL.")
+@click.option("--workers", multiple=True, type=int, default=[0, 4], show_default=True, help="PASSWORD_HASH_WORKERS to compare.")
+@click.option("--queue", default=64, show_default=True, help="PASSWORD_HASH_QUEUE.")
+@click.option("--method", default="pbkdf2:sha256:260000", show_default=True, help="PASSWORD_HASH_METHOD.")
+@click.option("--threads", default=16, show_default=True, help="Concurrent clients logging in.")
+@click.option("--logins", default=400, show_default=True, help="Logins per run.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write results as JSON to this file.")
+def main(database, workers, queue, method, threads, logins, output):
+    os.environ["DATABASE_URL"] = database
+    from api.app import app
+    from api.models import db
+    from benchmarks import seed
+    from benchmarks.run import percentile
+
+    app.config.update(PASSWORD_HASH_METHOD=method, PASSWORD_HASH_QUEUE=queue, RATELIMIT_ENABLED=False,
+                      JWT_ACCESS_TOKEN_EXPIRES=False)
+    results = {}
+    for count in workers:
+        app.config["PASSWORD_HASH_WORKERS"] = count
+        app.extensions.pop("password_hasher", None)
+        with app.app_context():
+            db.create_all(bind_key=None)
+            seed.seed_user()
+        client = app.test_client()
+        # Start the pool before timing.
+        client.post("/v1/auth/login", json={"email": "bench@example.com", "password": "benchmark"})
+
+        statuses = []
+        timings = []
+        probes = []
+        done = threading.Event()
+
+        def login():
+            start = time.perf_counter()
+            response = app.test_client().post("/v1/auth/login", json={"email": "bench@example.com", "password": "benchmark"})
+            timings.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+        def probe():
+            probe_client = app.test_client()
+            while not done.is_set():
+                start = time.perf_counter()
+                probe_client.get("/")
+                probes.append(time.perf_counter() - start)
+                time.sleep(0.005)
+
+        prober = threading.Thread(target=probe)
+        prober.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for _ in range(logins):
+                executor.submit(login)
+        elapsed = time.perf_counter() - start
+        done.set()
+        prober.join()
+
+        timings.sort()
+        probes.sort()
+        results[str(count)] = {
+            "logins_per_second": statuses.count(201) / elapsed,
+            "rejected": statuses.count(503),
+            "login_p50_ms": percentile(timings, 50) * 1000,
+            "login_p99_ms": percentile(timings, 99) * 1000,
+            "probe_p50_ms": percentile(probes, 50) * 1000,
+            "probe_p99_ms": percentile(probes, 99) * 1000
+        }
+        click.echo("workers {:<3} {logins_per_second:>7.1f} logins/s  {rejected:>4} rejected  "
+                   "login p99 {login_p99_ms:>8.1f} ms  probe p99 {probe_p99_ms:>8.1f} ms".format(count, **results[str(count)]))
+        hasher = app.extensions.pop("password_hasher")
+        if hasher.executor:
+            hasher.executor.shutdown()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"method": method, "threads": threads, "logins": logins, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Synthetic data for the benchmarks.
+
+Rows are written with batched core INSERTs so millions of files can be
+seeded in minutes. Only the files used by the download benchmark get a
+blob on disk.
+"""
+from api.models import db, User, Site, Folder, File
+import sqlalchemy as sa
+import shortuuid
+import os
+
+BATCH_SIZE = 10000
+
+def seed_user(email="bench@example.com"):
+    user = User.find_by_email(email)
+    if not user:
+        user = User(email=email, name="Benchmark", password=User.generate_hash("benchmark"))
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+def seed_site(user, name="benchmark"):
+    site = Site(name=name)
+    site.members.append(user)
+    db.session.add(site)
+    db.session.commit()
+    return site
+
+def seed_tree(site_id, depth, fanout):
+    """Create ``fanout`` folders per level, ``depth`` levels deep. Returns folder ids, parents first."""
+    folder_ids = []
+    level = [None]
+    for _ in range(depth):
+        rows = []
+        for parent_id in level:
+            for i in range(fanout):
+                rows.append(dict(id=shortuuid.uuid(), name="folder-{}".format(i), site_id=site_id, parent_id=parent_id))
+        _insert(Folder, rows)
+        level = [row["id"] for row in rows]
+        folder_ids.extend(level)
+    return folder_ids
+
+def seed_files(site_id, folder_ids, count, hot_folder=None, hot_count=0):
+    """Spread ``count`` rows over the site root and ``folder_ids``, plus ``hot_count`` in ``hot_folder``."""
+    targets = [None] + list(folder_ids)
+    rows = []
+    for i in range(count + hot_count):
+        folder_id = hot_folder if i >= count else targets[i % len(targets)]
+        rows.append(dict(id=shortuuid.uuid(), name="file-{}.txt".format(i), ext=".txt", mimetype="text/plain",
+                         size=1024, site_id=site_id, folder_id=folder_id, deleted=False))
+        if len(rows) >= BATCH_SIZE:
+            _insert(File, rows)
+            rows = []
+    _insert(File, rows)
+
+def seed_blob(site_id, data_folder, size):
+    """Create one file row with a blob of ``size`` bytes for the download benchmark."""
+    new_file = File(id=shortuuid.uuid(), name="blob.bin", ext=".bin", mimetype="application/octet-stream",
+                    size=size, site_id=site_id, deleted=False)
+    db.session.add(new_file)
+    db.session.commit()
+    folder = os.path.join(data_folder, str(site_id))
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, new_file.id + new_file.ext), "wb") as f:
+        f.write(os.urandom(size))
+    return new_file
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(sa.insert(model), rows)
+        db.session.commit()
@@ -0,0 +1,41 @@
+"""Measure how long a worker takes to import the app, and its memory.
+
+    python -m benchmarks.startup --runs 10
+
+Each run imports ``api.app`` in a fresh interpreter for every
+SWAGGER_MODE and reports wall time and peak RSS.
+"""
+import click
+import json
+import os
+import subprocess
+import sys
+
+PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+import api.app
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules))
+"""
+
+@click.command()
+@click.option("--runs", default=10, show_default=True, help="Imports per mode.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write results as JSON to this file.")
+def main(runs, output):
+    results = {}
+    for mode in ("eager", "lazy"):
+        env = dict(os.environ, SWAGGER_MODE=mode)
+        samples = [subprocess.check_output([sys.executable, "-c", PROBE], env=env, text=True).split() for _ in range(runs)]
+        times = sorted(float(s[0]) for s in samples)
+        results[mode] = {
+            "import_ms_median": times[len(times) // 2] * 1000,
+            "max_rss_kb": max(int(s[1]) for s in samples),
+            "modules": int(samples[0][2])
+        }
+        click.echo("{:<6} {import_ms_median:>8.1f} ms  {max_rss_kb:>8} KB  {modules:>5} modules".format(mode, **results[mode]))
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
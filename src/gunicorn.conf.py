@@ -0,0 +1,38 @@
+"""Gunicorn settings for production.
+
+The app is imported once in the master and forked, so workers share its
+memory copy-on-write. Nothing opens connections, threads or process pools
+at import time; those start on first use inside each worker.
+"""
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+# A change stream or long-poll holds a thread while it waits, EVENTS_MAX_STREAMS
+# of them per worker at most, half the threads unless set. Many clients
+# listening for changes need more threads, or a separate instance serving
+# /events and /changes.
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+wsgi_app = "api.app:app"
+preload_app = True
+
+def when_ready(server):
+    from api.app import app
+    from api.cache import shared_backend
+    if server.cfg.workers > 1 and not shared_backend(app):
+        # A write only bumps the versions in the worker that served it, the
+        # others would keep serving what it replaced.
+        server.log.warning("CACHE_URL=%s is per worker, response caching is off. Use redis:// with more than one worker.",
+                           app.config["CACHE_URL"])
+        app.config["CACHE_URL"] = "none"
+    # Keep the imported objects out of the collector, so it doesn't touch
+    # (and copy) their pages in every worker.
+    gc.freeze()
+
+def post_fork(server, worker):
+    from api.app import app
+    from api.models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
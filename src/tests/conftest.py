@@ -0,0 +1,71 @@
+import io
+import os
+os.environ["DATABASE_URL"] = "sqlite://"
+# Only used by tests that take the shard fixture, the others see no shards.
+os.environ["SITE_SHARDS"] = "b=sqlite://"
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import create_access_token
+from api.app import app as flask_app
+from api.models import db, User, Site
+from api.config import TestingConfig
+flask_app.config.from_object(TestingConfig)
+
+@pytest.fixture
+def app(tmp_path):
+    flask_app.config["DATA_FOLDER"] = str(tmp_path / "data")
+    with flask_app.app_context():
+        db.create_all(bind_key=None)
+        yield flask_app
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def site(app):
+    user = User(email="user@example.com", name="User", password="x")
+    site = Site(name="Site")
+    site.members.append(user)
+    db.session.add(site)
+    db.session.commit()
+    return str(site.id)
+
+@pytest.fixture
+def headers(app, site):
+    with app.test_request_context():
+        token = create_access_token(identity="user@example.com")
+    return {"Authorization": "Bearer " + token}
+
+@pytest.fixture
+def upload(client, site, headers):
+    """Post ``data`` as ``name`` to the site, or to its folder ``folder_id``, and return the response."""
+    def upload(data=b"hello", name="notes.txt", folder_id=None):
+        url = "/v1/sites/{}/folders/{}/files".format(site, folder_id) if folder_id else "/v1/sites/{}/files".format(site)
+        return client.post(url, headers=headers, content_type="multipart/form-data", data={"file": (io.BytesIO(data), name)})
+    return upload
+
+@pytest.fixture
+def bound_app(tmp_path):
+    """A bare app on SQLite files with a replica and shard b, all with the full schema, to test where statements go."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + str(tmp_path / "primary.db")
+    app.config["SQLALCHEMY_BINDS"] = {"replica": "sqlite:///" + str(tmp_path / "replica.db"),
+                                      "shard:b": "sqlite:///" + str(tmp_path / "b.db")}
+    db.init_app(app)
+    with app.app_context():
+        for bind in (None, "replica", "shard:b"):
+            db.metadata.create_all(bind=db.engines[bind])
+    return app
+
+@pytest.fixture
+def shard(app, monkeypatch):
+    """Turn on shard b from SITE_SHARDS, an in-memory database with the full schema."""
+    monkeypatch.setitem(app.config, "SQLALCHEMY_BINDS", {"shard:b": "sqlite://"})
+    engine = db.engines["shard:b"]
+    db.metadata.create_all(bind=engine)
+    yield "b"
+    db.metadata.drop_all(bind=engine)
@@ -0,0 +1,42 @@
+import io
+def test_listing_etag_until_site_changes(client, site, headers, upload):
+    upload()
+    url = "/v1/sites/{}/files".format(site)
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = client.get(url, headers=dict(headers, **{"If-None-Match": etag}))
+    assert again.status_code == 304
+
+    upload()
+    changed = client.get(url, headers=dict(headers, **{"If-None-Match": etag}))
+    assert changed.status_code == 200
+    assert len(changed.json) == 2
+    assert changed.headers["ETag"] != etag
+
+def test_site_id_spellings_share_the_cache(client, site, headers):
+    url = "/v1/sites/{}/files"
+    client.post(url.format(site.upper()), headers=headers, content_type="multipart/form-data",
+                data={"file": (io.BytesIO(b"a"), "a.txt")})
+    assert len(client.get(url.format(site), headers=headers).json) == 1
+    client.post(url.format(site.replace("-", "").upper()), headers=headers, content_type="multipart/form-data",
+                data={"file": (io.BytesIO(b"b"), "b.txt")})
+    assert len(client.get(url.format(site), headers=headers).json) == 2
+
+def test_site_list_follows_member_sites(client, site, headers, upload):
+    first = client.get("/v1/sites", headers=headers)
+    assert first.json[0]["file_count"] == 0
+    upload()
+    second = client.get("/v1/sites", headers=headers)
+    assert second.json[0]["file_count"] == 1
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+def test_caching_off(app, client, site, headers, monkeypatch):
+    monkeypatch.setitem(app.config, "CACHE_URL", "none")
+    monkeypatch.delitem(app.extensions, "response_cache", raising=False)
+    url = "/v1/sites/" + site
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    app.extensions.pop("response_cache")
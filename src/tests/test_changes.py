@@ -0,0 +1,72 @@
+import threading
+import time
+from api.events import stream_slots, InProcessBroker
+
+def test_change_feed(client, site, headers, upload):
+    folder = client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "docs"}).json["id"]
+    file_id = upload().json["id"]
+    client.patch("/v1/sites/{}/files/{}".format(site, file_id), headers=headers, json={"name": "todo.txt", "folder_id": folder})
+    client.delete("/v1/sites/{}/folders/{}/files/{}".format(site, folder, file_id), headers=headers)
+
+    feed = client.get("/v1/sites/{}/changes".format(site), headers=headers).json
+    assert [c["action"] for c in feed["changes"]] == ["folder_create", "upload", "rename", "move", "delete"]
+    assert [c["seq"] for c in feed["changes"]] == [1, 2, 3, 4, 5]
+    move = feed["changes"][3]
+    assert (move["id"], move["folder_id"], move["name"]) == (file_id, folder, "todo.txt")
+    assert feed["cursor"] == 5
+
+    page = client.get("/v1/sites/{}/changes?since=2&limit=2".format(site), headers=headers).json
+    assert [c["seq"] for c in page["changes"]] == [3, 4]
+    assert page["has_more"]
+    assert [c["seq"] for c in client.get("/v1/sites/{}/changes?since=2&limit=-1".format(site), headers=headers).json["changes"]] == [3]
+    assert client.get("/v1/sites/{}/changes?since=5".format(site), headers=headers).json["changes"] == []
+
+def test_folder_can_not_move_into_descendant(client, site, headers):
+    parent = client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "a"}).json["id"]
+    child = client.post("/v1/sites/{}/folders/{}".format(site, parent), headers=headers, json={"name": "b"}).json["id"]
+    response = client.patch("/v1/sites/{}/folders/{}".format(site, parent), headers=headers, json={"parent_id": child})
+    assert response.status_code == 400
+    assert client.patch("/v1/sites/{}/folders/{}".format(site, child), headers=headers, json={"parent_id": None}).status_code == 200
+
+def test_event_stream_replays_changes(app, client, site, headers, monkeypatch):
+    monkeypatch.setitem(app.config, "EVENTS_MAX_DURATION", 0)
+    client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "docs"})
+    client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "misc"})
+
+    response = client.get("/v1/sites/{}/events".format(site), headers=dict(headers, **{"Last-Event-ID": "1"}))
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert "id: 1\n" not in body
+    assert 'id: 2\nevent: folder_create\ndata: {"' in body
+
+def test_long_poll_wakes_on_commit(app, client, site, headers):
+    def add_folder():
+        time.sleep(0.2)
+        with app.app_context():
+            client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "late"})
+    thread = threading.Thread(target=add_folder)
+    thread.start()
+    feed = client.get("/v1/sites/{}/changes?since=0&wait=5".format(site), headers=headers).json
+    thread.join()
+    assert [c["name"] for c in feed["changes"]] == ["late"]
+
+def test_change_streams_are_capped_per_worker(app, client, site, headers, monkeypatch):
+    monkeypatch.setitem(app.config, "EVENTS_MAX_DURATION", 0)
+    monkeypatch.setitem(app.extensions, "change_stream_slots", threading.BoundedSemaphore(1))
+    response = client.get("/v1/sites/{}/events".format(site), headers=headers)
+    response.get_data()
+    response.close()
+    # The stream gave its slot back, so it can be taken for the rest of the test.
+    assert stream_slots().acquire(blocking=False)
+
+    busy = client.get("/v1/sites/{}/events".format(site), headers=headers)
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == "5"
+    assert client.get("/v1/sites/{}/changes?wait=5".format(site), headers=headers).status_code == 503
+    assert client.get("/v1/sites/{}/changes".format(site), headers=headers).status_code == 200
+
+def test_broker_matches_site_id_spellings(site):
+    broker = InProcessBroker()
+    broker.publish(site.upper(), 3)
+    assert broker.wait(site, 2, 0)
+    assert not broker.wait(site.replace("-", ""), 3, 0)
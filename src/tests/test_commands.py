@@ -0,0 +1,59 @@
+import os
+from api.models import db, Site, Folder, File, Change
+import json
+
+def make_tree(root):
+    (root / "docs" / "2023").mkdir(parents=True)
+    (root / "readme.txt").write_text("hello")
+    (root / "docs" / "report.csv").write_text("a,b\n1,2\n")
+    (root / "docs" / "2023" / "notes.md").write_text("# notes")
+
+def test_import_tree(app, site, tmp_path):
+    make_tree(tmp_path / "share")
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["site", "import", site, str(tmp_path / "share"), "--workers", "1"])
+    assert result.exit_code == 0, result.output
+
+    docs = Folder.query.filter_by(name="docs", parent_id=None).one()
+    assert [f.name for f in docs.children] == ["2023"]
+    report = File.query.filter_by(name="report.csv").one()
+    assert report.folder_id == docs.id
+    assert report.size == 8
+    assert report.mimetype == "text/csv"
+    assert os.path.exists(os.path.join(app.config["DATA_FOLDER"], site, report.id + ".csv"))
+
+    # Running again resumes and imports nothing new.
+    result = runner.invoke(args=["site", "import", site, str(tmp_path / "share"), "--workers", "1"])
+    assert "0 files imported" in result.output
+    assert File.query.count() == 3
+    assert Folder.query.count() == 2
+    assert {c.action for c in Change.query.filter_by(site_id=site)} == {"reset"}
+
+    result = runner.invoke(args=["site", "import", "not-a-site", str(tmp_path / "share")])
+    assert result.exit_code == 1
+    assert "Site not-a-site not found" in result.output
+
+
+def test_export_and_load(app, client, site, headers, tmp_path):
+    make_tree(tmp_path / "share")
+    runner = app.test_cli_runner()
+    runner.invoke(args=["site", "import", site, str(tmp_path / "share"), "--workers", "1"])
+
+    response = client.get("/v1/sites/{}/export".format(site), headers=headers)
+    assert response.status_code == 200
+    lines = response.get_data().splitlines()
+    kinds = [json.loads(line)["type"] for line in lines]
+    assert kinds == ["site", "folder", "folder", "file", "file", "file"]
+    (tmp_path / "site.ndjson").write_bytes(response.get_data())
+
+    copy = Site(name="Copy")
+    db.session.add(copy)
+    db.session.commit()
+    result = runner.invoke(args=["site", "load", str(copy.id), str(tmp_path / "site.ndjson"), "--new-ids"])
+    assert result.exit_code == 0, result.output
+    assert "Loaded 2 folders and 3 files" in result.output
+    docs = Folder.query.filter_by(site_id=copy.id, name="docs").one()
+    assert [f.name for f in docs.children] == ["2023"]
+    assert File.query.filter_by(site_id=copy.id, name="report.csv").one().folder_id == docs.id
+
+    assert [c.action for c in Change.query.filter_by(site_id=copy.id)] == ["reset"]
@@ -0,0 +1,70 @@
+import gzip
+import os
+import pytest
+from api.models import db, File
+
+TEXT = b"name,size\n" + b"".join(b"file-%d.txt,%d\n" % (i, i * 7) for i in range(2000))
+
+@pytest.fixture
+def gzip_uploads(app):
+    app.config["BLOB_COMPRESSION"] = "gzip"
+    yield
+    app.config["BLOB_COMPRESSION"] = None
+
+def upload_text(upload):
+    return db.session.get(File, upload(TEXT, "list.csv").json["id"])
+
+def test_compressed_upload_and_download(app, client, site, headers, upload, gzip_uploads):
+    file = upload_text(upload)
+    assert (file.encoding, file.size) == ("gzip", len(TEXT))
+    blob = os.path.join(app.config["DATA_FOLDER"], site, file.id + ".csv.gz")
+    assert os.path.getsize(blob) < len(TEXT) / 3
+
+    url = "/v1/sites/{}/files/{}.csv".format(site, file.id)
+    encoded = client.get(url, headers=dict(headers, **{"Accept-Encoding": "gzip"}))
+    assert encoded.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(encoded.get_data()) == TEXT
+
+    plain = client.get(url, headers=headers)
+    assert "Content-Encoding" not in plain.headers
+    assert plain.get_data() == TEXT
+
+    partial = client.get(url, headers=dict(headers, Range="bytes=100-199"))
+    assert partial.status_code == 206
+    assert partial.get_data() == TEXT[100:200]
+
+def test_binary_types_are_stored_raw(upload, gzip_uploads):
+    response = upload(b"\x89PNG\r\n\x1a\n" + os.urandom(64), "image.png")
+    assert db.session.get(File, response.json["id"]).encoding is None
+
+def test_compress_command(app, client, site, headers, upload):
+    file = upload_text(upload)
+    assert file.encoding is None
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["site", "compress", site, "--encoding", "gzip"])
+    assert "1 files recompressed" in result.output, result.output
+    db.session.expire_all()
+    file = db.session.get(File, file.id)
+    assert file.encoding == "gzip"
+    folder = os.path.join(app.config["DATA_FOLDER"], site)
+    assert os.listdir(folder) == [file.id + ".csv.gz"]
+
+    runner.invoke(args=["site", "compress", site, "--encoding", "none"])
+    assert os.listdir(folder) == [file.id + ".csv"]
+    assert client.get("/v1/sites/{}/files/{}.csv".format(site, file.id), headers=headers).get_data() == TEXT
+
+
+def test_compress_command_skips_corrupt_blob(app, site, upload):
+    file = upload_text(upload)
+    runner = app.test_cli_runner()
+    runner.invoke(args=["site", "compress", site, "--encoding", "gzip"])
+    folder = os.path.join(app.config["DATA_FOLDER"], site)
+    with open(os.path.join(folder, file.id + ".csv.gz"), "wb") as f:
+        f.write(b"not gzip at all")
+
+    result = runner.invoke(args=["site", "compress", site, "--encoding", "none"])
+    assert result.exit_code == 0, result.output
+    assert "0 files recompressed, 0 blobs missing, 1 corrupt" in result.output, result.output
+    db.session.expire_all()
+    assert db.session.get(File, file.id).encoding == "gzip"
+    assert os.listdir(folder) == [file.id + ".csv.gz"]
@@ -0,0 +1,39 @@
+import uuid
+from api.models import db, File
+from api import sharding
+from api.duplicates import sharded_duplicate_groups
+
+def test_duplicates(app, client, site, headers, upload):
+    first = upload(b"same content", "a.txt").json["id"]
+    second = upload(b"same content", "b.txt").json["id"]
+    upload(b"other content", "c.txt").json["id"]
+    # Files from before hashes were kept.
+    third = upload(b"same content", "d.txt").json["id"]
+    db.session.execute(db.update(File).where(File.id==third).values(hash=None))
+    db.session.commit()
+
+    groups = client.get("/v1/sites/{}/duplicates".format(site), headers=headers).json["groups"]
+    assert [(g["copies"], g["reclaimable"]) for g in groups] == [(2, 12)]
+
+    result = app.test_cli_runner().invoke(args=["site", "hash", site, "--workers", "1"])
+    assert "1 files hashed" in result.output, result.output
+    response = client.get("/v1/sites/{}/duplicates".format(site), headers=headers).json
+    assert response["reclaimable"] == 24
+    assert sorted(f["id"] for f in response["groups"][0]["files"]) == sorted([first, second, third])
+
+def test_duplicates_across_shards(app, site, shard):
+    other = uuid.uuid4()
+    db.session.add_all([File(id="a1", name="a1", size=5, hash="a", site_id=site),
+                        File(id="b1", name="b1", size=7, hash="b", site_id=site),
+                        File(id="b2", name="b2", size=7, hash="b", site_id=site)])
+    db.session.commit()
+    with sharding.using(shard):
+        db.session.add_all([File(id="a2", name="a2", size=5, hash="a", site_id=other),
+                            File(id="b3", name="b3", size=7, hash="b", site_id=other),
+                            File(id="c1", name="c1", size=9, hash="c", site_id=other)])
+        db.session.commit()
+
+    groups = sharded_duplicate_groups()
+    assert [(g["hash"], g["copies"], g["reclaimable"]) for g in groups] == [("b", 3, 14), ("a", 2, 5)]
+    assert sorted(f["id"] for f in groups[0]["files"]) == ["b1", "b2", "b3"]
+    assert [g["hash"] for g in sharded_duplicate_groups(limit=1)] == ["b"]
@@ -0,0 +1,39 @@
+import pytest
+from api.hashing import PasswordHasher, HasherBusy
+from api.models import db, User
+
+@pytest.fixture
+def hasher(app):
+    app.extensions.pop("password_hasher", None)
+    yield
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:260000"
+    app.extensions.pop("password_hasher", None)
+
+def test_login_rehashes_when_method_changes(app, client, hasher):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    assert client.post("/v1/auth/register", json={"email": "a@example.com", "name": "A", "password": "secret"}).status_code == 201
+    assert User.find_by_email("a@example.com").password.startswith("pbkdf2:sha256:1000$")
+
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:2000"
+    app.extensions.pop("password_hasher")
+    assert client.post("/v1/auth/login", json={"email": "a@example.com", "password": "secret"}).status_code == 201
+    db.session.expire_all()
+    assert User.find_by_email("a@example.com").password.startswith("pbkdf2:sha256:2000$")
+    assert client.post("/v1/auth/login", json={"email": "a@example.com", "password": "secret"}).status_code == 201
+
+def test_needs_rehash_with_default_cost():
+    hasher = PasswordHasher("pbkdf2:sha256")
+    assert not hasher.needs_rehash(hasher.hash("secret"))
+    assert hasher.needs_rehash(PasswordHasher("pbkdf2:sha256:1000").hash("secret"))
+
+def test_pool_rejects_when_queue_is_full():
+    hasher = PasswordHasher("pbkdf2:sha256:1000", workers=1, queue=0)
+    try:
+        assert hasher.verify("secret", hasher.hash("secret"))
+        pending = hasher._submit(sum, range(10 ** 7))
+        with pytest.raises(HasherBusy):
+            hasher.hash("secret")
+        pending.result()
+        assert hasher.hash("secret")
+    finally:
+        hasher.executor.shutdown()
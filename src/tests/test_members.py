@@ -0,0 +1,42 @@
+from flask_jwt_extended import create_access_token
+from api.models import db, User
+
+def token(app, email):
+    with app.test_request_context():
+        return {"Authorization": "Bearer " + create_access_token(identity=email)}
+
+def test_roles(app, client, site, headers):
+    for email in ("reader@example.com", "writer@example.com"):
+        db.session.add(User(email=email, name=email, password="x"))
+    db.session.commit()
+    response = client.post("/v1/sites/{}/members".format(site), headers=headers, json={"members": [
+        {"email": "reader@example.com", "role": "read"},
+        {"email": "writer@example.com", "role": "write"},
+        {"email": "nobody@example.com", "role": "read"}
+    ]})
+    assert response.json == {"added": 2, "updated": 0, "unknown": ["nobody@example.com"]}
+
+    reader = token(app, "reader@example.com")
+    writer = token(app, "writer@example.com")
+    assert client.get("/v1/sites/{}".format(site), headers=reader).status_code == 200
+    assert client.post("/v1/sites/{}/folders".format(site), headers=reader, json={"name": "x"}).status_code == 403
+    assert client.post("/v1/sites/{}/folders".format(site), headers=writer, json={"name": "x"}).status_code == 201
+    assert client.post("/v1/sites/{}/members".format(site), headers=writer, json={"members": []}).status_code == 403
+
+    assert len(client.get("/v1/sites?role=read", headers=reader).json) == 1
+    assert client.get("/v1/sites?role=write", headers=reader).status_code == 404
+    client.post("/v1/sites/{}/members".format(site), headers=headers,
+                json={"members": [{"email": "reader@example.com", "role": "write"}]})
+    assert len(client.get("/v1/sites?role=write", headers=reader).json) == 1
+
+    members = client.get("/v1/sites/{}/members".format(site), headers=reader).json
+    assert [m["role"] for m in members] == ["owner", "write", "write"]
+    owner_id = members[0]["id"]
+    assert client.delete("/v1/sites/{}/members/{}".format(site, owner_id), headers=headers).status_code == 403
+    reader_id = members[1]["id"]
+    assert client.delete("/v1/sites/{}/members/{}".format(site, reader_id), headers=headers).status_code == 200
+    assert client.get("/v1/sites/{}".format(site), headers=reader).status_code == 404
+    assert client.get("/v1/sites", headers=reader).status_code == 404
+
+def test_unknown_site_id(client, site, headers):
+    assert client.get("/v1/sites/not-a-uuid", headers=headers).status_code == 404
@@ -0,0 +1,17 @@
+import os
+
+def test_metrics_endpoint(app, client, site, headers, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "scraper")
+    client.get("/v1/sites/{}/files".format(site), headers=headers)
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers=headers).status_code == 404
+    body = client.get("/metrics", headers={"Authorization": "Bearer scraper"}).get_data(as_text=True)
+    pid = os.getpid()
+    assert 'docudir_request_duration_seconds_count{{method="GET",route="site.get_files_",status="404",pid="{}"}}'.format(pid) in body
+    assert 'docudir_request_queries_bucket{{route="site.get_files_",pid="{}",le="+Inf"}}'.format(pid) in body
+    assert "# TYPE docudir_fs_operation_duration_seconds histogram" in body
+
+def test_query_budget_warning(app, client, site, headers, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, "QUERY_BUDGET", 1)
+    client.get("/v1/sites/{}".format(site), headers=headers)
+    assert "more than the budget of 1" in caplog.text
@@ -0,0 +1,65 @@
+import pathlib
+import time
+import pytest
+from flask_jwt_extended import create_access_token
+from api.models import db, User
+from api.ratelimit import MemoryBuckets, parse_limit
+
+@pytest.fixture
+def limits(app):
+    app.config["RATELIMIT_ENABLED"] = True
+    app.extensions.pop("rate_limiter", None)
+    yield app.config
+    app.config["RATELIMIT_ENABLED"] = False
+    app.config["TRANSFER_RATE_LIMIT"] = 0
+    app.extensions.pop("rate_limiter", None)
+
+def test_token_bucket_refills():
+    now = [0.0]
+    buckets = MemoryBuckets(clock=lambda: now[0])
+    rate, burst = parse_limit("2/second")
+    assert buckets.take("k", rate, burst) == 0
+    assert buckets.take("k", rate, burst) == 0
+    assert buckets.take("k", rate, burst) == pytest.approx(0.5)
+    now[0] = 0.5
+    assert buckets.take("k", rate, burst) == 0
+
+def test_debt_waits_for_large_chunks():
+    buckets = MemoryBuckets(clock=lambda: 0.0)
+    assert buckets.take("k", 100, 100, 300, debt=True) == pytest.approx(2)
+
+def test_login_limited_per_ip(client, limits, site):
+    limits["RATELIMIT_LOGIN"] = "2/minute"
+    for _ in range(2):
+        assert client.post("/v1/auth/login", json={"email": "nobody@example.com", "password": "x"}).status_code == 404
+    response = client.post("/v1/auth/login", json={"email": "nobody@example.com", "password": "x"})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+    other = client.post("/v1/auth/login", json={"email": "nobody@example.com", "password": "x"},
+                        environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert other.status_code == 404
+
+def test_download_throttled(client, limits, site, headers, upload):
+    limits["TRANSFER_RATE_LIMIT"] = 64 * 1024
+    uploaded = upload(b"x" * 1024, "small.bin")
+    assert uploaded.status_code == 201
+    # A blob of twice the rate has to wait for about a second of tokens.
+    blob = pathlib.Path(limits["DATA_FOLDER"], site, uploaded.json["id"] + ".bin")
+    blob.write_bytes(b"x" * 128 * 1024)
+    start = time.monotonic()
+    response = client.get("/v1/sites/{}/files/{}.bin".format(site, uploaded.json["id"]), headers=headers)
+    assert len(response.get_data()) == 128 * 1024
+    assert time.monotonic() - start > 0.8
+
+def test_outsiders_dont_drain_site_limits(app, client, limits, site, headers, upload):
+    limits["RATELIMIT_DOWNLOAD"] = "1/minute"
+    uploaded = upload(b"x", "small.bin")
+    db.session.add(User(email="outsider@example.com", name="Outsider", password="x"))
+    db.session.commit()
+    with app.test_request_context():
+        outsider = {"Authorization": "Bearer " + create_access_token(identity="outsider@example.com")}
+    url = "/v1/sites/{}/files/{}.bin".format(site, uploaded.json["id"])
+    for _ in range(3):
+        assert client.get(url, headers=outsider).status_code == 404
+    assert client.get(url, headers=headers).status_code == 200
+    assert client.get(url, headers=headers).status_code == 429
@@ -0,0 +1,56 @@
+from flask import Flask, g
+from api.models import db, Site, Folder
+from api.pool import InstrumentedQueuePool, pool_status
+import sqlalchemy as sa
+
+def test_read_only_requests_use_replica(bound_app):
+    app = bound_app
+    with app.app_context():
+        db.session.add(Site(name="primary"))
+        db.session.commit()
+        with db.engines["replica"].begin() as conn:
+            conn.execute(Site.__table__.insert().values(name="replica"))
+
+    with app.test_request_context("/"):
+        assert Site.query.one().name == "primary"
+    with app.test_request_context("/"):
+        g.read_only = True
+        assert Site.query.one().name == "replica"
+
+def test_site_contents_follow_the_site_shard(bound_app):
+    with bound_app.app_context():
+        site = Site(name="sharded")
+        db.session.add(site)
+        db.session.commit()
+        g.site_shard = "b"
+        db.session.execute(sa.insert(Site.__table__).values(id=site.id, name=site.name),
+                           bind_arguments={"bind": db.engines["shard:b"]})
+        db.session.add(Folder(id="folder", name="folder", site_id=site.id))
+        db.session.commit()
+        # Sites stay on the primary, their folders go to the shard, whether through the ORM or Core.
+        assert db.session.execute(sa.select(sa.func.count()).select_from(Site)).scalar() == 1
+        db.session.execute(sa.update(Folder.__table__).where(Folder.id == "folder").values(name="renamed"))
+        db.session.commit()
+        g.site_shard = None
+        assert db.session.get(Folder, "folder") is None
+        with db.engines["shard:b"].connect() as conn:
+            assert conn.execute(sa.select(Folder.name)).scalar() == "renamed"
+
+def test_instrumented_pool_counts_checkouts_and_waits(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + str(tmp_path / "pool.db")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": InstrumentedQueuePool, "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.05}
+    db.init_app(app)
+    with app.app_context():
+        engine = db.engine
+        conn = engine.connect()
+        try:
+            engine.connect()
+        except Exception:
+            pass
+        conn.close()
+        status = pool_status(db.engines)["default"]
+    assert status["checkouts"] == 1
+    assert status["checkins"] == 1
+    assert status["waits"] == 1
+    assert status["timeouts"] == 1
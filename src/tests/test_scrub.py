@@ -0,0 +1,70 @@
+import os
+import time
+import sqlalchemy as sa
+from api.models import db, File
+
+def test_scrub(app, client, site, headers, upload):
+    folder = os.path.join(app.config["DATA_FOLDER"], site)
+    kept = upload(b"kept", "kept.bin").json["id"]
+    lost = upload(b"lost", "lost.bin").json["id"]
+    renamed = upload(b"renamed", "renamed.bin").json["id"]
+    changed = upload(b"changed", "changed.bin").json["id"]
+    os.remove(os.path.join(folder, lost + ".bin"))
+    os.rename(os.path.join(folder, renamed + ".bin"), os.path.join(folder, renamed + ".dat"))
+    with open(os.path.join(folder, changed + ".bin"), "wb") as f:
+        f.write(b"changed!")
+    with open(os.path.join(folder, "stray.bin"), "wb") as f:
+        f.write(b"stray")
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["site", "scrub", site, "--verify", "--grace", "0"])
+    assert result.exit_code == 1
+    kinds = sorted(line.split()[0] for line in result.output.splitlines()[:-1])
+    assert kinds == ["mismatch", "misnamed", "missing", "orphan"]
+    assert "kept" not in result.output
+
+    result = runner.invoke(args=["site", "scrub", site, "--verify", "--grace", "0", "--repair"])
+    assert db.session.get(File, lost).deleted
+    assert os.path.exists(os.path.join(folder, renamed + ".bin"))
+    assert os.path.exists(os.path.join(folder, ".trash", "stray.bin"))
+    # A blob that no longer matches its row is reported, never taken for the truth.
+    assert result.exit_code == 1, result.output
+    assert db.session.get(File, changed).size == 7
+
+    result = runner.invoke(args=["site", "scrub", site, "--verify", "--grace", "0"])
+    assert result.exit_code == 1
+    assert "1 issues, 1 mismatch" in result.output, result.output
+
+def test_scrub_fills_in_unhashed_rows(app, site, upload):
+    file_id = upload(b"old", "old.bin").json["id"]
+    db.session.execute(sa.update(File).where(File.id == file_id).values(hash=None))
+    db.session.commit()
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["site", "scrub", site, "--verify", "--repair"])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    assert db.session.get(File, file_id).hash is not None
+
+def test_scrub_needs_a_worker(app, site):
+    result = app.test_cli_runner().invoke(args=["site", "scrub", site, "--workers", "0"])
+    assert result.exit_code == 2
+    assert "--workers" in result.output
+
+def test_scrub_removes_stale_upload_parts(app, site):
+    incoming = os.path.join(app.config["DATA_FOLDER"], ".incoming")
+    os.makedirs(incoming, exist_ok=True)
+    stale = os.path.join(incoming, "tmpstale.part")
+    with open(stale, "wb") as f:
+        f.write(b"half an upload")
+    os.utime(stale, (time.time() - 7200, time.time() - 7200))
+    with open(os.path.join(incoming, "tmpfresh.part"), "wb") as f:
+        f.write(b"in flight")
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["site", "scrub"])
+    assert result.exit_code == 1
+    assert "stale_part /tmpstale.part: 14 bytes" in result.output, result.output
+    assert "tmpfresh" not in result.output
+    result = runner.invoke(args=["site", "scrub", "--repair"])
+    assert result.exit_code == 0, result.output
+    assert os.listdir(incoming) == ["tmpfresh.part"]
@@ -0,0 +1,47 @@
+import json
+from api.models import db, Site, Folder, File, FileSchema, FolderSchema, SiteSchema
+from api import serializers
+
+def seed(site_id):
+    db.session.add_all([
+        Folder(id="a", name="a", site_id=site_id),
+        Folder(id="b", name="b", site_id=site_id, parent_id="a"),
+        Folder(id="c", name="c", site_id=site_id, parent_id="b"),
+        Folder(id="d", name="d", site_id=site_id),
+        File(id="1", name="one.txt", ext=".txt", mimetype="text/plain", size=3, site_id=site_id),
+        File(id="2", name="two.csv", ext=".csv", mimetype="text/csv", size=5, site_id=site_id, folder_id="b"),
+        File(id="3", name="three.csv", ext=".csv", site_id=site_id, folder_id="b", deleted=True),
+    ])
+    db.session.commit()
+
+def normalize(data):
+    # Both paths must produce the same JSON; child order isn't part of the contract.
+    data = json.loads(json.dumps(data, default=str))
+    def sort(nodes):
+        for node in nodes:
+            sort(node.get("children", []))
+            node.get("children", []).sort(key=lambda n: n["id"])
+        return sorted(nodes, key=lambda n: n["id"])
+    return sort(data if isinstance(data, list) else [data])
+
+def test_file_parity(app, site):
+    seed(site)
+    criteria = (File.site_id == site, File.deleted == False)
+    assert normalize(serializers.file_rows(*criteria)) == normalize(FileSchema(many=True).dump(File.query.filter(*criteria).all()))
+    assert normalize(list(serializers.stream_file_rows(*criteria))) == normalize(serializers.file_rows(*criteria))
+
+def test_folder_parity(app, site):
+    seed(site)
+    top = Folder.query.filter(Folder.site_id == site, Folder.parent_id == None).all()
+    assert normalize(serializers.folder_tree(site)) == normalize(FolderSchema(many=True).dump(top))
+    assert normalize(serializers.folder_tree(site, "b")) == normalize(FolderSchema().dump(db.session.get(Folder, "b")))
+
+def test_site_parity(app, site):
+    seed(site)
+    assert normalize(serializers.site_rows(Site.id == site)) == normalize(SiteSchema(many=True).dump(Site.query.all()))
+
+def test_ndjson_listing(client, site, headers):
+    seed(site)
+    response = client.get("/v1/sites/{}/folders/b/files?format=ndjson".format(site), headers=headers)
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()] == ["2"]
@@ -0,0 +1,100 @@
+from flask import g
+from api.models import db, Site, SiteShard, Folder, File, Change
+from api import sharding
+from api.serializers import site_rows
+import sqlalchemy as sa
+
+def seed(site_id):
+    parent = Folder(id="parent", name="parent", site_id=site_id)
+    child = Folder(id="child", name="child", site_id=site_id, parent_id="parent")
+    db.session.add_all([parent, child,
+                        File(id="a", name="a", size=1, site_id=site_id, folder_id="child"),
+                        File(id="b", name="b", size=2, site_id=site_id)])
+    db.session.flush()
+    Change.record(site_id, "create", "a", "child", "a")
+    db.session.commit()
+
+def contents(site_id):
+    return (sorted(db.session.scalars(sa.select(Folder.id).where(Folder.site_id == site_id))),
+            sorted(db.session.scalars(sa.select(File.id).where(File.site_id == site_id))),
+            db.session.scalar(sa.select(sa.func.count()).select_from(Change).where(Change.site_id == site_id)))
+
+def test_move_site_between_shards(app, site, shard):
+    site_id = db.session.get(Site, site).id
+    seed(site_id)
+    seeded = contents(site_id)
+    assert seeded == (["child", "parent"], ["a", "b"], 1)
+
+    assert sharding.move_site(site_id, shard, batch_size=1) == 5
+    assert sharding.shard_of(site_id) == ("b", "active")
+    assert contents(site_id) == ([], [], 0)
+    with sharding.using(shard):
+        assert contents(site_id) == seeded
+    # The site row stays on the primary, where users and memberships point at it.
+    assert db.session.get(Site, site_id).name == "Site"
+    assert site_rows(Site.id == site_id)[0]["file_count"] == 2
+
+    with sharding.using(shard):
+        Change.record(site_id, "delete", "b", None, "b")
+        db.session.commit()
+        assert contents(site_id)[2] == 2
+
+    sharding.move_site(site_id, "default")
+    assert db.session.get(SiteShard, site_id) is None
+    assert contents(site_id) == (["child", "parent"], ["a", "b"], 2)
+    with sharding.using(shard):
+        assert contents(site_id) == ([], [], 0)
+    with sharding.engine(shard).connect() as conn:
+        assert conn.execute(sa.select(Site.id).where(Site.id == site_id)).first() is None
+
+def test_new_sites_are_placed_on_new_site_shard(app, shard, monkeypatch):
+    monkeypatch.setitem(app.config, "NEW_SITE_SHARD", shard)
+    site = Site(name="site")
+    db.session.add(site)
+    sharding.place_site(site)
+    db.session.commit()
+    assert sharding.shard_of(site.id) == ("b", "active")
+    with sharding.using(shard):
+        db.session.add(Folder(id="folder", name="folder", site_id=site.id))
+        db.session.commit()
+    assert contents(site.id)[0] == []
+    assert sharding.group_by_shard([site.id]) == {"b": [site.id]}
+
+def test_requests_reach_the_site_shard(app, client, site, headers, upload, shard):
+    sharding.move_site(db.session.get(Site, site).id, shard)
+    response = upload(b"on b")
+    assert response.status_code == 201
+    assert g.site_shard == "b"
+    file_id = response.json["id"]
+    with sharding.using("default"):
+        assert db.session.get(File, file_id) is None
+    with sharding.using(shard):
+        assert db.session.get(File, file_id).name == "notes.txt"
+        db.session.expunge_all()
+
+    listing = client.get("/v1/sites/{}/files".format(site), headers=headers)
+    assert [file["id"] for file in listing.json] == [file_id]
+
+    token = client.post("/v1/sites/{}/files/{}/shares".format(site, file_id), headers=headers,
+                        json={"max_downloads": 2}).json["token"]
+    g.pop("site_shard")
+    assert client.get("/v1/shares/" + token).get_data() == b"on b"
+
+def test_writes_wait_for_a_move(app, client, site, headers, shard):
+    site_id = db.session.get(Site, site).id
+    db.session.add(SiteShard(site_id=site_id, shard="default", state="moving"))
+    db.session.commit()
+    assert client.get("/v1/sites/" + site, headers=headers).status_code == 200
+    moving = client.post("/v1/sites/{}/folders".format(site), headers=headers, json={"name": "new"})
+    assert moving.status_code == 503
+    assert moving.headers["Retry-After"] == "30"
+
+    # A write that looked the site up before the move started is turned away once it holds the site.
+    db.session.execute(sa.update(SiteShard.__table__).values(state="active"))
+    db.session.commit()
+    with sharding.using("default"):
+        assert sharding.hold_site(site_id, "default")
+        db.session.rollback()
+    sharding.move_site(site_id, shard)
+    assert not sharding.hold_site(site_id, "default")
+    db.session.rollback()
@@ -0,0 +1,56 @@
+import io
+import time
+from api.models import db, Folder, File
+
+def test_file_share(client, site, headers, upload):
+    file_id = upload(b"shared content", "notes.bin").json["id"]
+    response = client.post("/v1/sites/{}/files/{}/shares".format(site, file_id), headers=headers, json={})
+    assert response.status_code == 201
+    token = response.json["token"]
+    assert response.json["url"].endswith("/v1/shares/" + token)
+
+    download = client.get("/v1/shares/" + token)
+    assert download.status_code == 200
+    assert download.get_data() == b"shared content"
+    assert "notes.bin" in download.headers["Content-Disposition"]
+    assert client.get("/v1/shares/" + token[:-2] + "xx").status_code == 404
+
+def test_limits_and_expiry(client, site, headers, upload, monkeypatch):
+    file_id = upload(b"once", "notes.bin").json["id"]
+    url = "/v1/sites/{}/files/{}/shares".format(site, file_id)
+    assert client.post(url, headers=headers, json={"max_downloads": 0}).status_code == 400
+
+    token = client.post(url, headers=headers, json={"max_downloads": 1}).json["token"]
+    assert client.get("/v1/shares/" + token).status_code == 200
+    assert client.get("/v1/shares/" + token).status_code == 410
+
+    token = client.post(url, headers=headers, json={"expires_in": 60}).json["token"]
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert client.get("/v1/shares/" + token).status_code == 410
+
+def test_folder_share(client, site, headers, upload):
+    folder = Folder(name="Shared", site_id=site)
+    db.session.add(folder)
+    db.session.commit()
+    inside = upload(b"inside", "notes.bin", folder.id).json["id"]
+    outside = upload(b"outside", "notes.bin").json["id"]
+    token = client.post("/v1/sites/{}/folders/{}/shares".format(site, folder.id), headers=headers).json["token"]
+
+    assert [f["id"] for f in client.get("/v1/shares/" + token).json] == [inside]
+    assert client.get("/v1/shares/{}/files/{}".format(token, inside)).get_data() == b"inside"
+    assert client.get("/v1/shares/{}/files/{}".format(token, outside)).status_code == 404
+
+def test_file_share_follows_the_row(app, client, site, headers, upload):
+    file_id = upload(b"shared text " * 100, "notes.txt").json["id"]
+    token = client.post("/v1/sites/{}/files/{}/shares".format(site, file_id), headers=headers, json={}).json["token"]
+    result = app.test_cli_runner().invoke(args=["site", "compress", "--encoding", "gzip", site])
+    assert result.exit_code == 0, result.output
+    assert db.session.get(File, file_id).encoding == "gzip"
+    download = client.get("/v1/shares/" + token)
+    assert download.status_code == 200
+    assert download.get_data() == b"shared text " * 100
+
+    client.post("/v1/sites/{}/files/{}/versions".format(site, file_id), headers=headers,
+                content_type="multipart/form-data", data={"file": (io.BytesIO(b"new"), "notes.txt")})
+    assert client.get("/v1/shares/" + token).status_code == 410
@@ -0,0 +1,78 @@
+import os
+import sqlalchemy as sa
+from api.models import db, File
+from api.sniffing import sniff
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+CSV = b"name,size\n" + b"".join(b"file-%d.txt,%d\n" % (i, i) for i in range(100))
+
+def test_sniff_trusts_content_over_name():
+    assert sniff(PNG, "photo.JPG") == ("image/png", ".png")
+    assert sniff(b"\xff\xd8\xff\xe0" + b"\x00" * 16, "photo.JPEG") == ("image/jpeg", ".jpeg")
+    assert sniff(b"%PDF-1.7\n", "report") == ("application/pdf", ".pdf")
+    assert sniff(b"PK\x03\x04" + b"\x00" * 26 + b"word/document.xml", "letter.zip")[1] == ".docx"
+
+def test_sniff_text():
+    assert sniff(b"a,b\n1,2\n", "data.CSV") == ("text/csv", ".csv")
+    assert sniff(b"BMW annual report", "notes") == ("text/plain", ".txt")
+    assert sniff(b"<svg xmlns='http://www.w3.org/2000/svg'/>", "logo.txt") == ("image/svg+xml", ".svg")
+    assert sniff(b"\x00\x01\x02\x03binary", "blob.Dat") == ("application/octet-stream", ".dat")
+
+def test_sniff_never_leaves_the_extension_empty():
+    assert sniff(b"\x7fELF\x02\x01", "tool")[1] == ".bin"
+    assert sniff(b"\x00\x01\x02\x03binary", "blob") == ("application/octet-stream", ".bin")
+    assert sniff(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "") == ("application/x-ole-storage", ".bin")
+    assert sniff(b"", None)[1] == ".bin"
+
+def test_upload_stores_detected_type(client, site, headers, upload):
+    response = upload(PNG, "image.JPG")
+    file = db.session.get(File, response.json["id"])
+    assert (file.mimetype, file.ext, file.size) == ("image/png", ".png", len(PNG))
+    assert file.hash is not None
+
+    download = client.get("/v1/sites/{}/files/{}.PNG".format(site, file.id), headers=headers)
+    assert download.status_code == 200
+    assert download.mimetype == "image/png"
+
+    listing = client.get("/v1/sites/{}/files?type=image".format(site), headers=headers)
+    assert [f["id"] for f in listing.json] == [file.id]
+    assert client.get("/v1/sites/{}/files?type=text/plain".format(site), headers=headers).status_code == 404
+    assert client.get("/v1/sites/{}/files?type=%".format(site), headers=headers).status_code == 404
+    assert client.get("/v1/sites/{}/files?type=_mage".format(site), headers=headers).status_code == 404
+
+def test_sniff_backfill(app, site):
+    folder = os.path.join(app.config["DATA_FOLDER"], site)
+    os.makedirs(folder)
+    with open(os.path.join(folder, "old.JPG"), "wb") as f:
+        f.write(PNG)
+    db.session.add(File(id="old", name="old.JPG", ext=".JPG", mimetype="image/jpeg", site_id=site))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["site", "sniff", site])
+    assert "1 files updated" in result.output, result.output
+    db.session.expire_all()
+    file = db.session.get(File, "old")
+    assert (file.mimetype, file.ext) == ("image/png", ".png")
+    assert os.path.exists(os.path.join(folder, "old.png"))
+
+def test_sniff_backfill_compressed_blob(app, client, site, headers, upload):
+    file_id = upload(CSV, "data.csv").json["id"]
+    runner = app.test_cli_runner()
+    runner.invoke(args=["site", "compress", site, "--encoding", "gzip"])
+    folder = os.path.join(app.config["DATA_FOLDER"], site)
+    assert os.listdir(folder) == [file_id + ".csv.gz"]
+
+    result = runner.invoke(args=["site", "sniff", site])
+    assert "0 files updated" in result.output, result.output
+
+    db.session.execute(sa.update(File).where(File.id == file_id).values(ext=".txt", mimetype="text/plain"))
+    db.session.commit()
+    os.rename(os.path.join(folder, file_id + ".csv.gz"), os.path.join(folder, file_id + ".txt.gz"))
+    result = runner.invoke(args=["site", "sniff", site])
+    assert "1 files updated" in result.output, result.output
+    db.session.expire_all()
+    file = db.session.get(File, file_id)
+    assert (file.mimetype, file.ext, file.encoding) == ("text/csv", ".csv", "gzip")
+    assert os.listdir(folder) == [file_id + ".csv.gz"]
+    download = client.get("/v1/sites/{}/files/{}.csv".format(site, file_id), headers=headers)
+    assert download.get_data() == CSV
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+import os
+
+def test_docs_are_built_on_first_request(client):
+    spec = client.get("/apidocs/apispec_1.json")
+    assert spec.status_code == 200
+    assert "/v1/sites/{site_id}/files" in spec.json["paths"]
+    assert client.get("/apidocs/").status_code == 200
+
+def test_import_does_not_load_docs_or_migrations():
+    probe = "import sys, api.app; print('flasgger' in sys.modules, 'alembic' in sys.modules)"
+    output = subprocess.check_output([sys.executable, "-c", probe], env={"DATABASE_URL": "sqlite://"},
+                                     cwd=os.path.dirname(os.path.dirname(__file__)), text=True)
+    assert output.split() == ["False", "False"]
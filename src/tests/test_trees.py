@@ -0,0 +1,47 @@
+import json
+from flask import g
+from api.models import db, Site, Folder, FolderTree
+from api import serializers, trees
+
+def test_snapshot_is_patched(client, site, headers, upload):
+    url = "/v1/sites/{}/folders".format(site)
+    docs = client.post(url, headers=headers, json={"name": "docs"}).json["id"]
+    first = client.get(url, headers=headers)
+    assert [f["name"] for f in first.json] == ["docs"]
+    version = db.session.get(FolderTree, site).version
+    assert client.get(url, headers=dict(headers, **{"If-None-Match": first.headers["ETag"]})).status_code == 304
+
+    # Writes patch the stored snapshot instead of dropping it.
+    drafts = client.post("{}/{}".format(url, docs), headers=headers, json={"name": "drafts"}).json["id"]
+    upload(b"x", "a.txt", drafts)
+    client.patch("{}/{}".format(url, drafts), headers=headers, json={"parent_id": None, "name": "Drafts"})
+    assert db.session.get(FolderTree, site).version == version + 3
+
+    second = client.get(url, headers=dict(headers, **{"If-None-Match": first.headers["ETag"]}))
+    assert second.status_code == 200
+    nodes = trees.decode(db.session.get(FolderTree, site).data)
+    assert nodes == trees.build(site)
+    assert json.loads(json.dumps(second.json)) == json.loads(serializers.dumps(serializers.folder_tree(site)))
+
+    assert client.delete("{}/{}".format(url, drafts), headers=headers).status_code == 409
+    assert client.delete("{}/{}".format(url, docs), headers=headers).status_code == 200
+    assert client.get("{}/{}".format(url, docs), headers=headers).status_code == 404
+    assert [f["name"] for f in client.get(url, headers=headers).json] == ["Drafts"]
+
+def test_snapshot_is_built_on_the_primary(bound_app):
+    with bound_app.app_context():
+        site = Site(name="lagging")
+        db.session.add(site)
+        db.session.commit()
+        site_id = site.id
+        db.session.add(Folder(id="docs", name="docs", site_id=site_id))
+        db.session.commit()
+
+    # The replica hasn't seen the folder yet, a snapshot built from it would stay without it.
+    with bound_app.test_request_context("/"):
+        g.read_only = True
+        version, data = trees.snapshot(site_id)
+        db.session.commit()
+        assert list(trees.decode(data)) == ["docs"]
+    with bound_app.app_context():
+        assert trees.decode(db.session.get(FolderTree, site_id).data) == {"docs": ["docs", None, 0]}
@@ -0,0 +1,28 @@
+import os
+from api.models import db, File
+
+def test_upload_commits_row_and_blob(app, client, site, headers, upload):
+    response = upload()
+    assert response.status_code == 201
+    new_file = db.session.get(File, response.json["id"])
+    assert new_file.name == "notes.txt"
+    assert os.path.exists(os.path.join(app.config["DATA_FOLDER"], site, new_file.id + ".txt"))
+
+def test_failed_upload_removes_blob(app, client, site, headers, upload, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("database unavailable")
+    monkeypatch.setattr(File, "save_to_db", fail)
+    response = upload()
+    assert response.status_code == 500
+    assert os.listdir(os.path.join(app.config["DATA_FOLDER"], site)) == []
+    assert File.query.count() == 0
+
+def test_failed_rename_is_undone(app, client, site, headers, upload, monkeypatch):
+    file_id = upload().json["id"]
+    def fail(*args):
+        raise RuntimeError("commit failed")
+    monkeypatch.setattr(db.session, "commit", fail)
+    response = client.patch("/v1/sites/{}/files/{}".format(site, file_id), headers=headers, json={"name": "notes.md"})
+    monkeypatch.undo()
+    assert response.status_code == 500
+    assert os.listdir(os.path.join(app.config["DATA_FOLDER"], site)) == [file_id + ".txt"]
@@ -0,0 +1,20 @@
+import os
+
+def test_upload_is_moved_not_copied(app, client, site, headers, upload):
+    response = upload(b"a" * 100000, "big.bin")
+    assert response.status_code == 201
+    blob = os.path.join(app.config["DATA_FOLDER"], site, response.json["id"] + ".bin")
+    assert os.path.getsize(blob) == 100000
+    # The spooled part became the blob, nothing is left behind.
+    assert os.listdir(os.path.join(app.config["DATA_FOLDER"], ".incoming")) == []
+
+def test_upload_limit(app, client, site, headers, upload, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_MAX_SIZE", 1000)
+    response = upload(b"a" * 2000, "big.bin")
+    assert response.status_code == 413
+    assert response.json["error"] == "Payload too large"
+    assert not os.path.exists(os.path.join(app.config["DATA_FOLDER"], ".incoming"))
+
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 10)
+    response = client.post("/v1/sites", headers=headers, json={"name": "A site with a long name"})
+    assert response.status_code == 413
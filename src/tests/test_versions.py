@@ -0,0 +1,65 @@
+import io
+import os
+import random
+from api.models import db, File, FileVersion, Chunk
+from api import versions
+
+def content(seed, size=300 * 1024):
+    return random.Random(seed).randbytes(size)
+
+def upload_version(client, site, headers, file_id, data):
+    return client.post("/v1/sites/{}/files/{}/versions".format(site, file_id), headers=headers,
+                       content_type="multipart/form-data", data={"file": (io.BytesIO(data), "sheet.bin")})
+
+def test_split_is_content_defined():
+    data = content(1, 2 * 1024 * 1024)
+    chunks = list(versions.split([data[i:i + 5000] for i in range(0, len(data), 5000)]))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= versions.MAX_CHUNK_SIZE for c in chunks)
+    edited = list(versions.split([data[:500000] + b"edit" + data[500000:]]))
+    assert len(set(edited) - set(chunks)) <= 2
+
+def test_versions_share_chunks(app, client, site, headers, upload):
+    v1 = content(1)
+    v2 = v1[:100000] + b"changed" + v1[100000:]
+    response = upload(v1, "sheet.bin")
+    file_id = response.json["id"]
+    assert upload_version(client, site, headers, file_id, v2).json["version"] == 2
+    assert upload_version(client, site, headers, file_id, v1 + b"tail").json["version"] == 3
+
+    listing = client.get("/v1/sites/{}/files/{}/versions".format(site, file_id), headers=headers).json
+    assert [(v["number"], v["current"]) for v in listing] == [(1, False), (2, False), (3, True)]
+
+    # v1 and v2 are packed and share most chunks.
+    stored = db.session.query(db.func.sum(Chunk.size)).scalar()
+    assert stored < len(v1) + 100000
+    assert not os.listdir(os.path.join(app.config["DATA_FOLDER"], site, ".versions"))
+
+    url = "/v1/sites/{}/files/{}/versions/{{}}".format(site, file_id)
+    assert client.get(url.format(1), headers=headers).get_data() == v1
+    assert client.get(url.format(2), headers=headers).get_data() == v2
+    assert client.get(url.format(3), headers=headers).get_data() == v1 + b"tail"
+    partial = client.get(url.format(2), headers=dict(headers, Range="bytes=99995-100011"))
+    assert partial.status_code == 206
+    assert partial.get_data() == v2[99995:100012]
+
+    restored = client.post(url.format(2) + "/restore", headers=headers)
+    assert restored.json["version"] == 4
+    assert client.get("/v1/sites/{}/files/{}.bin".format(site, file_id), headers=headers).get_data() == v2
+
+def test_large_versions_packed_later(app, client, site, headers, upload):
+    app.config["VERSIONS_PACK_INLINE"] = 0
+    try:
+        response = upload(content(2), "sheet.bin")
+        file_id = response.json["id"]
+        upload_version(client, site, headers, file_id, content(3))
+        assert FileVersion.query.one().packed is False
+        assert client.get("/v1/sites/{}/files/{}/versions/1".format(site, file_id), headers=headers).get_data() == content(2)
+
+        result = app.test_cli_runner().invoke(args=["site", "pack-versions"])
+        assert "1 versions packed" in result.output, result.output
+        db.session.expire_all()
+        assert FileVersion.query.one().packed is True
+        assert client.get("/v1/sites/{}/files/{}/versions/1".format(site, file_id), headers=headers).get_data() == content(2)
+    finally:
+        app.config["VERSIONS_PACK_INLINE"] = 1024 * 1024